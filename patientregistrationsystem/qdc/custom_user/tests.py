@@ -6,16 +6,19 @@ from django.contrib.auth.tokens import default_token_generator
 from django.contrib.messages import get_messages
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.urlresolvers import reverse, resolve
+from django.db import connection
 from django.shortcuts import get_object_or_404
 from django.template import loader
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.utils.http import int_to_base36
 from django.utils.translation import ugettext as _
 
 from custom_user.models import User, UserProfile, Institution
 from custom_user.tests_helper import create_user
 from custom_user.views import user_update, institution_view, institution_create, institution_update
+from qdc.middleware import PasswordChangeMiddleware
 
 USER_USERNAME = 'myadmin'
 USER_PWD = 'mypassword'
@@ -531,3 +534,49 @@ class PasswordResetTests(TestCase):
         response = self.client.post(
             reverse('login'), data={'username': user.username, 'password': passwd}, follow=True)
         self.assertRedirects(response, reverse('password_change'))
+
+
+class PasswordChangeMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.user, self.passwd = create_user()
+        self.client.login(username=self.user.username, password=self.passwd)
+
+    @staticmethod
+    def profile_queries(queries):
+        return [query for query in queries if UserProfile._meta.db_table in query['sql']]
+
+    def test_profile_is_read_once_per_session(self):
+        with CaptureQueriesContext(connection) as first_request:
+            self.assertEqual(self.client.get(reverse('contact')).status_code, 200)
+        with CaptureQueriesContext(connection) as second_request:
+            self.assertEqual(self.client.get(reverse('contact')).status_code, 200)
+
+        self.assertEqual(len(self.profile_queries(first_request.captured_queries)), 1)
+        self.assertEqual(self.profile_queries(second_request.captured_queries), [])
+        self.assertLess(len(second_request), len(first_request))
+
+    def test_middleware_makes_no_queries_with_the_flag_in_the_session(self):
+        self.client.get(reverse('contact'))
+        request = RequestFactory().get(reverse('contact'))
+        request.user = self.user
+        request.session = self.client.session
+        list(request.session.items())  # Loads the session
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(PasswordChangeMiddleware.process_request(request))
+
+    def test_forced_password_change_redirects_until_the_password_is_changed(self):
+        self.user.set_password('Other!123')
+        self.user.save()
+        self.user.user_profile.force_password_change = True
+        self.user.user_profile.save()
+        self.client.login(username=self.user.username, password='Other!123')
+
+        self.assertRedirects(self.client.get(reverse('contact')), reverse('password_change'))
+
+        self.client.post(reverse('password_change'), {
+            'old_password': 'Other!123', 'new_password1': 'Newpass!123', 'new_password2': 'Newpass!123'})
+
+        self.assertFalse(UserProfile.objects.get(user=self.user).force_password_change)
+        self.assertEqual(self.client.get(reverse('contact')).status_code, 200)
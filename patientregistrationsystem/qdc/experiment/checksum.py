@@ -0,0 +1,33 @@
+"""Checksum of stored files, as used to identify them in the EEG cache and
+in the Portal. The checksum is remembered in the 'default' cache by path,
+size and modification time of the file, so unchanged files are not read
+again to compute it.
+"""
+import hashlib
+import os
+
+from django.core.cache import caches
+
+CHUNK_SIZE = 1024 * 1024
+CHECKSUM_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def file_checksum(file_path):
+    """
+    :param file_path: path of the file
+    :return: SHA-256 of the file
+    """
+    file_stat = os.stat(file_path)
+    key = 'file-checksum-%s-%s-%s' % (
+        hashlib.md5(file_path.encode()).hexdigest(), file_stat.st_size, file_stat.st_mtime_ns)
+
+    checksum = caches['default'].get(key)
+    if checksum is None:
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        checksum = sha256.hexdigest()
+        caches['default'].set(key, checksum, CHECKSUM_TIMEOUT)
+
+    return checksum
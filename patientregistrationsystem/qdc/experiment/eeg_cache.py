@@ -0,0 +1,82 @@
+"""Cache of what is derived from EEG files by MNE: the header of the reading
+(channels, sampling rate, number of samples), whether the file could be read
+in its format and the image of the sensor positions.
+
+Entries are keyed by the EEGFile id and the checksum of its file, so a file
+changed or uploaded again gets new entries. Headers are stored in the
+'default' cache, shared by all processes; files in MEDIA_ROOT/eeg_cache.
+The checksum is computed by experiment.checksum.file_checksum.
+"""
+import os
+import shutil
+from os import path
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .checksum import file_checksum
+
+CACHE_DIRECTORY = 'eeg_cache'
+
+
+def _cache():
+    return caches['default']
+
+
+def make_key(eeg_file, name):
+    """
+    :param eeg_file: EEGFile instance
+    :param name: what is cached, e.g. 'header'
+    :return: cache key including the checksum of the file
+    """
+    return 'eeg-file-%s-%s-%s' % (eeg_file.id, file_checksum(eeg_file.file.path), name)
+
+
+def get_value(eeg_file, name):
+    return _cache().get(make_key(eeg_file, name))
+
+
+def set_value(eeg_file, name, value):
+    _cache().set(make_key(eeg_file, name), value)
+
+
+def get_or_load(eeg_file, name, loader):
+    """Return the value cached for the file, calling loader and caching its
+    result on a cache miss
+    """
+    key = make_key(eeg_file, name)
+    value = _cache().get(key)
+    if value is None:
+        value = loader()
+        _cache().set(key, value)
+
+    return value
+
+
+def get_directory(eeg_file):
+    return path.join(settings.MEDIA_ROOT, CACHE_DIRECTORY, str(eeg_file.id))
+
+
+def get_file_path(eeg_file, filename):
+    """Path of a file derived from the EEG file. Files derived from an older
+    version of the EEG file are removed, as they will not be used again.
+    :param eeg_file: EEGFile instance
+    :param filename: name of the derived file, e.g. 'sensors_position.png'
+    :return: path of the file, that may not exist yet
+    """
+    directory = get_directory(eeg_file)
+    checksum = file_checksum(eeg_file.file.path)
+    os.makedirs(directory, exist_ok=True)
+
+    for cached_filename in os.listdir(directory):
+        if not cached_filename.startswith(checksum):
+            os.remove(path.join(directory, cached_filename))
+
+    return path.join(directory, checksum + '_' + filename)
+
+
+def remove_files(eeg_file):
+    """Remove the files derived from the EEG file, e.g. when it is removed
+    :param eeg_file: EEGFile instance
+    """
+    shutil.rmtree(get_directory(eeg_file), ignore_errors=True)
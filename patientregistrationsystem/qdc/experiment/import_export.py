@@ -1,9 +1,9 @@
 import os
 import shutil
-import sys
 import tempfile
 import json
 import zipfile
+from collections import OrderedDict
 from json import JSONDecodeError
 from os import path
 
@@ -12,30 +12,64 @@ from operator import or_
 
 import networkx as nx
 from django.conf import settings
+from django.core import serializers
 from django.core.files import File
-from django.core.management import call_command
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
 from django.apps import apps
-from django.db.models import Count, Q
+from django.db import connection, transaction
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.utils import timezone
 from django.utils.translation import ugettext as _
-from base64 import b64encode, b64decode
+from simple_history.manager import HistoryManager
 
 from experiment.models import Group, ResearchProject, Experiment, \
-    Keyword, Component, Questionnaire, QuestionnaireResponse, EEGElectrodeLocalizationSystem, FileFormat, Subject
+    Keyword, Component, Questionnaire, QuestionnaireResponse, EEGElectrodeLocalizationSystem, FileFormat, Subject, \
+    DataConfigurationTree
+from experiment import protocol_index
 from experiment.import_export_model_relations import ONE_TO_ONE_RELATION, FOREIGN_RELATIONS, MODEL_ROOT_NODES, \
     EXPERIMENT_JSON_FILES, PATIENT_JSON_FILES, JSON_FILES_DETACHED_MODELS, PRE_LOADED_MODELS_FOREIGN_KEYS, \
     PRE_LOADED_MODELS_INHERITANCE, PRE_LOADED_MODELS_NOT_EDITABLE, PRE_LOADED_PATIENT_MODEL, \
     PRE_LOADED_MODELS_NOT_EDITABLE_INHERITANCE, MODELS_WITH_FILE_FIELD, MODELS_WITH_RELATION_TO_AUTH_USER
-from patient.models import Patient, ClassificationOfDiseases
-from survey.abc_search_engine import Questionnaires
+from patient.models import Patient, PatientCode, PatientSearchToken, ClassificationOfDiseases
+from survey.abc_search_engine import Questionnaires, ConcurrentQuestionnaires
 from survey.models import Survey
 from survey.survey_utils import QuestionnaireUtils
 
 
+def sort_models_by_dependencies(models):
+    """
+    :param models: models of the objects exported or imported
+    :return: models sorted so that each model comes after the models it
+    refers to, when they do not refer to each other
+    """
+    sorted_models = []
+    visiting = set()
+
+    def visit(model):
+        if model in visiting:
+            return
+        visiting.add(model)
+        for field in model._meta.concrete_fields:
+            if field.is_relation and field.related_model in models:
+                visit(field.related_model)
+        sorted_models.append(model)
+
+    for model in models:
+        visit(model)
+
+    return sorted_models
+
+
 class ExportExperiment:
 
     FILE_NAME_JSON = 'experiment.json'
     FILE_NAME_ZIP = 'experiment.zip'
     LIMESURVEY_ERROR = 1
+    BATCH_SIZE = 1000
+    # Models not exported, whose relations are not followed: users are replaced
+    # when importing and classifications of diseases are referred to by code
+    EXCLUDED_MODELS = ('auth.user', 'patient.classificationofdiseases')
 
     def __init__(self, experiment):
         self.experiment = experiment
@@ -44,172 +78,153 @@ class ExportExperiment:
     def __del__(self):
         shutil.rmtree(self.temp_dir)
 
-    def _generate_fixture(self, filename, elements, app='experiment.'):
-        sysout = sys.stdout
-        sys.stdout = open(path.join(self.temp_dir, filename + '.json'), 'w')
-        call_command(
-            'dump_object', app + elements[0], '--query',
-            '{"' + elements[1] + '": ' + str([self.experiment.id]) + '}'
-        )
-        sys.stdout = sysout
-
-    def _generate_detached_fixture(self, filename, elements):
-        with open(path.join(self.temp_dir, elements[3] + '.json')) as file:
-            data = json.load(file)
-        parent_ids = [dict_['pk'] for index, dict_ in enumerate(data) if dict_['model'] == elements[2]]
-
-        sysout = sys.stdout
-        sys.stdout = open(path.join(self.temp_dir, filename + '.json'), 'w')
-        call_command(
-            'dump_object', 'experiment.' + elements[0], '--query', '{"' + elements[1] + '": ' + str(parent_ids) + '}')
-        sys.stdout = sysout
-
-    def _generate_keywords_fixture(self):
-        # Generate fixture to keywords of the research project
-        sysout = sys.stdout
-        sys.stdout = open(path.join(self.temp_dir, 'keywords.json'), 'w')
-        call_command('dump_object', 'experiment.researchproject_keywords', '--query',
-                     '{"researchproject_id__in": ' + str([self.experiment.research_project.id]) + '}')
-        sys.stdout = sysout
-
-    def _remove_auth_user_model_from_json(self):
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON)) as f:
-            data = f.read().replace('\n', '')
-
-        deserialized = json.loads(data)
-        while True:
-            index = next(
-                (index for (index, dict_) in enumerate(deserialized) if dict_['model'] == 'auth.user'),
-                None)
-            if index is None:
-                break
-            del deserialized[index]
-
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON), 'w') as f:
-            f.write(json.dumps(deserialized))
-
-    def _remove_researchproject_keywords_model_from_json(self):
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON)) as f:
-            data = f.read().replace('\n', '')
-
-        deserialized = json.loads(data)
-        indexes = [
-            index for (index, dict_) in enumerate(deserialized)
-            if dict_['model'] == 'experiment.researchproject_keywords'
-        ]
-        for i in sorted(indexes, reverse=True):
-            del (deserialized[i])
-
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON), 'w') as f:
-            f.write(json.dumps(deserialized))
-
-    # TODO: In future, import groups verifying existence of group_codes in the database, not excluding them
-    def _change_group_code_to_null_from_json(self):
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON)) as f:
-            data = f.read().replace('\n', '')
-
-        serialized = json.loads(data)
-        indexes = [index for (index, dict_) in enumerate(serialized) if
-                   dict_['model'] == 'experiment.group']
-        for i in sorted(indexes, reverse=True):
-            serialized[i]['fields']['code'] = None
-
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON), 'w') as f:
-            f.write(json.dumps(serialized))
-
-    def _remove_survey_code(self):
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON)) as f:
-            data = f.read().replace('\n', '')
-
-        serialized = json.loads(data)
-        indexes = [index for (index, dict_) in enumerate(serialized) if
-                   dict_['model'] == 'survey.survey']
-        for i in indexes:
-            serialized[i]['fields']['code'] = ''
-
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON), 'w') as f:
-            f.write(json.dumps(serialized))
-
-    def _update_classification_of_diseases_reference(self):
-        """Change json data exported to replace references to classification
-        of diseases so the reference is to code not to id. We consider that
-        NES instances all share the same classification of diseases data
+    def _add_related_objects(self, pks):
+        """Add to pks the objects that the objects in pks refer to, by foreign
+        keys or many to many fields, and so on, as dump_object does. Relations
+        of EXCLUDED_MODELS are not followed.
+        :param pks: dict of sets of pks of the objects to export by model
+        """
+        new_pks = {model: set(model_pks) for model, model_pks in pks.items()}
+
+        def add(related_model, related_pks):
+            related_pks = set(related_pks) - pks.setdefault(related_model, set())
+            related_pks.discard(None)
+            if related_pks:
+                pks[related_model] |= related_pks
+                new_pks.setdefault(related_model, set()).update(related_pks)
+
+        while new_pks:
+            model, model_pks = new_pks.popitem()
+            if model._meta.label_lower in self.EXCLUDED_MODELS:
+                continue
+            fields = [field for field in model._meta.local_concrete_fields if field.is_relation]
+            model_pks = list(model_pks)
+            for start in range(0, len(model_pks), self.BATCH_SIZE):
+                batch = model_pks[start:start + self.BATCH_SIZE]
+                if fields:
+                    rows = list(
+                        model._base_manager.filter(pk__in=batch).values_list(*[field.attname for field in fields]))
+                    for index, field in enumerate(fields):
+                        add(field.related_model, [row[index] for row in rows])
+                for field in model._meta.many_to_many:
+                    add(field.related_model, field.remote_field.through._base_manager.filter(
+                        **{field.m2m_field_name() + '__in': batch}
+                    ).values_list(field.m2m_reverse_field_name(), flat=True))
+
+    def _collect_objects(self):
+        """
+        :return: dict of sets of pks of the objects to export by model: the ones
+        in EXPERIMENT_JSON_FILES, PATIENT_JSON_FILES and
+        JSON_FILES_DETACHED_MODELS, and the ones they refer to
         """
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON)) as f:
-            data = f.read().replace('\n', '')
+        pks = {}
+        for app, json_files in (('experiment', EXPERIMENT_JSON_FILES), ('patient', PATIENT_JSON_FILES)):
+            for model_name, query in json_files.values():
+                model = apps.get_model(app, model_name)
+                # Many to many relations are exported with the objects that have them
+                if not model._meta.auto_created:
+                    pks.setdefault(model, set()).update(
+                        model._base_manager.filter(**{query: [self.experiment.id]}).values_list('pk', flat=True))
+        self._add_related_objects(pks)
+
+        # Models with multi-table inheritance that are only reached from their parents
+        for model_name, query, parent_model, json_file in JSON_FILES_DETACHED_MODELS.values():
+            parent_pks = list(pks.get(apps.get_model(parent_model), ()))
+            model = apps.get_model('experiment', model_name)
+            pks.setdefault(model, set()).update(
+                model._base_manager.filter(**{query: parent_pks}).values_list('pk', flat=True))
+        self._add_related_objects(pks)
+
+        return pks
+
+    def _write_fixture(self, pks):
+        """Serialize the objects to the json file, model by model after the models
+        they refer to, a batch of objects at a time. On the way, group codes and
+        survey codes are removed, as they must be unique, references to
+        classification of diseases become their codes, that NES instances
+        share, and the files to be added to the zip file are listed.
+        :param pks: dict of sets of pks of the objects to export by model
+        """
+        classification_of_diseases_codes = dict(ClassificationOfDiseases.objects.filter(
+            pk__in=pks.get(ClassificationOfDiseases, ())).values_list('id', 'code'))
+        self.file_paths = []
+
+        serializer = serializers.get_serializer('python')()
+        with open(self.get_file_path('json'), 'w') as f:
+            f.write('[')
+            separator = ''
+            for model in sort_models_by_dependencies(list(pks)):
+                label = model._meta.label_lower
+                if label in self.EXCLUDED_MODELS or model._meta.auto_created:
+                    continue
+                model_pks = sorted(pks[model])
+                for start in range(0, len(model_pks), self.BATCH_SIZE):
+                    queryset = model._base_manager.filter(
+                        pk__in=model_pks[start:start + self.BATCH_SIZE]
+                    ).order_by('pk').prefetch_related(*[
+                        field.name for field in model._meta.many_to_many
+                        if field.remote_field.through._meta.auto_created
+                    ])
+                    for dict_ in serializer.serialize(queryset):
+                        # TODO: In future, import groups verifying existence of group_codes in the database,
+                        #  not excluding them
+                        if label == 'experiment.group':
+                            dict_['fields']['code'] = None
+                        elif label == 'survey.survey':
+                            dict_['fields']['code'] = ''
+                            dict_['fields']['completion_synced_at'] = None
+                        elif label == 'patient.diagnosis':
+                            # Natural key in dumped data has to be a list
+                            dict_['fields']['classification_of_diseases'] = [
+                                classification_of_diseases_codes[dict_['fields']['classification_of_diseases']]
+                            ]
+                        if label in MODELS_WITH_FILE_FIELD and dict_['fields'][MODELS_WITH_FILE_FIELD[label]]:
+                            # Relative to MEDIA_ROOT
+                            self.file_paths.append(dict_['fields'][MODELS_WITH_FILE_FIELD[label]])
 
-        serialized = json.loads(data)
-        indexes = [index for (index, dict_) in enumerate(serialized) if dict_['model'] == 'patient.diagnosis']
-        for index in indexes:
-            pk = serialized[index]['fields']['classification_of_diseases']
-            code = ClassificationOfDiseases.objects.get(id=int(pk)).code
-            # Make a list with one element as natural key in dumped data has to be a list
-            serialized[index]['fields']['classification_of_diseases'] = [code]
-
-        # Remove ClassificationOfDiseases items: these data are preloaded in database
-        while True:
-            index = next(
-                (index for (index, dict_) in enumerate(serialized) if dict_['model'] ==
-                 'patient.classificationofdiseases'), None)
-            if index is None:
-                break
-            del serialized[index]
-
-        with open(path.join(self.temp_dir, self.FILE_NAME_JSON), 'w') as f:
-            f.write(json.dumps(serialized))
-
-    def get_indexes(self, app, model):
-        with open(self.get_file_path('json')) as f:
-            data = json.load(f)
-        return [index for (index, dict_) in enumerate(data) if dict_['model'] == app + '.' + model]
+                        f.write(separator)
+                        json.dump(dict_, f, cls=DjangoJSONEncoder)
+                        separator = ', '
+            f.write(']')
 
     def _export_surveys(self):
-        """Export experiment surveys archives using LimeSurvey RPC API.
+        """Export experiment surveys archives using LimeSurvey RPC API, at the
+        same time (see ConcurrentQuestionnaires), each archive written to disk
+        as it is decoded.
         :return: list of survey archive paths
         """
         questionnaire_ids = Questionnaire.objects.filter(
             experiment=self.experiment).values_list('survey_id', flat=True)
-        surveys = Survey.objects.filter(id__in=questionnaire_ids)
-        ls_interface = Questionnaires(settings.LIMESURVEY['URL_API'] +
-                                      '/index.php/plugins/unsecure?plugin=extendRemoteControl&function=action')
+        lime_survey_ids = Survey.objects.filter(id__in=questionnaire_ids).values_list('lime_survey_id', flat=True)
+        ls_interface = ConcurrentQuestionnaires(
+            settings.LIMESURVEY['URL_API'] + '/index.php/plugins/unsecure?plugin=extendRemoteControl&function=action')
         if ls_interface.session_key is None:
             return self.LIMESURVEY_ERROR, _('Could not export LimeSurvey data. Please try again. If problem persists '
                                             'please contact the system administator')
-        archive_paths = []
-        for survey in surveys:
-            result = ls_interface.export_survey(survey.lime_survey_id)
-            if result is None:
-                return self.LIMESURVEY_ERROR, _(
-                    'Could not export LimeSurvey data. Please try again. If problem persists '
-                    'please contact the system administator')
-            decoded_archive = b64decode(result)
-            lsa_archive_path = os.path.join(self.temp_dir, str(survey.lime_survey_id) + '.lsa')
-            lsa_archive = open(lsa_archive_path, 'wb')
-            lsa_archive.write(decoded_archive)
-            archive_paths.append(lsa_archive_path)
+        archive_paths = ls_interface.gather(
+            ('export_survey_to_file', lime_survey_id, os.path.join(self.temp_dir, str(lime_survey_id) + '.lsa'))
+            for lime_survey_id in lime_survey_ids
+        )
+        if None in archive_paths:
+            return self.LIMESURVEY_ERROR, _(
+                'Could not export LimeSurvey data. Please try again. If problem persists '
+                'please contact the system administator')
 
         ls_interface.release_session_key()
 
-        return archive_paths if archive_paths else []  # TODO (NES_956): return empty list?
+        return archive_paths
 
     def _create_zip_file(self, survey_archives):
         """Create zip file with experiment.json file and subdirs corresponding
         to file paths from models that have FileField fields
         :param survey_archives: list of survey archive paths
         """
-        with open(self.get_file_path('json')) as f:
-            data = json.load(f)
-
-        indexes = [index for index, dict_ in enumerate(data) if dict_['model'] in MODELS_WITH_FILE_FIELD]
         with zipfile.ZipFile(self.get_file_path(), 'w') as zip_file:
             zip_file.write(self.get_file_path('json').encode('utf-8'), self.FILE_NAME_JSON)
             # Append file subdirs
-            for index in indexes:
-                # Relative to MEDIA_ROOT
-                relative_filepath = data[index]['fields'][MODELS_WITH_FILE_FIELD[data[index]['model']]]
-                if relative_filepath is not '':
-                    absolute_filepath = path.join(settings.MEDIA_ROOT, relative_filepath)
-                    zip_file.write(absolute_filepath, relative_filepath)
+            for relative_filepath in self.file_paths:
+                absolute_filepath = path.join(settings.MEDIA_ROOT, relative_filepath)
+                zip_file.write(absolute_filepath, relative_filepath)
             # Append limesurvey archives if they exist
             if isinstance(survey_archives, tuple):  # There was an error
                 return survey_archives
@@ -224,31 +239,11 @@ class ExportExperiment:
             return path.join(self.temp_dir, self.FILE_NAME_JSON)
 
     def export_all(self):
-        for key, value in EXPERIMENT_JSON_FILES.items():
-            self._generate_fixture(key, value)
-        for key, value in PATIENT_JSON_FILES.items():
-            self._generate_fixture(key, value, 'patient.')
-        for key, value in JSON_FILES_DETACHED_MODELS.items():
-            self._generate_detached_fixture(key, value)
-        self._generate_keywords_fixture()
-
-        fixtures = []
-        for filename in {**EXPERIMENT_JSON_FILES, **PATIENT_JSON_FILES, **JSON_FILES_DETACHED_MODELS}:
-            fixtures.append(path.join(self.temp_dir, filename + '.json'))
-
-        sysout = sys.stdout
-        sys.stdout = open(path.join(self.temp_dir, self.FILE_NAME_JSON), 'w')
-        call_command('merge_fixtures', *fixtures)
-        sys.stdout = sysout
-
-        self._remove_researchproject_keywords_model_from_json()
-        self._change_group_code_to_null_from_json()
-        self._remove_survey_code()
-        self._update_classification_of_diseases_reference()
-        self._remove_auth_user_model_from_json()
+        pks = self._collect_objects()
+        self._write_fixture(pks)
 
         result = []
-        if self.get_indexes('experiment', 'questionnaire'):
+        if pks.get(Questionnaire):
             result = self._export_surveys()
         return self._create_zip_file(result)
 
@@ -257,6 +252,7 @@ class ImportExperiment:
     BAD_JSON_FILE_ERROR_CODE = 1
     LIMESURVEY_ERROR = 2
     FIXTURE_FILE_NAME = 'experiment.json'
+    BATCH_SIZE = 1000
 
     def __init__(self, file_path):
         self.file_path = file_path
@@ -298,6 +294,34 @@ class ImportExperiment:
         for i, component in enumerate(components):
             components[i]['human_readable'] = str(human_readables[component['component_type']])
 
+    def _update_data_configuration_tree_paths(self):
+        """Paths of the data configuration trees have the ids of the component
+        configurations, that were changed by _manage_pks, or are empty in
+        exports made before the paths. They are computed again from the roots
+        down and updated in batches.
+        """
+        imported = [item['pk'] for item in self.data if item['model'] == 'experiment.dataconfigurationtree']
+        children = {}
+        for pk, parent_id, component_configuration_id in DataConfigurationTree.objects.filter(
+                pk__in=imported).values_list('pk', 'parent_id', 'component_configuration_id'):
+            children.setdefault(parent_id, []).append((pk, component_configuration_id))
+
+        paths = {}
+        pending = [(pk, '/%s/' % component_configuration_id) for pk, component_configuration_id in
+                   children.get(None, [])]
+        while pending:
+            pk, tree_path = pending.pop()
+            paths[pk] = tree_path
+            pending.extend(
+                (child_pk, '%s%s/' % (tree_path, component_configuration_id))
+                for child_pk, component_configuration_id in children.get(pk, []))
+
+        pks = list(paths)
+        for start in range(0, len(pks), self.BATCH_SIZE):
+            batch = pks[start:start + self.BATCH_SIZE]
+            DataConfigurationTree.objects.filter(pk__in=batch).update(path=Case(
+                *[When(pk=pk, then=Value(paths[pk])) for pk in batch], output_field=CharField()))
+
     def _collect_new_objects(self):
         """Collect new objects to display to user some main objects that was
         imported
@@ -372,18 +396,10 @@ class ImportExperiment:
     def _update_patients_stuff(self, patients_to_update):
         indexes = [index for (index, dict_) in enumerate(self.data) if dict_['model'] == 'patient.patient']
 
-        # Update patient codes
-        # TODO (Refactor): Patient model has function to generate random patient code
-        patients = Patient.objects.all()
-        if patients:
-            last_patient_code = patients.order_by('-code').first().code
-            if last_patient_code:
-                numerical_part_code = int(last_patient_code.split('P')[1])
-                next_numerical_part = numerical_part_code + 1
-                for i in indexes:
-                    if str(self.data[i]['pk']) not in patients_to_update:
-                        self.data[i]['fields']['code'] = 'P' + str(next_numerical_part)
-                        next_numerical_part += 1
+        # Update patient codes, taking them from the pool of codes as Patient.save does
+        new_patient_indexes = [i for i in indexes if str(self.data[i]['pk']) not in patients_to_update]
+        for i, code in zip(new_patient_indexes, PatientCode.reserve(len(new_patient_indexes))):
+            self.data[i]['fields']['code'] = code
 
         for i in indexes:
             if str(self.data[i]['pk']) not in patients_to_update:
@@ -515,7 +531,7 @@ class ImportExperiment:
         """For objects in fixtures initially loaded, check if the objects
         that are to be are already there. This is to avoid duplication of that objects.
         The objects checked here are the ones that can be edited. Objects that are not
-        editable are simply ignored when updating indexes in _update_pks method.
+        editable are simply ignored when updating indexes in _manage_pks method.
         """
         self._deal_with_models_with_unique_fields()
 
@@ -669,100 +685,204 @@ class ImportExperiment:
                             last_id = last_model_id if last_id < last_model_id else last_id
         return last_id + 1
 
-    def _update_pks(self, digraph, successor, next_id):
-        """Recursive function to update models pks based on a directed graph representing
-        model relations
-        """
-        if self.data[successor]['model'] not in ONE_TO_ONE_RELATION and not digraph.node[successor]['pre_loaded']:
-            if not digraph.node[successor]['updated']:
-                self.data[successor]['pk'] = next_id
-
-                # Patch for repeated next_id in same models
-                model = self.data[successor]['model']
-                updated_ids = [dict_['pk'] for (index, dict_) in enumerate(self.data) if dict_['model'] == model]
-                if next_id in updated_ids:
-                    # Prevent from duplicated pks in same model: this is done in the recursive path
-                    # TODO: verify better way to update next_id
-                    next_id = max(updated_ids) + 1
-                    self.data[successor]['pk'] = next_id
-                digraph.node[successor]['updated'] = True
-        for predecessor in digraph.predecessors(successor):
-            if 'relation' in digraph[predecessor][successor]:
-                relation = digraph[predecessor][successor]['relation']
-                self.data[predecessor]['fields'][relation] = self.data[successor]['pk']
-            else:
-                self.data[predecessor]['pk'] = self.data[successor]['pk']
-            next_id += 1
-            self._update_pks(digraph, predecessor, next_id)
+    def _build_indexes(self):
+        """Map (model, pk) of each object of the fixture to its index in self.data"""
+        return {(dict_['model'], dict_['pk']): index for index, dict_ in enumerate(self.data)}
 
     def _build_digraph(self):
+        """Build a directed graph with an edge from each object to the objects
+        it refers to: by a foreign key, with the field in 'relation', or by
+        being a multi-table inheritance child of it, without 'relation'
+        """
+        indexes = self._build_indexes()
         digraph = nx.DiGraph()
         for index_from, dict_ in enumerate(self.data):
+            if dict_['model'] in MODEL_ROOT_NODES:
+                digraph.add_node(index_from)
             if dict_['model'] in FOREIGN_RELATIONS:
-                node_from = dict_['model']
-                nodes_to = FOREIGN_RELATIONS[node_from]
-                for node_to in nodes_to:
-                    index_to = next(
-                        (index_foreign for index_foreign, dict_foreign in enumerate(self.data)
-                         if dict_foreign['model'] == node_to[0] and dict_foreign['pk'] == dict_['fields'][node_to[1]]),
-                        None)
+                for node_to in FOREIGN_RELATIONS[dict_['model']]:
+                    if not node_to[0]:
+                        continue
+                    foreign_pk = dict_['fields'].get(node_to[1])
+                    # Natural keys (lists) do not refer to objects of the fixture
+                    if foreign_pk is None or isinstance(foreign_pk, list):
+                        continue
+                    index_to = indexes.get((node_to[0], foreign_pk))
                     if index_to is not None:
                         digraph.add_edge(index_from, index_to)
                         digraph[index_from][index_to]['relation'] = node_to[1]
             if dict_['model'] in ONE_TO_ONE_RELATION:
-                node_from = dict_['model']
-                node_to = ONE_TO_ONE_RELATION[node_from]
-                index_to = next(
-                    (index_inheritade for index_inheritade, dict_inheritade in enumerate(self.data)
-                     if dict_inheritade['model'] == node_to and dict_inheritade['pk'] == dict_['pk']),
-                    None
-                )
+                index_to = indexes.get((ONE_TO_ONE_RELATION[dict_['model']], dict_['pk']))
                 if index_to is not None:
                     digraph.add_edge(index_from, index_to)
 
         for node in digraph.nodes():
-            digraph.node[node]['atributes'] = self.data[node]
-            digraph.node[node]['updated'] = False
-            if self.data[node]['model'] not in PRE_LOADED_MODELS_NOT_EDITABLE:
-                digraph.node[node]['pre_loaded'] = False
-            else:
-                digraph.node[node]['pre_loaded'] = True
+            digraph.node[node]['pre_loaded'] = self.data[node]['model'] in PRE_LOADED_MODELS_NOT_EDITABLE
 
         # set digraph.node[node]['pre_loaded'] == True for models inherited
         nodes = [
             node for node in digraph.nodes if self.data[node]['model'] in PRE_LOADED_MODELS_NOT_EDITABLE_INHERITANCE
         ]
         for node in nodes:
-            model_inheritances = PRE_LOADED_MODELS_NOT_EDITABLE_INHERITANCE[self.data[node]['model']]
-            for model in model_inheritances:
-                node_inheritance = next(node_inheritance for node_inheritance in digraph.nodes if self.data[node_inheritance]['model'] == model and
-                                        self.data[node]['pk'] == self.data[node_inheritance]['pk'])
-                digraph.node[node_inheritance]['pre_loaded'] = True
+            for model in PRE_LOADED_MODELS_NOT_EDITABLE_INHERITANCE[self.data[node]['model']]:
+                node_inheritance = indexes.get((model, self.data[node]['pk']))
+                if node_inheritance in digraph:
+                    digraph.node[node_inheritance]['pre_loaded'] = True
 
         return digraph
 
     def _manage_pks(self, digraph):
-        next_id = self._get_first_available_id()
-        for model_root_node in MODEL_ROOT_NODES:
-            root_nodes = [index for index, dict_ in enumerate(self.data) if dict_['model'] == model_root_node]
-            for root_node in root_nodes:
-                self._update_pks(digraph, root_node, next_id)
-                next_id += 1
-
-    def _upload_files(self):
-        indexes = [index for index, dict_ in enumerate(self.data) if dict_['model'] in MODELS_WITH_FILE_FIELD]
-        with zipfile.ZipFile(self.file_path) as zip_file:
-            for index in indexes:
-                relative_path = self.data[index]['fields'][MODELS_WITH_FILE_FIELD[self.data[index]['model']]]
-                if relative_path:
-                    file_path = zip_file.extract(relative_path, self.temp_dir)
-                    app_model = self.data[index]['model'].split('.')
-                    model_class = apps.get_model(app_model[0], app_model[1])
-                    object_imported = model_class.objects.get(id=self.data[index]['pk'])
-                    with File(open(file_path, 'rb')) as f:
-                        file_field = MODELS_WITH_FILE_FIELD[self.data[index]['model']]
-                        getattr(object_imported, file_field).save(path.basename(file_path), f)
-                        object_imported.save()
+        """Give new pks to the objects that depend on root nodes (MODEL_ROOT_NODES)
+        and update the references to them, in one pass over the objects in
+        topological order: the objects an object refers to get their new pks
+        before it. Multi-table inheritance children get the pk of their parents;
+        pre loaded objects that can not be edited keep their pks. New pks are
+        unique in each model and greater than the ids in the database.
+        """
+        roots = [
+            node for node in digraph.nodes if self.data[node]['model'] in MODEL_ROOT_NODES
+        ]
+        # Objects that refer, directly or not, to a root node
+        reached = set(roots)
+        stack = list(roots)
+        while stack:
+            for predecessor in digraph.predecessors(stack.pop()):
+                if predecessor not in reached:
+                    reached.add(predecessor)
+                    stack.append(predecessor)
+
+        def gets_new_pk(node):
+            return node in reached and self.data[node]['model'] not in ONE_TO_ONE_RELATION \
+                and not digraph.node[node]['pre_loaded']
+
+        # Next pk of each model, above the pks that are kept
+        first_available_id = self._get_first_available_id()
+        next_pks = {}
+        for index, dict_ in enumerate(self.data):
+            if not (index in digraph and gets_new_pk(index)) and isinstance(dict_['pk'], int):
+                next_pks[dict_['model']] = max(next_pks.get(dict_['model'], first_available_id), dict_['pk'] + 1)
+
+        for node in reversed(list(nx.topological_sort(digraph))):
+            if node not in reached:
+                continue
+            if gets_new_pk(node):
+                model = self.data[node]['model']
+                self.data[node]['pk'] = next_pks.get(model, first_available_id)
+                next_pks[model] = self.data[node]['pk'] + 1
+            for successor in digraph.successors(node):
+                if 'relation' in digraph[node][successor]:
+                    self.data[node]['fields'][digraph[node][successor]['relation']] = self.data[successor]['pk']
+                else:
+                    self.data[node]['pk'] = self.data[successor]['pk']
+
+    def _upload_file(self, zip_file, instance, file_field):
+        """Store the file of the object, extracted from the zip file, before
+        the object is inserted
+        """
+        relative_path = getattr(instance, file_field).name
+        if relative_path:
+            file_path = zip_file.extract(relative_path, self.temp_dir)
+            with File(open(file_path, 'rb')) as f:
+                getattr(instance, file_field).save(path.basename(file_path), f, save=False)
+
+    @staticmethod
+    def _create_historical_records(model, pks, user):
+        """Create the history of the objects imported in bulk, as if each one
+        had been created by user
+        """
+        history_model = model.history.model
+        fields = [field.attname for field in history_model._meta.fields if not field.name.startswith('history_')]
+        history_date = timezone.now()
+        history_model.objects.bulk_create([
+            history_model(
+                history_date=history_date, history_type='+', history_user=user,
+                **{field: getattr(instance, field) for field in fields}
+            ) for instance in model._base_manager.filter(pk__in=pks)
+        ], batch_size=ImportExperiment.BATCH_SIZE)
+
+    def _insert_objects(self, create_history=False, user=None):
+        """Insert the objects of the fixture, model by model after the models
+        they refer to, in one transaction. Files are stored before their objects
+        are inserted. Objects already in the database, objects of models with
+        multi-table inheritance, which can not be inserted in bulk, and objects
+        of models with auto_now/auto_now_add fields, which bulk_create would set
+        to the time of the import, are saved one by one in raw mode, as loaddata
+        does.
+        :param create_history: create the history of the models with
+        HistoricalRecords, which loaddata does not create
+        :param user: user of the history
+        """
+        objects = OrderedDict()
+        for deserialized_object in serializers.deserialize('python', self.data):
+            objects.setdefault(type(deserialized_object.object), []).append(deserialized_object)
+
+        models = sort_models_by_dependencies(list(objects))
+        inserted_pks = {}
+        with zipfile.ZipFile(self.file_path) as zip_file, transaction.atomic():
+            with connection.constraint_checks_disabled():
+                for model in models:
+                    file_field = MODELS_WITH_FILE_FIELD.get(model._meta.label_lower)
+                    if file_field:
+                        for deserialized_object in objects[model]:
+                            self._upload_file(zip_file, deserialized_object.object, file_field)
+
+                    # Pre loaded objects kept with their pks in the database are updated, as loaddata does
+                    existing_pks = set(model._base_manager.filter(
+                        pk__in=[deserialized_object.object.pk for deserialized_object in objects[model]]
+                    ).values_list('pk', flat=True))
+                    save_one_by_one = bool(model._meta.parents) or any(
+                        getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+                        for field in model._meta.concrete_fields
+                    )
+                    new_objects = []
+                    for deserialized_object in objects[model]:
+                        if deserialized_object.object.pk in existing_pks or save_one_by_one:
+                            deserialized_object.save()
+                        else:
+                            new_objects.append(deserialized_object)
+                    inserted_pks[model] = [
+                        deserialized_object.object.pk for deserialized_object in objects[model]
+                        if deserialized_object.object.pk not in existing_pks
+                    ]
+                    if not new_objects:
+                        continue
+
+                    model._base_manager.bulk_create(
+                        [deserialized_object.object for deserialized_object in new_objects],
+                        batch_size=self.BATCH_SIZE)
+                    for field in model._meta.many_to_many:
+                        through = field.remote_field.through
+                        if not through._meta.auto_created:
+                            continue
+                        through.objects.bulk_create([
+                            through(**{
+                                field.m2m_field_name() + '_id': deserialized_object.object.pk,
+                                field.m2m_reverse_field_name() + '_id': related_pk
+                            })
+                            for deserialized_object in new_objects
+                            for related_pk in deserialized_object.m2m_data.get(field.name, [])
+                        ], batch_size=self.BATCH_SIZE)
+
+            connection.check_constraints(table_names=[model._meta.db_table for model in models])
+
+            # Patients inserted in bulk are not indexed by Patient post_save signal
+            if inserted_pks.get(Patient):
+                PatientSearchToken.index_patients(Patient.objects.filter(pk__in=inserted_pks[Patient]))
+
+            if create_history:
+                for model in models:
+                    if isinstance(getattr(model, 'history', None), HistoryManager):
+                        self._create_historical_records(model, inserted_pks[model], user)
+
+            # Objects were inserted with their pks
+            sequence_sql = connection.ops.sequence_reset_sql(no_style(), models)
+            if sequence_sql:
+                with connection.cursor() as cursor:
+                    for line in sequence_sql:
+                        cursor.execute(line)
+
+        # Objects inserted in bulk send no signals
+        protocol_index.clear()
 
     def _get_indexes(self, app, model):
         # TODO (NES-956): disseminate to rest of the script
@@ -870,42 +990,48 @@ class ImportExperiment:
         return result
 
     def _import_limesurvey_surveys(self):
-        """Import surveys to Limesurvey server
+        """Import surveys to Limesurvey server, at the same time (see
+        ConcurrentQuestionnaires)
         :return: list of limsurvey surveys imported
         """
         result = 0, ''
-        ls_interface = Questionnaires()
+        ls_interface = ConcurrentQuestionnaires()
         if ls_interface.session_key is None:
             result = self.LIMESURVEY_ERROR, _('Could not import survey(s) to LimeSurvey. Only Experiment data was '
                                               'imported. You can remove experiment imported and try again. If problem '
                                               'persists please contact system administrator')
             return result
-        limesurvey_ids = []
         # Does not add try/exception trying to open zipfile here because it
         # was done in import_all method
         with zipfile.ZipFile(self.file_path) as zip_file:
-            for old_ls_id, dummy_ls_id in self.limesurvey_relations.items():
-                survey_archivename = str(old_ls_id) + '.lsa'
-                if survey_archivename in zip_file.namelist():
-                    survey_archive = zip_file.extract(survey_archivename, self.temp_dir)
-                    with open(survey_archive, 'rb') as file:
-                        encoded_string = b64encode(file.read())
-                        encoded_string = encoded_string.decode('utf-8')
-                        new_ls_id = ls_interface.import_survey(encoded_string)
-                        if new_ls_id is None:
-                            result = self.LIMESURVEY_ERROR, _('Could not import survey(s) to LimeSurvey. Only '
-                                                              'Experiment data was imported. You can remove experiment '
-                                                              'imported and try again. If problem persists please '
-                                                              'contact system administrator')
-                            return result
-                        survey = Survey.objects.get(lime_survey_id=dummy_ls_id)
-                        survey.lime_survey_id = new_ls_id
-                        survey.save()
-                        limesurvey_ids.append(new_ls_id)
-                else:
-                    # TODO (NES-956): add information that was not a survey archive
-                    #  to this survey
-                    continue
+            survey_archivenames = zip_file.namelist()
+            # TODO (NES-956): add information that was not a survey archive
+            #  to the surveys without archive
+            limesurvey_relations = [
+                (old_ls_id, dummy_ls_id) for old_ls_id, dummy_ls_id in self.limesurvey_relations.items()
+                if str(old_ls_id) + '.lsa' in survey_archivenames
+            ]
+            survey_archives = [
+                zip_file.extract(str(old_ls_id) + '.lsa', self.temp_dir) for old_ls_id, dummy_ls_id in
+                limesurvey_relations
+            ]
+
+        new_ls_ids = ls_interface.gather(
+            ('import_survey_from_file', survey_archive) for survey_archive in survey_archives)
+
+        limesurvey_ids = []
+        for (old_ls_id, dummy_ls_id), new_ls_id in zip(limesurvey_relations, new_ls_ids):
+            if new_ls_id is not None:
+                survey = Survey.objects.get(lime_survey_id=dummy_ls_id)
+                survey.lime_survey_id = new_ls_id
+                survey.save()
+                limesurvey_ids.append(new_ls_id)
+        if None in new_ls_ids:
+            result = self.LIMESURVEY_ERROR, _('Could not import survey(s) to LimeSurvey. Only '
+                                              'Experiment data was imported. You can remove experiment '
+                                              'imported and try again. If problem persists please '
+                                              'contact system administrator')
+            return result
 
         if limesurvey_ids:
             result = self._remove_limesurvey_participants()
@@ -914,7 +1040,7 @@ class ImportExperiment:
 
         return result
 
-    def import_all(self, request, research_project_id=None, patients_to_update=None):
+    def import_all(self, request, research_project_id=None, patients_to_update=None, create_history=False):
         # TODO: maybe this try in constructor
         try:
             with zipfile.ZipFile(self.file_path) as zip_file:
@@ -930,14 +1056,11 @@ class ImportExperiment:
         self._manage_pks(digraph)
         self._update_data_before_importing(request, research_project_id, patients_to_update)
 
-        with open(path.join(self.temp_dir, self.FIXTURE_FILE_NAME), 'w') as file:
-            file.write(json.dumps(self.data))
-
-        call_command('loaddata', path.join(self.temp_dir, self.FIXTURE_FILE_NAME))
+        self._insert_objects(create_history, request.user)
+        self._update_data_configuration_tree_paths()
 
         self._collect_new_objects()
 
-        self._upload_files()
         result = self._import_limesurvey_surveys()
 
         return result
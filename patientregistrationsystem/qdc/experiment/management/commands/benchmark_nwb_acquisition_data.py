@@ -0,0 +1,34 @@
+import time
+
+import mne
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from experiment.views import get_nwb_acquisition_data
+
+
+class Command(BaseCommand):
+    help = 'Time the NWB acquisition data of a synthetic EGI reading (129 EEG channels) ' \
+           'against building it sample by sample'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=int, default=600, help='Seconds of the reading')
+        parser.add_argument('--sampling-rate', type=int, default=250, help='Sampling rate of the reading')
+
+    def handle(self, *args, **options):
+        channel_names = ['E%d' % index for index in range(1, 129)] + ['Vertex Reference', 'STI 014']
+        info = mne.create_info(channel_names, options['sampling_rate'], 129 * ['eeg'] + ['stim'])
+        data = np.random.RandomState(0).randn(len(channel_names), options['seconds'] * options['sampling_rate'])
+        raw = mne.io.RawArray(data * 1e-5, info, verbose=False)
+
+        start = time.perf_counter()
+        array_data = get_nwb_acquisition_data(raw)
+        self.stdout.write('At once: %.3f s for %d samples' % (time.perf_counter() - start, len(array_data)))
+
+        picks = mne.pick_types(raw.info, eeg=True)
+        start = time.perf_counter()
+        by_sample = np.zeros((raw._data.shape[1], len(picks)))
+        for index_channel, pick in enumerate(picks):
+            for index, value in enumerate(raw._data[pick]):
+                by_sample[index][index_channel] = value
+        self.stdout.write('Sample by sample: %.3f s' % (time.perf_counter() - start))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_data_configuration_tree_path(apps, schema_editor):
+    data_configuration_tree_model = apps.get_model('experiment', 'dataconfigurationtree')
+
+    nodes = {
+        node_id: (parent_id, component_configuration_id)
+        for node_id, parent_id, component_configuration_id in data_configuration_tree_model.objects.values_list(
+            'id', 'parent_id', 'component_configuration_id')
+    }
+    paths = {}
+
+    def get_path(node_id):
+        if node_id not in paths:
+            parent_id, component_configuration_id = nodes[node_id]
+            paths[node_id] = (get_path(parent_id) if parent_id else '/') + '%s/' % component_configuration_id
+        return paths[node_id]
+
+    for node_id in nodes:
+        data_configuration_tree_model.objects.filter(id=node_id).update(path=get_path(node_id))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiment', '0006_auto_20190329_1627'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataconfigurationtree',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=1000),
+        ),
+        migrations.RunPython(fill_data_configuration_tree_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('experiment', '0007_dataconfigurationtree_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortalSentObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('portal_id', models.IntegerField(null=True)),
+                ('schedule_of_sending', models.ForeignKey(
+                    null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sent_objects',
+                    to='experiment.ScheduleOfSending')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='portalsentobject',
+            unique_together=set([('schedule_of_sending', 'key')]),
+        ),
+        # unique_together does not apply to the objects shared by the
+        # schedules, whose schedule_of_sending is null
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX experiment_portalsentobject_shared_key '
+            'ON experiment_portalsentobject ("key") WHERE schedule_of_sending_id IS NULL',
+            'DROP INDEX experiment_portalsentobject_shared_key',
+        ),
+    ]
@@ -4,6 +4,8 @@ import datetime
 from os import path
 
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
@@ -1165,9 +1167,44 @@ class DataConfigurationTree(models.Model):
         ComponentConfiguration, on_delete=models.PROTECT)
     parent = models.ForeignKey('self', null=True, related_name='children')
     code = models.IntegerField(null=True, blank=True)
+    # Ids of the component configurations from the root of the tree, e.g.
+    # '/3/8/15/', so that a tree is found by its path in one query
+    path = models.CharField(max_length=1000, db_index=True, blank=True, default='')
+
+    @staticmethod
+    def make_path(list_of_path):
+        """
+        :param list_of_path: ids of the component configurations from the root
+        :return: value of the path field
+        """
+        return '/' + ''.join('%s/' % component_configuration_id for component_configuration_id in list_of_path)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DataConfigurationTree, cls).from_db(db, field_names, values)
+        instance._saved_path = (instance.parent_id, instance.component_configuration_id, instance.path)
+        return instance
 
     def save(self, *args, **kwargs):
+        # (parent, component configuration, path) as in the database
+        saved_path = getattr(self, '_saved_path', None)
+        if saved_path is None or saved_path[:2] != (self.parent_id, self.component_configuration_id):
+            self.path = (self.parent.path if self.parent_id else '/') + '%s/' % self.component_configuration_id
         super(DataConfigurationTree, self).save(*args, **kwargs)
+
+        # Descendants keep the path of this tree as prefix. Other trees may
+        # have the same path, so the descendants are found level by level.
+        if saved_path is not None and saved_path[2] and saved_path[2] != self.path:
+            descendant_ids = []
+            parent_ids = [self.pk]
+            while parent_ids:
+                parent_ids = list(
+                    DataConfigurationTree.objects.filter(parent_id__in=parent_ids).values_list('id', flat=True))
+                descendant_ids.extend(parent_ids)
+            DataConfigurationTree.objects.filter(id__in=descendant_ids, path__startswith=saved_path[2]).update(
+                path=Concat(Value(self.path), Substr('path', len(saved_path[2]) + 1)))
+        self._saved_path = (self.parent_id, self.component_configuration_id, self.path)
+
         self.component_configuration.component.experiment.save()
 
 
@@ -1528,6 +1565,19 @@ class ScheduleOfSending(models.Model):
     send_participant_age = models.BooleanField()
 
 
+class PortalSentObject(models.Model):
+    # Object of a schedule of sending already created in the Portal, so that a
+    # sending that stopped resumes where it was (see experiment.portal_sending).
+    # Objects shared by the schedules, as files, have no schedule of sending
+    schedule_of_sending = models.ForeignKey(ScheduleOfSending, related_name='sent_objects', null=True)
+    key = models.CharField(max_length=255)
+    # None for objects that have no id in the Portal
+    portal_id = models.IntegerField(null=True)
+
+    class Meta:
+        unique_together = ('schedule_of_sending', 'key',)
+
+
 class PortalSelectedQuestion(models.Model):
     experiment = models.ForeignKey(Experiment, related_name='portal_selected_questions')
     survey = models.ForeignKey(Survey)
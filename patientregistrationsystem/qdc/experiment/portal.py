@@ -1,5 +1,9 @@
 import coreapi
 import os
+import requests
+import threading
+import time
+import uuid
 
 from csv import reader
 from datetime import date, timedelta
@@ -9,6 +13,8 @@ from os import path
 
 from django.conf import settings
 from django.utils import translation
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .models import Experiment, Group, Subject, User, EEGSetting, \
     EMGSetting, TMSSetting, ContextTree, \
@@ -33,33 +39,105 @@ from survey.survey_utils import QuestionnaireUtils
 from survey.views import questionnaire_evaluation_fields_excluded
 
 
+class PortalConnection:
+    """Connection to the Portal REST API shared by the RestApiClient
+    instances of a process, so that sending each object does not download
+    the API schema and open new connections again.
+
+    The schema is kept for PORTAL_API['SCHEMA_EXPIRATION'] seconds. Each
+    thread gets its own coreapi client, whose HTTP session keeps connections
+    alive and retries requests that could not connect, and idempotent
+    requests that failed with a gateway error, with exponential backoff.
+    These are the only retries of the requests to the Portal.
+    """
+
+    SCHEMA_EXPIRATION = 10 * 60
+    RETRIES = 3
+    BACKOFF_FACTOR = 0.5
+    RETRY_STATUSES = (502, 503, 504)
+
+    _connections = {}
+    _connections_lock = threading.Lock()
+
+    def __init__(self, url, username, password):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.schema = None
+        self.schema_time = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @classmethod
+    def get(cls):
+        """
+        :return: the PortalConnection of the process for the PORTAL_API
+        settings
+        """
+        url = settings.PORTAL_API['URL'] + (
+            ':' + settings.PORTAL_API['PORT'] if settings.PORTAL_API['PORT'] else '')
+        key = (url, settings.PORTAL_API['USER'], settings.PORTAL_API['PASSWORD'])
+        with cls._connections_lock:
+            if key not in cls._connections:
+                cls._connections[key] = cls(*key)
+            return cls._connections[key]
+
+    @property
+    def session(self):
+        """
+        :return: HTTP session of the coreapi client of the thread, for
+        requests made without coreapi
+        """
+        self.client
+        return self.local.session
+
+    @property
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            retry = Retry(
+                total=self.RETRIES, connect=self.RETRIES, read=self.RETRIES, status=self.RETRIES,
+                backoff_factor=self.BACKOFF_FACTOR, status_forcelist=self.RETRY_STATUSES
+            )
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(max_retries=retry))
+            session.mount('https://', HTTPAdapter(max_retries=retry))
+            auth = coreapi.auth.BasicAuthentication(username=self.username, password=self.password)
+            self.local.client = coreapi.Client(auth=auth, session=session)
+            self.local.session = session
+        return self.local.client
+
+    def get_schema(self, refresh=False):
+        """
+        :param refresh: download the schema even if it has not expired
+        :return: the API schema, downloaded again when expired; None if the
+        Portal can not be reached
+        """
+        expiration = settings.PORTAL_API.get('SCHEMA_EXPIRATION', self.SCHEMA_EXPIRATION)
+        with self.lock:
+            if refresh or self.schema is None or time.time() - self.schema_time > expiration:
+                try:
+                    self.schema = self.client.get(self.url + '/api/schema/')
+                    self.schema_time = time.time()
+                except:
+                    self.schema = None
+            return self.schema
+
+
 class RestApiClient(object):
     client = None
     schema = None
     active = False
 
     def __init__(self):
-        auth = coreapi.auth.BasicAuthentication(
-            username=settings.PORTAL_API['USER'],
-            password=settings.PORTAL_API['PASSWORD']
-        )
-        self.client = coreapi.Client(auth=auth)
-
-        try:
-            url = settings.PORTAL_API['URL'] + \
-                  (
-                      ':' + settings.PORTAL_API['PORT'] if
-                      settings.PORTAL_API['PORT'] else ''
-                  ) + '/api/schema/'
-
-            self.schema = self.client.get(url)
-            self.active = True
-        except:
-            self.active = False
+        connection = PortalConnection.get()
+        self.client = connection.client
+        self.schema = connection.get_schema()
+        self.active = self.schema is not None
 
 
 def get_portal_status():
-    return RestApiClient().active
+    # Checks that the Portal is reachable now, not when the schema was cached
+    return PortalConnection.get().get_schema(refresh=True) is not None
 
 
 def send_experiment_to_portal(experiment: Experiment):
@@ -1232,8 +1310,47 @@ def get_experiment_status_portal(experiment_id):
 
 def send_steps_to_portal(portal_group_id, component_tree,
                          list_of_eeg_setting, list_of_emg_setting, list_of_tms_setting, list_of_context_tree,
-                         language_code, component_configuration_id=None, parent=None):
+                         language_code, component_configuration_id=None, parent=None, sending=None):
+    """
+    :param sending: PortalSending, to skip the steps already sent when
+    sending a schedule again
+    :return: dict with the Portal id of each step, by numeration
+    """
+    rest = RestApiClient()
+
+    if not rest.active:
+        return None
+
+    numeration = component_tree['numeration'] if component_tree['numeration'] != '' else '0'
 
+    step_args = (portal_group_id, component_tree, list_of_eeg_setting, list_of_emg_setting, list_of_tms_setting,
+                 list_of_context_tree, component_configuration_id, parent)
+    if sending:
+        portal_step_id = sending.send('step:%s:%s' % (portal_group_id, numeration), send_step_to_portal, *step_args)
+    else:
+        portal_step_id = send_step_to_portal(*step_args)['id']
+
+    return_dict = {numeration: {'portal_step_id': portal_step_id}}
+
+    # sending sub-steps
+    if component_tree['list_of_component_configuration']:
+        for component_configuration in component_tree['list_of_component_configuration']:
+            sub_step_list = send_steps_to_portal(
+                portal_group_id, component_configuration['component'],
+                list_of_eeg_setting, list_of_emg_setting, list_of_tms_setting,
+                list_of_context_tree, language_code, component_configuration['id'],
+                portal_step_id, sending)
+            return_dict.update(sub_step_list)
+
+    return return_dict
+
+
+def send_step_to_portal(portal_group_id, component_tree,
+                        list_of_eeg_setting, list_of_emg_setting, list_of_tms_setting, list_of_context_tree,
+                        component_configuration_id=None, parent=None):
+    """Send one step, with its questionnaire languages and additional files
+    :return: step created in the Portal
+    """
     component = component_tree['component']
     component_configuration = None
 
@@ -1346,8 +1463,6 @@ def send_steps_to_portal(portal_group_id, component_tree,
 
     portal_step = rest.client.action(rest.schema, action_keys, params=params, encoding="multipart/form-data")
 
-    return_dict = {numeration: {'portal_step_id': portal_step['id']}}
-
     # Questionnaire step has languages
     if step_type == "questionnaire":
 
@@ -1394,17 +1509,7 @@ def send_steps_to_portal(portal_group_id, component_tree,
             action_keys = ['step', 'step_additional_file', 'create']
             rest.client.action(rest.schema, action_keys, params=params, encoding="multipart/form-data")
 
-    # sending sub-steps
-    if component_tree['list_of_component_configuration']:
-        for component_configuration in component_tree['list_of_component_configuration']:
-            sub_step_list = send_steps_to_portal(
-                portal_group_id, component_configuration['component'],
-                list_of_eeg_setting, list_of_emg_setting, list_of_tms_setting,
-                list_of_context_tree, language_code, component_configuration['id'],
-                portal_step['id'])
-            return_dict.update(sub_step_list)
-
-    return return_dict
+    return portal_step
 
 
 def get_survey_information(language, survey, surveys):
@@ -1445,22 +1550,63 @@ def get_questionnaire_fields_for_portal(questionnaire_lime_survey, lime_survey_i
     return fields
 
 
-def send_file_to_portal(file):
+class MultipartFileStream:
+    """Body of a multipart/form-data request with one file, read from the
+    disk in chunks while it is sent, so that large files are never loaded in
+    memory. Its length is known beforehand, so the request is not sent with
+    chunked transfer encoding, which WSGI servers may not accept.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, field_name, file_path, chunk_size=CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.head = (
+            '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n' % (
+                self.boundary, field_name, os.path.basename(file_path).replace('"', '\\"'))
+        ).encode()
+        self.tail = ('\r\n--%s--\r\n' % self.boundary).encode()
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
 
+    def __len__(self):
+        return len(self.head) + os.path.getsize(self.file_path) + len(self.tail)
+
+    def __iter__(self):
+        # Each iteration reads the file again, so the body can be sent again
+        yield self.head
+        with open(self.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                yield chunk
+        yield self.tail
+
+
+def send_file_to_portal(file):
+    """Upload a file, streaming it from the disk. The session of the
+    PortalConnection tries the upload again from the start if it could not
+    connect, as the Portal API does not resume partial uploads.
+    :param file: name of the file in MEDIA_ROOT
+    :return: file created in the Portal
+    """
     rest = RestApiClient()
 
     if not rest.active:
         return None
 
-    params = {}
-
-    action_keys = ['files', 'create']
+    link = rest.schema['files']['create']
+    body = MultipartFileStream('file', path.join(settings.MEDIA_ROOT, file))
+    session = PortalConnection.get().session
 
-    with open(path.join(settings.MEDIA_ROOT, file), 'rb') as f:
-        params["file"] = coreapi.utils.File(os.path.basename(file), f)
-        portal_file = rest.client.action(rest.schema, action_keys, params=params, encoding="multipart/form-data")
+    response = session.post(link.url, data=body, headers={
+        'Content-Type': body.content_type, 'Accept': 'application/json'})
+    response.raise_for_status()
 
-    return portal_file
+    return response.json()
 
 
 def send_eeg_data_to_portal(portal_participant_id, portal_step_id, portal_file_id_list, portal_eeg_setting_id,
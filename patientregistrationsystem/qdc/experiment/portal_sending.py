@@ -0,0 +1,155 @@
+"""Sending of a scheduled experiment to the Portal.
+
+Each object created in the Portal is recorded with its Portal id for the
+schedule of sending (PortalSentObject), so sending a schedule that stopped
+in the middle resumes where it was, without creating the sent objects
+again. Files, identified by their checksum, are recorded for every
+schedule, so a file is uploaded once even if it is sent again by other
+schedules. Objects that do not depend on each other, as the files and the data
+collections of a group, are sent at the same time by a pool of threads
+(PORTAL_API['MAX_CONCURRENT_SENDS'], MAX_CONCURRENT_SENDS by default);
+objects are only sent after the ones they refer to (experiment, group,
+steps, files, data collections).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
+
+from .models import PortalSentObject
+
+MAX_CONCURRENT_SENDS = 4
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_max_concurrent_sends():
+    return settings.PORTAL_API.get('MAX_CONCURRENT_SENDS', MAX_CONCURRENT_SENDS)
+
+
+def get_executor(max_workers):
+    """
+    :return: the pool of threads of the process sending to the Portal
+    """
+    with _executors_lock:
+        if max_workers not in _executors:
+            _executors[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='portal')
+        return _executors[max_workers]
+
+
+class PortalSending:
+
+    # Objects recorded for every schedule of sending and kept when it finishes
+    SHARED_KEY_PREFIXES = ('file:',)
+
+    def __init__(self, schedule_of_sending):
+        self.schedule_of_sending = schedule_of_sending
+        sent_objects = Q(schedule_of_sending=schedule_of_sending)
+        for prefix in self.SHARED_KEY_PREFIXES:
+            sent_objects |= Q(schedule_of_sending=None, key__startswith=prefix)
+        self.portal_ids = dict(PortalSentObject.objects.filter(sent_objects).values_list('key', 'portal_id'))
+        self.lock = threading.Lock()
+
+    def is_sent(self, key):
+        """
+        :param key: key of the object, e.g. 'group:12'
+        :return: True if the object was already sent
+        """
+        with self.lock:
+            return key in self.portal_ids
+
+    def sent(self, key):
+        """
+        :param key: key of the object, e.g. 'group:12'
+        :return: Portal id of the object if it was already sent, or None if
+        it was not sent or has no id
+        """
+        with self.lock:
+            return self.portal_ids.get(key)
+
+    def send(self, key, function, *args):
+        """Send the object with function, unless it was already sent
+        :param key: key of the object in the schedule of sending
+        :param function: send_*_to_portal function, returning the object
+        created in the Portal
+        :param args: arguments of function
+        :return: Portal id of the object, or None if the Portal is not
+        available or the object has no id (see is_sent)
+        """
+        with self.lock:
+            if key in self.portal_ids:
+                return self.portal_ids[key]
+
+        portal_object = function(*args)
+        if not portal_object:
+            return None
+
+        # Some objects, as the experimental protocol, may not have an id
+        portal_id = portal_object.get('id') if isinstance(portal_object, dict) else None
+        if key.startswith(self.SHARED_KEY_PREFIXES):
+            # Unique by a partial index, as schedule_of_sending is null
+            with transaction.atomic():
+                PortalSentObject.objects.get_or_create(
+                    schedule_of_sending=None, key=key, defaults={'portal_id': portal_id})
+        else:
+            try:
+                with transaction.atomic():
+                    PortalSentObject.objects.create(
+                        schedule_of_sending=self.schedule_of_sending, key=key, portal_id=portal_id)
+            except IntegrityError:
+                # Recorded by a sending running at the same time
+                pass
+        with self.lock:
+            self.portal_ids[key] = portal_id
+
+        return portal_id
+
+    def _send_in_thread(self, key, function, args):
+        try:
+            return self.send(key, function, *args)
+        finally:
+            # Threads of the pool do not close their connection as the requests do
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+    def send_concurrently(self, sends):
+        """Send objects that do not depend on each other at the same time.
+        All the objects are tried before an error is raised, so that the ones
+        sent are recorded.
+        :param sends: list of (key, function, args)
+        :return: list of the Portal ids of the objects, in the order of sends
+        """
+        sends = list(sends)
+        max_workers = get_max_concurrent_sends()
+        if max_workers <= 1 or len(sends) <= 1:
+            portal_ids = []
+            error = None
+            for key, function, args in sends:
+                try:
+                    portal_ids.append(self.send(key, function, *args))
+                except Exception as e:
+                    error = error or e
+                    portal_ids.append(None)
+            if error:
+                raise error
+            return portal_ids
+
+        executor = get_executor(max_workers)
+        futures = [executor.submit(self._send_in_thread, key, function, args) for key, function, args in sends]
+        wait(futures)
+
+        return [future.result() for future in futures]
+
+    def finish(self):
+        """Forget the objects sent, except the shared ones, once the schedule
+        of sending is sent
+        """
+        self.schedule_of_sending.sent_objects.all().delete()
+        with self.lock:
+            self.portal_ids = {
+                key: portal_id for key, portal_id in self.portal_ids.items()
+                if key.startswith(self.SHARED_KEY_PREFIXES)
+            }
@@ -0,0 +1,159 @@
+"""Index of the experimental protocols of an experiment, giving the paths to
+the steps of each type without querying the configurations block by block.
+
+The index of an experiment is built from all its component configurations,
+read in one query, and kept for the current thread until a request starts or
+ends, or a component or a configuration is changed. Changes bump a generation
+shared by the threads of the process, so the indexes kept by other threads,
+as the ones making exports or sending to the Portal, are built again too.
+"""
+import threading
+
+from django.core.signals import request_started, request_finished
+from django.db.models import signals
+
+from .models import Component, ComponentConfiguration
+
+_local = threading.local()
+# Incremented when a component or a configuration changes
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def _indexes():
+    """
+    :return: dict of the indexes of the current thread, by experiment id
+    """
+    if getattr(_local, 'generation', None) != _generation:
+        clear()
+
+    return _local.indexes
+
+
+def clear(**kwargs):
+    """Forget the indexes of the current thread"""
+    _local.generation = _generation
+    _local.indexes = {}
+    # Experiment of the root blocks already seen
+    _local.experiments = {}
+
+
+def clear_on_change(sender, instance, **kwargs):
+    """Forget the indexes of every thread"""
+    global _generation
+
+    # Steps are saved as subclasses of Component, that are the senders
+    if isinstance(instance, (Component, ComponentConfiguration)):
+        with _generation_lock:
+            _generation += 1
+        clear()
+
+
+class ProtocolIndex:
+    """Component configurations of one experiment, by the block they belong
+    to, in the order of the steps
+    """
+
+    def __init__(self, experiment_id):
+        self.experiment_id = experiment_id
+        self.children = {}
+        self._paths = {}
+
+        configurations = ComponentConfiguration.objects.filter(
+            component__experiment_id=experiment_id
+        ).select_related('component', 'parent').order_by('order')
+        for configuration in configurations:
+            self.children.setdefault(configuration.parent_id, []).append(configuration)
+
+    def _walk(self, block_id, numeration=''):
+        """
+        :return: list of (component type, path) of the steps of the block and
+        its descendant blocks, in the order they are shown in the protocol
+        """
+        paths = []
+
+        for counter, configuration in enumerate(self.children.get(block_id, []), 1):
+            sub_numeration = (numeration + '.' if numeration else '') + str(counter)
+            step = [configuration.id,
+                    configuration.parent.identification,
+                    configuration.name,
+                    configuration.component.identification,
+                    sub_numeration]
+            component_type = configuration.component.component_type
+            paths.append((component_type, [step]))
+
+            # Look for steps in descendant blocks
+            if component_type == Component.BLOCK:
+                paths.extend(
+                    (descendant_type, [step] + path)
+                    for descendant_type, path in self._walk(configuration.component_id, sub_numeration))
+
+        return paths
+
+    def paths(self, block_id, component_type=None):
+        """
+        :param block_id: id of the root block of the protocol
+        :param component_type: type of the steps; None for all of them
+        :return: list of paths to the steps of the type. Each path is a list
+        of [configuration id, parent identification, configuration name,
+        component identification, numeration], from the root block to the
+        step.
+        """
+        if block_id not in self._paths:
+            paths_by_type = {None: []}
+            for step_type, path in self._walk(block_id):
+                paths_by_type.setdefault(step_type, []).append(path)
+                paths_by_type[None].append(path)
+            self._paths[block_id] = paths_by_type
+
+        # Callers are free to change the paths they get
+        return [[list(step) for step in path] for path in self._paths[block_id].get(component_type, [])]
+
+
+def get_protocol_index(experiment_id):
+    """
+    :param experiment_id: Experiment id
+    :return: ProtocolIndex of the experiment, built once in the thread
+    """
+    indexes = _indexes()
+    if experiment_id not in indexes:
+        indexes[experiment_id] = ProtocolIndex(experiment_id)
+
+    return indexes[experiment_id]
+
+
+def create_list_of_trees(block_id, component_type, numeration=''):
+    """
+    :param block_id: root block of the protocol, or its id
+    :param component_type: type of the steps; None for all of them
+    :param numeration: numeration of the block
+    :return: list of paths to the steps of the type (see ProtocolIndex.paths)
+    """
+    if block_id is None:
+        return []
+
+    _indexes()
+    if isinstance(block_id, Component):
+        _local.experiments[block_id.id] = block_id.experiment_id
+        block_id = block_id.id
+    elif block_id not in _local.experiments:
+        _local.experiments[block_id] = \
+            Component.objects.filter(pk=block_id).values_list('experiment_id', flat=True).first()
+
+    experiment_id = _local.experiments[block_id]
+    if experiment_id is None:
+        return []
+
+    index = get_protocol_index(experiment_id)
+    if numeration:
+        return [[list(step) for step in path]
+                for step_type, path in index._walk(block_id, numeration)
+                if not component_type or step_type == component_type]
+
+    return index.paths(block_id, component_type or None)
+
+
+request_started.connect(clear, dispatch_uid='experiment.protocol_index')
+request_finished.connect(clear, dispatch_uid='experiment.protocol_index')
+signals.post_save.connect(clear_on_change, dispatch_uid='experiment.protocol_index')
+signals.post_delete.connect(clear_on_change, dispatch_uid='experiment.protocol_index')
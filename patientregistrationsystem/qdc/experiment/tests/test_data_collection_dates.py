@@ -0,0 +1,61 @@
+from datetime import date
+
+from experiment.models import Component
+from experiment.tests.tests_helper import ObjectsFactory, ExperimentTestCase
+from experiment.views import dates_of_first_data_collection, date_of_first_data_collection
+from patient.tests.tests_orig import UtilTests
+
+
+class FirstDataCollectionDateTest(ExperimentTestCase):
+
+    def setUp(self):
+        super(FirstDataCollectionDateTest, self).setUp()
+
+        information_type = ObjectsFactory.create_information_type()
+        generic_data_collection = ObjectsFactory.create_component(
+            self.experiment, Component.GENERIC_DATA_COLLECTION, kwargs={'it': information_type})
+        self.generic_data_collection_tree = ObjectsFactory.create_data_configuration_tree(
+            ObjectsFactory.create_component_configuration(self.root_component, generic_data_collection))
+
+        eeg_setting = ObjectsFactory.create_eeg_setting(self.experiment)
+        eeg = ObjectsFactory.create_component(self.experiment, Component.EEG, kwargs={'eeg_set': eeg_setting})
+        self.eeg_tree = ObjectsFactory.create_data_configuration_tree(
+            ObjectsFactory.create_component_configuration(self.root_component, eeg))
+        self.eeg_setting = eeg_setting
+
+        self.other_subject_of_group = ObjectsFactory.create_subject_of_group(
+            self.group, ObjectsFactory.create_subject(UtilTests().create_patient(changed_by=self.user)))
+        self.subject_of_group_without_data = ObjectsFactory.create_subject_of_group(
+            self.group, ObjectsFactory.create_subject(UtilTests().create_patient(changed_by=self.user)))
+
+    def create_generic_data(self, subject_of_group, date_):
+        data = ObjectsFactory.create_generic_data_collection_data(self.generic_data_collection_tree, subject_of_group)
+        data.date = date_
+        data.save()
+
+    def create_eeg_data(self, subject_of_group, date_):
+        data = ObjectsFactory.create_eeg_data(self.eeg_tree, subject_of_group, self.eeg_setting)
+        data.date = date_
+        data.save()
+
+    def test_first_dates_of_many_subjects_of_group_are_read_in_one_query(self):
+        self.create_generic_data(self.subject_of_group, date(2018, 7, 7))
+        self.create_eeg_data(self.subject_of_group, date(2012, 5, 5))
+        self.create_generic_data(self.other_subject_of_group, date(2015, 1, 1))
+        self.create_eeg_data(self.other_subject_of_group, date(2016, 1, 1))
+
+        with self.assertNumQueries(1):
+            dates = dates_of_first_data_collection([
+                self.subject_of_group.id, self.other_subject_of_group.id, self.subject_of_group_without_data.id
+            ])
+
+        self.assertEqual(dates, {
+            self.subject_of_group.id: date(2012, 5, 5), self.other_subject_of_group.id: date(2015, 1, 1)
+        })
+
+    def test_first_date_of_one_subject_of_group(self):
+        self.create_generic_data(self.subject_of_group, date(2018, 7, 7))
+
+        self.assertEqual(date_of_first_data_collection(self.subject_of_group), date(2018, 7, 7))
+        self.assertIsNone(date_of_first_data_collection(self.subject_of_group_without_data))
+        self.assertEqual(dates_of_first_data_collection([]), {})
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+from experiment.models import Component, DataConfigurationTree
+from experiment.tests.tests_helper import ObjectsFactory, ExperimentTestCase
+from experiment.views import create_data_configuration_tree, list_data_configuration_tree, \
+    list_data_configuration_trees
+
+
+class DataConfigurationTreePathTest(ExperimentTestCase):
+
+    def setUp(self):
+        super(DataConfigurationTreePathTest, self).setUp()
+
+        block = ObjectsFactory.create_block(self.experiment)
+        self.block_configuration = ObjectsFactory.create_component_configuration(self.root_component, block)
+        self.task_configuration = ObjectsFactory.create_component_configuration(
+            block, ObjectsFactory.create_component(self.experiment, Component.TASK))
+        self.pause_configuration = ObjectsFactory.create_component_configuration(
+            block, ObjectsFactory.create_component(self.experiment, Component.PAUSE))
+
+        self.task_path = [self.block_configuration.id, self.task_configuration.id]
+        self.pause_path = [self.block_configuration.id, self.pause_configuration.id]
+
+    def test_path_is_saved_with_the_tree(self):
+        data_configuration_tree_id = create_data_configuration_tree(self.task_path)
+
+        self.assertEqual(DataConfigurationTree.objects.get(pk=data_configuration_tree_id).path,
+                         '/%s/%s/' % tuple(self.task_path))
+
+    def test_tree_is_found_by_its_path_in_one_query(self):
+        data_configuration_tree_id = create_data_configuration_tree(self.task_path)
+        create_data_configuration_tree([self.task_configuration.id])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list_data_configuration_tree(self.task_configuration.id, self.task_path), data_configuration_tree_id)
+        self.assertIsNone(list_data_configuration_tree(self.pause_configuration.id, self.pause_path))
+
+    def test_trees_of_many_paths_are_found_in_one_query(self):
+        task_tree_id = create_data_configuration_tree(self.task_path)
+        pause_tree_id = create_data_configuration_tree(self.pause_path)
+
+        with self.assertNumQueries(1):
+            data_configuration_tree_ids = list_data_configuration_trees(
+                [self.task_path, self.pause_path, [self.pause_configuration.id]])
+
+        self.assertEqual(data_configuration_tree_ids,
+                         {tuple(self.task_path): task_tree_id, tuple(self.pause_path): pause_tree_id})
+
+    def test_paths_of_descendants_change_with_the_parent(self):
+        leaf = DataConfigurationTree.objects.get(pk=create_data_configuration_tree(self.task_path))
+        root = leaf.parent
+        root.component_configuration = self.pause_configuration
+        root.save()
+
+        self.assertEqual(DataConfigurationTree.objects.get(pk=leaf.pk).path,
+                         '/%s/%s/' % (self.pause_configuration.id, self.task_configuration.id))
+
+    def test_paths_of_descendants_of_other_trees_with_the_same_path_are_kept(self):
+        task_tree_id = create_data_configuration_tree(self.task_path)
+        pause_tree_id = create_data_configuration_tree(self.pause_path)
+        root = DataConfigurationTree.objects.get(pk=task_tree_id).parent
+        other_block_configuration = ObjectsFactory.create_component_configuration(
+            self.root_component, ObjectsFactory.create_block(self.experiment))
+        root.component_configuration = other_block_configuration
+        root.save()
+
+        self.assertEqual(DataConfigurationTree.objects.get(pk=task_tree_id).path,
+                         '/%s/%s/' % (other_block_configuration.id, self.task_configuration.id))
+        self.assertEqual(DataConfigurationTree.objects.get(pk=pause_tree_id).path,
+                         '/%s/%s/' % tuple(self.pause_path))
+
+    def test_saving_without_moving_the_tree_does_not_touch_descendants(self):
+        leaf = DataConfigurationTree.objects.get(pk=create_data_configuration_tree(self.task_path))
+        root = DataConfigurationTree.objects.get(pk=leaf.parent_id)
+        root.code = 1
+
+        with patch.object(DataConfigurationTree.objects, 'filter') as filter_descendants:
+            root.save()
+
+        filter_descendants.assert_not_called()
+        self.assertEqual(DataConfigurationTree.objects.get(pk=leaf.pk).path, '/%s/%s/' % tuple(self.task_path))
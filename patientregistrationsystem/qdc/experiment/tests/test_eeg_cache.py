@@ -0,0 +1,87 @@
+import shutil
+import tempfile
+from os import path
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.test import override_settings
+
+from experiment import eeg_cache
+from experiment.models import FileFormat
+from experiment.tests.tests_helper import ObjectsFactory, ExperimentTestCase
+from experiment.views import eeg_data_reading, get_sensors_position
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class EEGCacheTest(ExperimentTestCase):
+
+    def setUp(self):
+        super(EEGCacheTest, self).setUp()
+
+        eeg_setting = ObjectsFactory.create_eeg_setting(self.experiment)
+        component = ObjectsFactory.create_component(self.experiment, 'eeg', kwargs={'eeg_set': eeg_setting})
+        component_configuration = ObjectsFactory.create_component_configuration(self.root_component, component)
+        data_configuration_tree = ObjectsFactory.create_data_configuration_tree(component_configuration)
+        self.eeg_data = ObjectsFactory.create_eeg_data(data_configuration_tree, self.subject_of_group, eeg_setting)
+        self.eeg_data.file_format = FileFormat.objects.get_or_create(
+            nes_code='MNE-RawFromEGI', defaults={'name': 'EGI'})[0]
+        self.eeg_data.save()
+        self.eeg_file = ObjectsFactory.create_eeg_file(self.eeg_data)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def replace_file_content(self, content):
+        self.eeg_file.file.save('file.bin', ContentFile(content))
+
+    @patch('experiment.views.read_eeg_file')
+    def test_header_is_read_once_for_each_version_of_the_file(self, mock_read_eeg_file):
+        mock_read_eeg_file.return_value = None
+
+        self.assertFalse(eeg_data_reading(self.eeg_file).is_valid)
+        self.assertFalse(eeg_data_reading(self.eeg_file).is_valid)
+        self.assertEqual(mock_read_eeg_file.call_count, 1)
+
+        self.replace_file_content(b'changed recording')
+        eeg_data_reading(self.eeg_file)
+        self.assertEqual(mock_read_eeg_file.call_count, 2)
+
+    @patch('experiment.views.read_eeg_file')
+    def test_reading_is_only_parsed_when_used(self, mock_read_eeg_file):
+        eeg_cache.set_value(self.eeg_file, 'header', {'valid': True, 'number_of_eeg_channels': 129})
+
+        eeg_reading = eeg_data_reading(self.eeg_file, preload=True)
+
+        self.assertEqual(eeg_reading.header['number_of_eeg_channels'], 129)
+        mock_read_eeg_file.assert_not_called()
+        self.assertEqual(eeg_reading.reading, mock_read_eeg_file.return_value)
+        mock_read_eeg_file.assert_called_once_with(self.eeg_file, True)
+
+    @patch('experiment.views.save_sensors_position')
+    def test_sensors_position_image_is_made_once_for_each_version_of_the_file(self, mock_save_sensors_position):
+        def save_sensors_position(eeg_file, nes_code, file_path):
+            open(file_path, 'wb').close()
+            return True
+
+        mock_save_sensors_position.side_effect = save_sensors_position
+
+        file_path = get_sensors_position(self.eeg_data)
+        self.assertTrue(path.exists(file_path))
+        self.assertEqual(get_sensors_position(self.eeg_data), file_path)
+        self.assertEqual(mock_save_sensors_position.call_count, 1)
+
+        self.replace_file_content(b'changed recording')
+        new_file_path = get_sensors_position(self.eeg_data)
+        self.assertNotEqual(new_file_path, file_path)
+        self.assertFalse(path.exists(file_path))
+        self.assertEqual(mock_save_sensors_position.call_count, 2)
+
+    @patch('experiment.views.save_sensors_position')
+    def test_sensors_position_not_made_is_not_tried_again(self, mock_save_sensors_position):
+        mock_save_sensors_position.return_value = False
+
+        self.assertIsNone(get_sensors_position(self.eeg_data))
+        self.assertIsNone(get_sensors_position(self.eeg_data))
+        self.assertEqual(mock_save_sensors_position.call_count, 1)
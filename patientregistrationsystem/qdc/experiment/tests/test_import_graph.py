@@ -0,0 +1,85 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from experiment.import_export import ImportExperiment
+from experiment.tests.tests_helper import CountingList
+
+
+def create_protocol_fixture(number_of_blocks):
+    """Fixture of an experiment whose protocol has a root block with
+    number_of_blocks blocks, as exported: pks start at 1 in each model
+    """
+    data = [
+        {'model': 'experiment.researchproject', 'pk': 1, 'fields': {'title': 'Project'}},
+        {'model': 'experiment.experiment', 'pk': 1, 'fields': {'research_project': 1}},
+        {'model': 'experiment.stimulustype', 'pk': 1, 'fields': {'name': 'Visual'}},
+    ]
+    for pk in range(1, number_of_blocks + 2):
+        data.append({'model': 'experiment.component', 'pk': pk, 'fields': {'experiment': 1}})
+        data.append({'model': 'experiment.block', 'pk': pk, 'fields': {}})
+    for pk in range(1, number_of_blocks + 1):
+        data.append({
+            'model': 'experiment.componentconfiguration', 'pk': pk,
+            'fields': {'component': pk + 1, 'parent': 1}
+        })
+    data.append({'model': 'experiment.group', 'pk': 1, 'fields': {'experiment': 1, 'experimental_protocol': 1}})
+
+    return data
+
+
+class ImportGraphTest(TestCase):
+
+    def manage_pks(self, data):
+        import_experiment = ImportExperiment('')
+        import_experiment.data = data
+        import_experiment._manage_pks(import_experiment._build_digraph())
+        return import_experiment.data
+
+    def test_new_pks_are_unique_and_references_follow_them(self):
+        data = self.manage_pks(create_protocol_fixture(3))
+        objects = {}
+        for dict_ in data:
+            objects.setdefault(dict_['model'], {})[dict_['pk']] = dict_['fields']
+
+        self.assertEqual(len(objects['experiment.component']), 4)
+        self.assertEqual(len(objects['experiment.componentconfiguration']), 3)
+        self.assertNotIn(1, objects['experiment.component'])
+        self.assertEqual(set(objects['experiment.block']), set(objects['experiment.component']))
+
+        experiment_id, = objects['experiment.experiment']
+        research_project_id, = objects['experiment.researchproject']
+        self.assertEqual(objects['experiment.experiment'][experiment_id]['research_project'], research_project_id)
+
+        group, = objects['experiment.group'].values()
+        self.assertEqual(group['experiment'], experiment_id)
+        for component_configuration in objects['experiment.componentconfiguration'].values():
+            self.assertEqual(component_configuration['parent'], group['experimental_protocol'])
+            self.assertIn(component_configuration['component'], objects['experiment.component'])
+            self.assertNotEqual(component_configuration['component'], group['experimental_protocol'])
+
+    def test_pre_loaded_objects_keep_their_pks(self):
+        data = create_protocol_fixture(1)
+        data.append({'model': 'experiment.component', 'pk': 3, 'fields': {'experiment': 1}})
+        data.append({'model': 'experiment.stimulus', 'pk': 3, 'fields': {'stimulus_type': 1}})
+        data = self.manage_pks(data)
+
+        self.assertIn({'model': 'experiment.stimulustype', 'pk': 1, 'fields': {'name': 'Visual'}}, data)
+        stimulus, = [dict_ for dict_ in data if dict_['model'] == 'experiment.stimulus']
+        self.assertNotEqual(stimulus['pk'], 3)
+        self.assertEqual(stimulus['fields']['stimulus_type'], 1)
+
+    def test_pks_of_fixtures_of_increasing_size_are_managed_in_linear_time(self):
+        reads_per_object = []
+        queries = []
+        for number_of_blocks in (50, 400):
+            data = CountingList(create_protocol_fixture(number_of_blocks))
+            with CaptureQueriesContext(connection) as context:
+                self.manage_pks(data)
+            reads_per_object.append(data.reads / len(data))
+            queries.append(len(context))
+
+        # Each object is read a fixed number of times, and the database is
+        # queried the same number of times, whatever the size of the fixture
+        self.assertLess(reads_per_object[1], reads_per_object[0] * 1.1)
+        self.assertEqual(queries[0], queries[1])
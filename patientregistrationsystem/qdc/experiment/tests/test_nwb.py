@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+import mne
+import numpy as np
+from django.test import TestCase
+
+from experiment.views import get_nwb_acquisition_data
+
+
+def create_egi_like_reading(seconds, sampling_rate=250, eeg_channels=128):
+    """Synthetic reading with the channels of an EGI recording: the EEG
+    channels E1..En, the vertex reference and a stimulus channel
+    """
+    channel_names = ['E%d' % index for index in range(1, eeg_channels + 1)] + ['Vertex Reference', 'STI 014']
+    channel_types = (eeg_channels + 1) * ['eeg'] + ['stim']
+    info = mne.create_info(channel_names, sampling_rate, channel_types)
+    data = np.random.RandomState(0).randn(len(channel_names), seconds * sampling_rate) * 1e-5
+
+    return mne.io.RawArray(data, info, verbose=False)
+
+
+def get_nwb_acquisition_data_by_sample(raw):
+    # Sample by sample construction used before get_nwb_acquisition_data
+    number_of_channels = len(mne.pick_types(raw.info, eeg=True))
+    number_of_samples = len(raw._data[0])
+    array_data = np.zeros((number_of_samples, number_of_channels))
+    for index_channel in range(number_of_channels):
+        channel_reading = raw._data[mne.pick_types(raw.info, eeg=True)[index_channel]]
+        for index, value in enumerate(channel_reading):
+            array_data[index][index_channel] = value
+
+    return array_data
+
+
+class NWBAcquisitionDataTest(TestCase):
+
+    def test_acquisition_data_has_one_row_per_sample_of_eeg_channels(self):
+        raw = create_egi_like_reading(seconds=2)
+
+        array_data = get_nwb_acquisition_data(raw)
+
+        self.assertEqual(array_data.shape, (2 * 250, 129))
+        self.assertTrue(array_data.flags['C_CONTIGUOUS'])
+        np.testing.assert_array_equal(array_data, get_nwb_acquisition_data_by_sample(raw))
+
+    def test_acquisition_data_of_channels_not_contiguous(self):
+        raw = create_egi_like_reading(seconds=1)
+        raw.reorder_channels(['STI 014'] + raw.ch_names[:-1])
+        raw.set_channel_types({'E2': 'misc'})
+
+        np.testing.assert_array_equal(get_nwb_acquisition_data(raw), get_nwb_acquisition_data_by_sample(raw))
+
+    def test_contiguous_channels_are_not_copied_before_the_transposition(self):
+        raw = create_egi_like_reading(seconds=1)
+
+        with patch('experiment.views.np.ascontiguousarray', wraps=np.ascontiguousarray) as ascontiguousarray:
+            get_nwb_acquisition_data(raw)
+
+        channels = ascontiguousarray.call_args[0][0]
+        self.assertTrue(np.shares_memory(channels, raw._data))
@@ -1,21 +1,34 @@
 import csv
+import os
+import shutil
+import tempfile
 from io import StringIO
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 
+import coreapi
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from custom_user.tests_helper import create_user
-from experiment.models import ScheduleOfSending, Component
+from experiment.checksum import file_checksum
+from experiment.models import ScheduleOfSending, Component, PortalSentObject
 from experiment.portal import send_experiment_to_portal, \
     send_experiment_researcher_to_portal, \
-    send_researcher_to_portal, send_steps_to_portal
+    send_researcher_to_portal, send_steps_to_portal, get_portal_status, PortalConnection, RestApiClient, \
+    send_file_to_portal, MultipartFileStream
+from experiment.portal_sending import PortalSending
 from experiment.tests.tests_helper import ObjectsFactory
-from experiment.views import get_block_tree
+from experiment.views import get_block_tree, send_all_experiments_to_portal
+from patient.tests.tests_orig import UtilTests
 from survey.abc_search_engine import ABCSearchEngine
 from survey.survey_utils import HEADER_EXPLANATION_FIELDS
 from survey.tests.tests_helper import create_survey
 
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
 
 class PortalAPITest(TestCase):
 
@@ -158,3 +171,218 @@ class PortalAPITest(TestCase):
         survey_metadata = csv.reader(StringIO(kwargs['params']['survey_metadata']))
         for row in survey_metadata:
             self.assertEqual(len(row), len(HEADER_EXPLANATION_FIELDS))
+
+
+@override_settings(PORTAL_API={'URL': 'http://portal.test', 'PORT': '8000', 'USER': 'nes', 'PASSWORD': 'nes',
+                               'SCHEMA_EXPIRATION': 600})
+class PortalConnectionTest(TestCase):
+
+    def setUp(self):
+        PortalConnection._connections.clear()
+
+    @patch('experiment.portal.coreapi.Client')
+    def test_clients_share_the_connection_and_schema(self, mockClientClass):
+        rest1 = RestApiClient()
+        rest2 = RestApiClient()
+
+        self.assertTrue(rest1.active)
+        self.assertIs(rest1.client, rest2.client)
+        self.assertIs(rest1.schema, rest2.schema)
+        mockClientClass.assert_called_once()
+        mockClientClass.return_value.get.assert_called_once_with('http://portal.test:8000/api/schema/')
+
+    @patch('experiment.portal.coreapi.Client')
+    def test_schema_is_downloaded_again_after_failure(self, mockClientClass):
+        mockClientClass.return_value.get.side_effect = [ConnectionError, 'schema']
+
+        self.assertFalse(RestApiClient().active)
+        self.assertEqual(RestApiClient().schema, 'schema')
+
+    @patch('experiment.portal.coreapi.Client')
+    def test_portal_status_checks_portal_again(self, mockClientClass):
+        RestApiClient()
+        mockClientClass.return_value.get.side_effect = ConnectionError
+
+        self.assertFalse(get_portal_status())
+
+
+# Threads of the pool have their own connection, which does not see the
+# objects created in the transaction of the test
+@override_settings(PORTAL_API=dict(settings.PORTAL_API, MAX_CONCURRENT_SENDS=1))
+class PortalSendingTest(TestCase):
+
+    def setUp(self):
+        exec(open('add_initial_data.py').read())
+        user, user_passwd = create_user(Group.objects.all())
+        experiment = ObjectsFactory.create_experiment(ObjectsFactory.create_research_project())
+        self.schedule_of_sending = ScheduleOfSending.objects.create(
+            experiment=experiment, responsible=user, status='scheduled', send_participant_age=False)
+        self.sent = []
+
+    def send(self, name):
+        self.sent.append(name)
+        return {'id': len(self.sent)}
+
+    def test_objects_sent_are_not_sent_again_when_sending_resumes(self):
+        sending = PortalSending(self.schedule_of_sending)
+        self.assertEqual(sending.send('group:1', self.send, 'group'), 1)
+
+        sending = PortalSending(self.schedule_of_sending)
+        self.assertEqual(sending.send('group:1', self.send, 'group'), 1)
+        self.assertEqual(sending.send('group:2', self.send, 'group 2'), 2)
+        self.assertEqual(self.sent, ['group', 'group 2'])
+
+    def test_objects_sent_concurrently_are_recorded_before_the_error(self):
+        def send_or_fail(name):
+            if name == 'fail':
+                raise ConnectionError
+            return self.send(name)
+
+        sending = PortalSending(self.schedule_of_sending)
+        with self.assertRaises(ConnectionError):
+            sending.send_concurrently([
+                ('file:1', send_or_fail, ('file 1',)),
+                ('file:2', send_or_fail, ('fail',)),
+                ('file:3', send_or_fail, ('file 3',)),
+            ])
+
+        sending = PortalSending(self.schedule_of_sending)
+        self.assertEqual(
+            sending.send_concurrently([(
+                'file:%s' % index, self.send, ('file %s' % index,)) for index in range(1, 4)]
+            ), [1, 3, 2])
+        self.assertEqual(self.sent, ['file 1', 'file 3', 'file 2'])
+
+    def test_objects_sent_are_forgotten_when_sending_finishes(self):
+        sending = PortalSending(self.schedule_of_sending)
+        sending.send('experiment', self.send, 'experiment')
+        sending.finish()
+
+        self.assertFalse(PortalSentObject.objects.exists())
+        self.assertIsNone(PortalSending(self.schedule_of_sending).sent('experiment'))
+
+    def test_files_sent_are_not_sent_again_by_other_schedules(self):
+        sending = PortalSending(self.schedule_of_sending)
+        self.assertEqual(sending.send('file:checksum', self.send, 'file'), 1)
+        sending.finish()
+
+        schedule_of_sending = ScheduleOfSending.objects.create(
+            experiment=self.schedule_of_sending.experiment, responsible=self.schedule_of_sending.responsible,
+            status='scheduled', send_participant_age=False)
+        sending = PortalSending(schedule_of_sending)
+        self.assertEqual(sending.send('file:checksum', self.send, 'file'), 1)
+        self.assertEqual(sending.send('experiment', self.send, 'experiment'), 2)
+        self.assertEqual(self.sent, ['file', 'experiment'])
+
+    def test_files_are_recorded_once_for_every_schedule(self):
+        PortalSentObject.objects.create(schedule_of_sending=None, key='file:checksum', portal_id=1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PortalSentObject.objects.create(schedule_of_sending=None, key='file:checksum', portal_id=2)
+
+    def test_object_recorded_by_other_sending_keeps_the_transaction_usable(self):
+        PortalSentObject.objects.create(schedule_of_sending=self.schedule_of_sending, key='group:1', portal_id=1)
+
+        sending = PortalSending(ScheduleOfSending.objects.get(pk=self.schedule_of_sending.pk))
+        sending.portal_ids.clear()
+        self.assertEqual(sending.send('group:1', self.send, 'group'), 1)
+        self.assertEqual(PortalSentObject.objects.filter(key='group:1').count(), 1)
+
+    def test_objects_without_id_are_not_sent_again_when_sending_resumes(self):
+        sending = PortalSending(self.schedule_of_sending)
+        self.assertIsNone(sending.send('experimental_protocol:1', lambda: {'status': 'ok'}))
+        self.assertTrue(sending.is_sent('experimental_protocol:1'))
+
+        sending = PortalSending(self.schedule_of_sending)
+        self.assertTrue(sending.is_sent('experimental_protocol:1'))
+        self.assertIsNone(sending.send('experimental_protocol:1', self.send, 'experimental protocol'))
+        self.assertEqual(self.sent, [])
+
+    def test_sending_of_experiment_resumes_after_failure_without_sending_again(self):
+        group = ObjectsFactory.create_group(self.schedule_of_sending.experiment)
+        user = self.schedule_of_sending.responsible
+        subjects = [ObjectsFactory.create_subject(UtilTests().create_patient(changed_by=user)) for _ in range(2)]
+        for subject in subjects:
+            ObjectsFactory.create_subject_of_group(group, subject)
+        failing = [subjects[1]]
+
+        def send_participant(schedule_of_sending, portal_group_id, subject, first_data_collection):
+            if subject in failing:
+                failing.remove(subject)
+                raise ConnectionError
+            return self.send('participant %s of group %s' % (subject.id, portal_group_id))
+
+        with patch.multiple(
+                'experiment.views',
+                # The experiment, as some objects of the Portal, has no id
+                send_experiment_to_portal=lambda experiment: self.send('experiment') and {'title': 'experiment'},
+                send_research_project_to_portal=lambda experiment: self.send('research project'),
+                send_researcher_to_portal=lambda research_project_id, owner: self.send(
+                    'researcher of research project %s' % research_project_id),
+                send_group_to_portal=lambda group: self.send('group'),
+                send_participant_to_portal=send_participant,
+                send_experiment_end_message_to_portal=lambda experiment: self.send('end')):
+            with self.assertRaises(ConnectionError):
+                send_all_experiments_to_portal()
+            self.assertEqual(self.sent, [
+                'experiment', 'research project', 'researcher of research project 2', 'group',
+                'participant %s of group 4' % subjects[0].id])
+
+            send_all_experiments_to_portal()
+
+        self.assertEqual(self.sent[5:], ['participant %s of group 4' % subjects[1].id, 'end'])
+        self.schedule_of_sending.refresh_from_db()
+        self.assertEqual(self.schedule_of_sending.status, 'sent')
+        self.assertFalse(PortalSentObject.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   PORTAL_API={'URL': 'http://portal.test', 'PORT': '', 'USER': 'nes', 'PASSWORD': 'nes'})
+class PortalFileTest(TestCase):
+
+    def setUp(self):
+        PortalConnection._connections.clear()
+        os.makedirs(TEMP_MEDIA_ROOT, exist_ok=True)
+        self.content = os.urandom(10000)
+        for name in ('file.raw', 'copy.raw'):
+            with open(os.path.join(TEMP_MEDIA_ROOT, name), 'wb') as f:
+                f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_file_is_streamed_in_chunks(self):
+        body = MultipartFileStream('file', os.path.join(TEMP_MEDIA_ROOT, 'file.raw'), chunk_size=4096)
+
+        chunks = list(body)
+        self.assertEqual(max(len(chunk) for chunk in chunks[1:-1]), 4096)
+        self.assertEqual(len(b''.join(chunks)), len(body))
+        self.assertEqual(b''.join(body), b''.join(chunks))
+
+        self.assertEqual(b''.join(chunks), body.head + self.content + body.tail)
+        self.assertIn(b'name="file"; filename="file.raw"', body.head)
+        self.assertIn(body.boundary, body.content_type)
+
+    def test_identical_files_have_the_same_checksum(self):
+        file_path, copy_path = (os.path.join(TEMP_MEDIA_ROOT, name) for name in ('file.raw', 'copy.raw'))
+        self.assertEqual(file_checksum(file_path), file_checksum(copy_path))
+
+        with open(copy_path, 'ab') as f:
+            f.write(b'changed')
+        self.assertNotEqual(file_checksum(file_path), file_checksum(copy_path))
+
+    @patch('experiment.portal.coreapi.Client')
+    def test_upload_is_tried_again_by_the_session_when_connection_fails(self, mockClientClass):
+        mockClientClass.return_value.get.return_value = {
+            'files': {'create': coreapi.Link(url='http://portal.test/api/files/', action='post')}}
+
+        retry = PortalConnection.get().session.get_adapter('http://portal.test/api/files/').max_retries
+        self.assertEqual(retry.connect, PortalConnection.RETRIES)
+
+        with patch.object(PortalConnection.get().session, 'post') as mock_post:
+            mock_post.return_value = Mock(**{'json.return_value': {'id': 7}})
+            self.assertEqual(send_file_to_portal('file.raw'), {'id': 7})
+
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_post.call_args[0][0], 'http://portal.test/api/files/')
+        self.assertIsInstance(mock_post.call_args[1]['data'], MultipartFileStream)
@@ -0,0 +1,80 @@
+import threading
+
+from experiment import protocol_index
+from experiment.models import Component
+from experiment.protocol_index import create_list_of_trees
+from experiment.tests.tests_helper import ObjectsFactory, ExperimentTestCase
+
+
+class ProtocolIndexTest(ExperimentTestCase):
+
+    def setUp(self):
+        super(ProtocolIndexTest, self).setUp()
+
+        eeg_setting = ObjectsFactory.create_eeg_setting(self.experiment)
+        eeg_kwargs = {'eeg_set': eeg_setting}
+
+        # root: eeg, block (task, block (eeg)), pause
+        self.eeg1 = ObjectsFactory.create_component_configuration(
+            self.root_component, ObjectsFactory.create_component(self.experiment, Component.EEG, kwargs=eeg_kwargs))
+        self.block1 = ObjectsFactory.create_component_configuration(
+            self.root_component, ObjectsFactory.create_block(self.experiment))
+        self.task = ObjectsFactory.create_component_configuration(
+            self.block1.component, ObjectsFactory.create_component(self.experiment, Component.TASK))
+        self.block2 = ObjectsFactory.create_component_configuration(
+            self.block1.component, ObjectsFactory.create_block(self.experiment))
+        self.eeg2 = ObjectsFactory.create_component_configuration(
+            self.block2.component, ObjectsFactory.create_component(self.experiment, Component.EEG, kwargs=eeg_kwargs))
+        self.pause = ObjectsFactory.create_component_configuration(
+            self.root_component, ObjectsFactory.create_component(self.experiment, Component.PAUSE))
+
+    def test_paths_to_steps_of_a_type_with_their_numeration(self):
+        paths = create_list_of_trees(self.group.experimental_protocol, Component.EEG)
+
+        self.assertEqual([[step[0] for step in path] for path in paths],
+                         [[self.eeg1.id], [self.block1.id, self.block2.id, self.eeg2.id]])
+        self.assertEqual([step[4] for step in paths[1]], ['2', '2.2', '2.2.1'])
+        self.assertEqual(paths[1][2][1:4], [
+            self.block2.component.identification, self.eeg2.name, self.eeg2.component.identification])
+
+    def test_paths_to_all_steps_in_protocol_order(self):
+        paths = create_list_of_trees(self.group.experimental_protocol.id, None)
+
+        self.assertEqual([path[-1][0] for path in paths], [
+            self.eeg1.id, self.block1.id, self.task.id, self.block2.id, self.eeg2.id, self.pause.id])
+
+    def test_protocol_is_read_in_one_query_for_all_step_types(self):
+        protocol_index.clear()
+        experimental_protocol = self.group.experimental_protocol
+
+        with self.assertNumQueries(1):
+            for component_type in (Component.EEG, Component.TASK, Component.TMS, Component.QUESTIONNAIRE, None):
+                create_list_of_trees(experimental_protocol, component_type)
+
+    def test_changed_paths_are_not_shared(self):
+        create_list_of_trees(self.group.experimental_protocol, Component.TASK)[0].insert(0, 'changed')
+
+        self.assertEqual(len(create_list_of_trees(self.group.experimental_protocol, Component.TASK)[0]), 2)
+
+    def test_index_is_built_again_after_protocol_changes(self):
+        create_list_of_trees(self.group.experimental_protocol, Component.TMS)
+
+        tms_setting = ObjectsFactory.create_tms_setting(self.experiment)
+        tms = ObjectsFactory.create_component_configuration(
+            self.root_component,
+            ObjectsFactory.create_component(self.experiment, Component.TMS, kwargs={'tms_set': tms_setting}))
+
+        self.assertEqual(
+            [path[-1][0] for path in create_list_of_trees(self.group.experimental_protocol, Component.TMS)], [tms.id])
+
+    def test_index_of_this_thread_is_built_again_after_change_in_other_thread(self):
+        experimental_protocol = self.group.experimental_protocol
+        create_list_of_trees(experimental_protocol, Component.TASK)
+
+        thread = threading.Thread(
+            target=protocol_index.clear_on_change, args=(Component,), kwargs={'instance': self.task.component})
+        thread.start()
+        thread.join()
+
+        with self.assertNumQueries(1):
+            create_list_of_trees(experimental_protocol, Component.TASK)
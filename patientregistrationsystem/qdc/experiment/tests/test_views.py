@@ -16,14 +16,17 @@ from django.core.exceptions import PermissionDenied
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.core.files import File
-from django.test import TestCase, override_settings
+from django.db import connection
+from django.test import TestCase, override_settings, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.utils.encoding import smart_str
+from django.utils import timezone
 from django.utils.html import strip_tags
 from django.conf import settings
 from faker import Factory
 
 from custom_user.tests_helper import create_user
-from experiment.import_export import ExportExperiment
+from experiment.import_export import ExportExperiment, ImportExperiment
 from experiment.models import Keyword, Component, \
     FileFormat, ExperimentResearcher, Experiment, ResearchProject, \
     TMS, ComponentConfiguration, Questionnaire, Subject, SubjectOfGroup, \
@@ -376,6 +379,8 @@ class CollaboratorTest(TestCase):
             self.assertEqual(response.status_code, 302)
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class ExportExperimentTest(TestCase):
     TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 
@@ -965,7 +970,43 @@ class ExportExperimentTest(TestCase):
             message, 'Não foi possível exportar dados do LimeSurvey. Por favor tente novamente. Se '
                      'o problema persistir entre em contato com o administrador de sistemas.')
 
+    def test_export_all_removes_group_codes(self):
+        self.group.code = 'G1'
+        self.group.save()
 
+        export = ExportExperiment(self.experiment)
+        export.export_all()
+
+        with zipfile.ZipFile(export.get_file_path()) as zipped_file:
+            data = json.loads(zipped_file.read(export.FILE_NAME_JSON).decode())
+        group = next(dict_ for dict_ in data if dict_['model'] == 'experiment.group')
+        self.assertEqual(group['pk'], self.group.id)
+        self.assertIsNone(group['fields']['code'])
+        self.assertEqual(
+            [dict_['model'] for dict_ in data if dict_['model'].startswith('experiment.researchproject')],
+            ['experiment.researchproject'])
+
+    def test_export_all_queries_do_not_grow_with_number_of_objects(self):
+        def count_export_queries():
+            with CaptureQueriesContext(connection) as context:
+                ExportExperiment(self.experiment).export_all()
+            return len(context)
+
+        rootcomponent = ObjectsFactory.create_component(self.experiment, 'block', 'root component')
+        ObjectsFactory.create_component_configuration(
+            rootcomponent, ObjectsFactory.create_component(self.experiment, Component.TASK))
+        queries = count_export_queries()
+
+        for i in range(10):
+            ObjectsFactory.create_group(self.experiment)
+            ObjectsFactory.create_component_configuration(
+                rootcomponent, ObjectsFactory.create_component(self.experiment, Component.TASK))
+
+        self.assertEqual(count_export_queries(), queries)
+
+
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class ImportExperimentTest(TestCase):
     TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 
@@ -1420,6 +1461,45 @@ class ImportExperimentTest(TestCase):
 
         shutil.rmtree(self.TEMP_MEDIA_ROOT)
 
+    def test_import_all_creates_history_of_objects_imported_when_asked(self):
+        research_project = ObjectsFactory.create_research_project(owner=self.user)
+        experiment = ObjectsFactory.create_experiment(research_project)
+        ObjectsFactory.create_group(experiment)
+
+        export = ExportExperiment(experiment)
+        export.export_all()
+
+        request = RequestFactory().post(reverse('experiment_import'))
+        request.user = self.user_importer
+        old_history_count = Experiment.history.count()
+        ImportExperiment(export.get_file_path()).import_all(request, patients_to_update=[], create_history=True)
+
+        experiment_imported = Experiment.objects.last()
+        self.assertNotEqual(experiment_imported.id, experiment.id)
+        self.assertEqual(Experiment.history.count(), old_history_count + 1)
+        history = experiment_imported.history.get()
+        self.assertEqual(history.history_type, '+')
+        self.assertEqual(history.history_user, self.user_importer)
+        self.assertEqual(history.title, experiment.title)
+
+    def test_import_all_keeps_dates_set_automatically_in_the_exported_objects(self):
+        patient = UtilTests.create_patient(self.user)
+        experiment = self._create_minimum_objects_to_test_patient(patient)
+        medical_record = MedicalRecordData.objects.create(patient=patient, record_responsible=self.user)
+        old_date = datetime(2015, 3, 9, 10, 30, tzinfo=timezone.utc)
+        Experiment.objects.filter(pk=experiment.pk).update(last_update=old_date)
+        MedicalRecordData.objects.filter(pk=medical_record.pk).update(record_date=old_date)
+
+        export = ExportExperiment(Experiment.objects.get(pk=experiment.pk))
+        export.export_all()
+
+        request = RequestFactory().post(reverse('experiment_import'))
+        request.user = self.user_importer
+        ImportExperiment(export.get_file_path()).import_all(request, patients_to_update=[])
+
+        self.assertEqual(Experiment.objects.exclude(pk=experiment.pk).get().last_update, old_date)
+        self.assertEqual(MedicalRecordData.objects.exclude(pk=medical_record.pk).get().record_date, old_date)
+
     def test_POST_experiment_import_file_creates_new_groups_and_returns_successful_message(self):
         research_project = ObjectsFactory.create_research_project(owner=self.user)
         experiment = ObjectsFactory.create_experiment(research_project)
@@ -4407,6 +4487,40 @@ class ImportExperimentTest(TestCase):
         dct_children = objects_after.exclude(pk=dct_parent.id).first()
         self.assertEqual(dct_children.parent, dct_parent)
 
+    def test_import_data_configuration_tree_computes_paths_of_the_imported_trees(self):
+        self._create_minimum_objects_to_test_components()
+        eeg_setting = ObjectsFactory.create_eeg_setting(self.experiment)
+        eeg_step = ObjectsFactory.create_component(self.experiment, 'eeg', kwargs={'eeg_set': eeg_setting})
+        component_configuration1 = ObjectsFactory.create_component_configuration(self.rootcomponent, eeg_step)
+        component_configuration2 = ObjectsFactory.create_component_configuration(self.rootcomponent, eeg_step)
+        dct1 = ObjectsFactory.create_data_configuration_tree(component_configuration1)
+        ObjectsFactory.create_data_configuration_tree(component_configuration2, dct1)
+        # As in exports made before the paths
+        DataConfigurationTree.objects.update(path='')
+
+        ids_objects_before = list(DataConfigurationTree.objects.values_list('id', flat=True))
+
+        export = ExportExperiment(self.experiment)
+        export.export_all()
+        file_path = export.get_file_path()
+
+        session = self.client.session
+        session['patients'] = []
+        session['patients_conflicts_resolved'] = True
+        with open(file_path, 'rb') as file:
+            session['file_name'] = file.name
+            session.save()
+            self.client.post(reverse('experiment_import'), {'file': file}, follow=True)
+
+        objects_after = DataConfigurationTree.objects.exclude(pk__in=ids_objects_before)
+        dct_parent = objects_after.get(parent=None)
+        dct_child = objects_after.get(parent=dct_parent)
+        self.assertNotIn(dct_parent.component_configuration_id,
+                         [component_configuration1.id, component_configuration2.id])
+        self.assertEqual(dct_parent.path, '/%s/' % dct_parent.component_configuration_id)
+        self.assertEqual(dct_child.path, '/%s/%s/' % (
+            dct_parent.component_configuration_id, dct_child.component_configuration_id))
+
     # Tests for Component Additional Data
     def _create_all_data_collections(self):
         # Base elements
@@ -5288,6 +5402,8 @@ class ImportExperimentTest(TestCase):
             message, 'Não foi possível atualizar todas as respostas.')
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class ExperimentQuestionnaireTest(ExperimentTestCase):
 
     def setUp(self):
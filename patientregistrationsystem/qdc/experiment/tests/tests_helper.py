@@ -29,6 +29,25 @@ from patient.tests.tests_orig import UtilTests
 from survey.tests.tests_helper import create_survey
 
 
+class CountingList(list):
+    """List counting the items read from it, to check how many times an
+    algorithm goes through its input
+    """
+
+    def __init__(self, *args):
+        super(CountingList, self).__init__(*args)
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return super(CountingList, self).__getitem__(index)
+
+    def __iter__(self):
+        for item in super(CountingList, self).__iter__():
+            self.reads += 1
+            yield item
+
+
 class ExperimentTestCase(TestCase):
 
     def setUp(self):
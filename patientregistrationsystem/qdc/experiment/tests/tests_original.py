@@ -5,6 +5,7 @@ import tempfile
 
 from unittest.mock import patch
 
+from django.conf import settings
 from django.test import TestCase, override_settings
 from django.core.urlresolvers import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -917,6 +918,8 @@ class ListOfQuestionnaireFromExperimentalProtocolOfAGroupTest(TestCase):
         questionnaire_response.save()
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class SubjectTest(TestCase):
     util = UtilTests()
     data = {}
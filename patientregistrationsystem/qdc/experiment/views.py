@@ -1,6 +1,5 @@
 # coding=utf-8
 import csv
-import re
 import json
 import random
 import tempfile
@@ -41,7 +40,6 @@ from django.http import HttpResponseRedirect, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render, render_to_response
 from django.utils.encoding import smart_str
 from django.utils.translation import ugettext as _
-from django.core.cache import cache
 
 from experiment.import_export import ExportExperiment, ImportExperiment
 from patient.views import update_completed_status, update_acquisition_date
@@ -103,6 +101,10 @@ from .portal import get_experiment_status_portal, \
     send_additional_data_to_portal, send_publication_to_portal, \
     send_experiment_researcher_to_portal
 
+from . import eeg_cache
+from .checksum import file_checksum
+from .portal_sending import PortalSending
+from .protocol_index import create_list_of_trees
 from .pdf import render as render_to_pdf
 
 from configuration.models import LocalInstitution
@@ -112,11 +114,12 @@ from export.forms import ParticipantsSelectionForm, AgeIntervalForm
 
 from patient.models import Patient, \
     QuestionnaireResponse as PatientQuestionnaireResponse, \
-    SocialDemographicData
+    SocialDemographicData, PatientSearchToken
 
-from survey.abc_search_engine import Questionnaires
+from survey.abc_search_engine import Questionnaires, ConcurrentQuestionnaires
+from survey.token_completion import TokenCompletionMirror
 from survey.models import Survey, SensitiveQuestion
-from survey.views import get_questionnaire_responses, check_limesurvey_access, create_list_of_trees, \
+from survey.views import get_questionnaire_responses, check_limesurvey_access, \
     get_questionnaire_language, get_survey_header, questionnaire_evaluation_fields_excluded
 
 
@@ -156,8 +159,37 @@ delimiter = "-"
 
 
 class EEGReading:
+    """Reading of an EEG file by MNE. The header of the reading is kept in the
+    cache of the file (see experiment.eeg_cache), so the file is only parsed
+    when the reading itself is used.
+    """
     file_format = None
-    reading = None
+    header = None
+
+    def __init__(self, eeg_file=None, preload=False):
+        self.eeg_file = eeg_file
+        self.preload = preload
+        self._reading = None
+        self._read = eeg_file is None
+
+    @property
+    def reading(self):
+        if not self._read:
+            self._reading = read_eeg_file(self.eeg_file, self.preload)
+            self._read = True
+        return self._reading
+
+    @reading.setter
+    def reading(self, value):
+        self._reading = value
+        self._read = True
+
+    @property
+    def is_valid(self):
+        """
+        :return: True if the file could be read in its format
+        """
+        return bool(self.header and self.header['valid'])
 
 
 @login_required
@@ -1052,22 +1084,31 @@ def schedule_of_sending_list(request, template_name="experiment/schedule_of_send
 
 
 def date_of_first_data_collection(subject_of_group):
+    return dates_of_first_data_collection([subject_of_group.id]).get(subject_of_group.id)
 
-    result = None
 
-    dates_to_compare = [
-        QuestionnaireResponse.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min'],
-        EEGData.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min'],
-        EMGData.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min'],
-        AdditionalData.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min'],
-        TMSData.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min'],
-        DigitalGamePhaseData.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min'],
-        GenericDataCollectionData.objects.filter(subject_of_group=subject_of_group).aggregate(Min('date'))['date__min']
+def dates_of_first_data_collection(subject_of_group_ids):
+    """Dates of the first data collections of many subjects of group, in one
+    query for all the kinds of data collection
+    :param subject_of_group_ids: list of SubjectOfGroup ids
+    :return: dict with the date of the first data collection by subject of
+    group id, without the subjects of group with no data collection
+    """
+    subject_of_group_ids = list(subject_of_group_ids)
+    if not subject_of_group_ids:
+        return {}
+
+    queries = [
+        model.objects.filter(subject_of_group_id__in=subject_of_group_ids).order_by().values_list(
+            'subject_of_group_id').annotate(first_date=Min('date'))
+        for model in (QuestionnaireResponse, EEGData, EMGData, AdditionalData, TMSData, DigitalGamePhaseData,
+                      GenericDataCollectionData)
     ]
 
-    for date_to_compare in dates_to_compare:
-        if date_to_compare:
-            result = min(result, date_to_compare) if result else date_to_compare
+    result = {}
+    for subject_of_group_id, first_date in queries[0].union(*queries[1:], all=True):
+        if first_date and (subject_of_group_id not in result or first_date < result[subject_of_group_id]):
+            result[subject_of_group_id] = first_date
 
     return result
 
@@ -1080,104 +1121,96 @@ def send_all_experiments_to_portal():
         print("\nExperiment %s - %s\n" % (schedule_of_sending.experiment.id,
                                           schedule_of_sending.experiment.title))
 
-        if send_experiment_to_portal(schedule_of_sending.experiment):
+        # Objects sent by a former sending of the schedule that stopped are not sent again
+        sending = PortalSending(schedule_of_sending)
+        experiment = schedule_of_sending.experiment
+
+        sending.send('experiment', send_experiment_to_portal, experiment)
+        if sending.is_sent('experiment'):
 
             # sending research project
-            created_research_project = send_research_project_to_portal(schedule_of_sending.experiment)
+            portal_research_project_id = sending.send(
+                'research_project', send_research_project_to_portal, experiment)
 
             # sending researcher
-            send_researcher_to_portal(created_research_project['id'],
-                                      schedule_of_sending.experiment.research_project.owner)
+            sending.send('researcher', send_researcher_to_portal,
+                         portal_research_project_id, experiment.research_project.owner)
 
             list_of_eeg_setting = {}
             list_of_emg_setting = {}
             list_of_tms_setting = {}
             list_of_context_tree = {}
 
-            # sending experiment researchers
-            for experiment_researcher in \
-                    schedule_of_sending.experiment.researchers.all():
-                # only send experiment researcher with first_name and
-                # last_name
-                if not experiment_researcher.researcher.first_name and \
-                        not \
-                        experiment_researcher.researcher.last_name:
-                    continue
-                else:
-                    send_experiment_researcher_to_portal(
-                        experiment_researcher
-                    )
-
-            # sending publications
-            for publication in \
-                    schedule_of_sending.experiment.publication_set.all():
-                send_publication_to_portal(
-                    publication, schedule_of_sending.experiment.id
-                )
+            # sending experiment researchers (only the ones with first_name or last_name) and publications
+            sends = [
+                ('experiment_researcher:%s' % experiment_researcher.id, send_experiment_researcher_to_portal,
+                 (experiment_researcher,))
+                for experiment_researcher in experiment.researchers.all()
+                if experiment_researcher.researcher.first_name or experiment_researcher.researcher.last_name
+            ]
+            sends += [
+                ('publication:%s' % publication.id, send_publication_to_portal, (publication, experiment.id))
+                for publication in experiment.publication_set.all()
+            ]
+            sending.send_concurrently(sends)
 
             # sending groups
-            for group in schedule_of_sending.experiment.groups.all():
-                portal_group = send_group_to_portal(group)
+            for group in experiment.groups.all():
+                portal_group_id = sending.send('group:%s' % group.id, send_group_to_portal, group)
 
-                # eeg settings
-                list_of_eeg_configuration = create_list_of_trees(group.experimental_protocol, "eeg")
-                for path_tree in list_of_eeg_configuration:
+                # eeg, emg and tms settings of the steps and of the data collections, and context trees
+                eeg_settings = {}
+                for path_tree in create_list_of_trees(group.experimental_protocol, "eeg"):
                     component_id = ComponentConfiguration.objects.get(pk=path_tree[-1][0]).component_id
                     eeg_setting = EEG.objects.get(pk=component_id).eeg_setting
-                    if eeg_setting.id not in list_of_eeg_setting:
-                        portal_eeg_setting = send_eeg_setting_to_portal(eeg_setting)
-                        list_of_eeg_setting[eeg_setting.id] = portal_eeg_setting['id']
-
+                    eeg_settings[eeg_setting.id] = eeg_setting
                 for eeg_data in EEGData.objects.filter(subject_of_group__group__experiment=group.experiment):
-                    if eeg_data.eeg_setting.id not in list_of_eeg_setting:
-                        portal_eeg_setting = send_eeg_setting_to_portal(eeg_data.eeg_setting)
-                        list_of_eeg_setting[eeg_data.eeg_setting.id] = portal_eeg_setting['id']
+                    eeg_settings[eeg_data.eeg_setting_id] = eeg_data.eeg_setting
 
-                # emg settings
-                list_of_emg_configuration = create_list_of_trees(group.experimental_protocol, "emg")
-                for path_tree in list_of_emg_configuration:
+                emg_settings = {}
+                for path_tree in create_list_of_trees(group.experimental_protocol, "emg"):
                     component_id = ComponentConfiguration.objects.get(pk=path_tree[-1][0]).component_id
                     emg_setting = EMG.objects.get(pk=component_id).emg_setting
-                    if emg_setting.id not in list_of_emg_setting:
-                        portal_emg_setting = send_emg_setting_to_portal(emg_setting)
-                        list_of_emg_setting[emg_setting.id] = portal_emg_setting['id']
-
+                    emg_settings[emg_setting.id] = emg_setting
                 for emg_data in EMGData.objects.filter(subject_of_group__group__experiment=group.experiment):
-                    if emg_data.emg_setting.id not in list_of_emg_setting:
-                        portal_emg_setting = send_emg_setting_to_portal(emg_data.emg_setting)
-                        list_of_emg_setting[emg_data.emg_setting.id] = portal_emg_setting['id']
+                    emg_settings[emg_data.emg_setting_id] = emg_data.emg_setting
 
-                # tms settings
-                list_of_tms_configuration = create_list_of_trees(group.experimental_protocol, "tms")
-                for path_tree in list_of_tms_configuration:
+                tms_settings = {}
+                for path_tree in create_list_of_trees(group.experimental_protocol, "tms"):
                     component_id = ComponentConfiguration.objects.get(pk=path_tree[-1][0]).component_id
                     tms_setting = TMS.objects.get(pk=component_id).tms_setting
-                    if tms_setting.id not in list_of_tms_setting:
-                        portal_tms_setting = send_tms_setting_to_portal(tms_setting)
-                        list_of_tms_setting[tms_setting.id] = portal_tms_setting['id']
-
+                    tms_settings[tms_setting.id] = tms_setting
                 for tms_data in TMSData.objects.filter(subject_of_group__group__experiment=group.experiment):
-                    if tms_data.tms_setting.id not in list_of_tms_setting:
-                        portal_tms_setting = send_tms_setting_to_portal(tms_data.tms_setting)
-                        list_of_tms_setting[tms_data.tms_setting.id] = portal_tms_setting['id']
-
-                # context trees
-                list_of_digital_game_phase_configuration = \
-                    create_list_of_trees(group.experimental_protocol, "digital_game_phase")
-                for path_tree in list_of_digital_game_phase_configuration:
+                    tms_settings[tms_data.tms_setting_id] = tms_data.tms_setting
+
+                context_trees = {}
+                for path_tree in create_list_of_trees(group.experimental_protocol, "digital_game_phase"):
                     component_id = ComponentConfiguration.objects.get(pk=path_tree[-1][0]).component_id
                     context_tree = DigitalGamePhase.objects.get(pk=component_id).context_tree
-                    if context_tree.id not in list_of_context_tree:
-                        portal_context_tree = send_context_tree_to_portal(context_tree)
-                        list_of_context_tree[context_tree.id] = portal_context_tree['id']
+                    context_trees[context_tree.id] = context_tree
+
+                for name, function, objects, list_of_portal_id in (
+                        ('eeg_setting', send_eeg_setting_to_portal, eeg_settings, list_of_eeg_setting),
+                        ('emg_setting', send_emg_setting_to_portal, emg_settings, list_of_emg_setting),
+                        ('tms_setting', send_tms_setting_to_portal, tms_settings, list_of_tms_setting),
+                        ('context_tree', send_context_tree_to_portal, context_trees, list_of_context_tree)):
+                    object_ids = list(objects)
+                    portal_ids = sending.send_concurrently(
+                        ('%s:%s' % (name, object_id), function, (objects[object_id],)) for object_id in object_ids)
+                    list_of_portal_id.update(zip(object_ids, portal_ids))
 
                 # participants
-                portal_participant_list = {}
-                for subject_of_group in group.subjectofgroup_set.all():
-                    first_data_collection = date_of_first_data_collection(subject_of_group)
-                    portal_participant = send_participant_to_portal(schedule_of_sending, portal_group['id'],
-                                                                    subject_of_group.subject, first_data_collection)
-                    portal_participant_list[subject_of_group.id] = portal_participant['id']
+                subjects_of_group = list(group.subjectofgroup_set.select_related('subject__patient__gender'))
+                first_data_collections = dates_of_first_data_collection(
+                    [subject_of_group.id for subject_of_group in subjects_of_group])
+                portal_participant_ids = sending.send_concurrently(
+                    ('participant:%s' % subject_of_group.id, send_participant_to_portal,
+                     (schedule_of_sending, portal_group_id, subject_of_group.subject,
+                      first_data_collections.get(subject_of_group.id)))
+                    for subject_of_group in subjects_of_group
+                )
+                portal_participant_list = dict(
+                    zip([subject_of_group.id for subject_of_group in subjects_of_group], portal_participant_ids))
 
                 # experimental protocol
                 portal_step_list = {}
@@ -1189,78 +1222,83 @@ def send_all_experiments_to_portal():
 
                     # Steps
                     step_list = send_steps_to_portal(
-                        portal_group['id'], tree, list_of_eeg_setting, list_of_emg_setting,
-                        list_of_tms_setting, list_of_context_tree, language_code)
+                        portal_group_id, tree, list_of_eeg_setting, list_of_emg_setting,
+                        list_of_tms_setting, list_of_context_tree, language_code, sending=sending)
                     root_step_id = step_list['0']['portal_step_id']
 
                     list_of_trees = create_list_of_trees(group.experimental_protocol, None)
+                    data_configuration_tree_ids = list_data_configuration_trees(
+                        [item[0] for item in tree] for tree in list_of_trees)
                     for tree in list_of_trees:
-                        path_tree = [item[0] for item in tree]
-                        data_configuration_tree_id = list_data_configuration_tree(path_tree[-1], path_tree)
+                        data_configuration_tree_id = data_configuration_tree_ids.get(tuple(item[0] for item in tree))
                         numeration = tree[-1][-1]
                         step_list[numeration]['data_configuration_tree_id'] = data_configuration_tree_id
                         if data_configuration_tree_id:
                             portal_step_list[data_configuration_tree_id] = step_list[numeration]['portal_step_id']
 
-                    # eeg data
-                    eeg_data_list = EEGData.objects.filter(subject_of_group__group=group)
+                    eeg_data_list = list(EEGData.objects.filter(subject_of_group__group=group))
+                    emg_data_list = list(EMGData.objects.filter(subject_of_group__group=group))
+                    tms_data_list = TMSData.objects.filter(subject_of_group__group=group)
+                    digital_game_phase_data_list = list(
+                        DigitalGamePhaseData.objects.filter(subject_of_group__group=group))
+                    additional_data_list = list(AdditionalData.objects.filter(subject_of_group__group=group))
+                    generic_data_collection_data_list = list(
+                        GenericDataCollectionData.objects.filter(subject_of_group__group=group))
+
+                    # Files of the data collections, sent before the data collections that refer to them.
+                    # Files are identified by their checksum, so identical files are sent once
+                    file_sends = {}
+                    for data_list, files_name in (
+                            (eeg_data_list, 'eeg_files'),
+                            (emg_data_list, 'emg_files'),
+                            (digital_game_phase_data_list, 'digital_game_phase_files'),
+                            (additional_data_list, 'additional_data_files'),
+                            (generic_data_collection_data_list, 'generic_data_collection_files')):
+                        for data in data_list:
+                            data.portal_file_keys = []
+                            for data_file in getattr(data, files_name).all():
+                                key = 'file:%s' % file_checksum(data_file.file.path)
+                                data.portal_file_keys.append(key)
+                                file_sends.setdefault(key, (key, send_file_to_portal, (data_file.file.name,)))
+                    sending.send_concurrently(file_sends.values())
+
+                    def portal_file_id_list(data):
+                        return [sending.sent(key) for key in data.portal_file_keys]
+
+                    # Data collections
+                    data_sends = []
 
                     for eeg_data in eeg_data_list:
-
-                        portal_file_id_list = []
-                        for eeg_file in eeg_data.eeg_files.all():
-                            portal_file = send_file_to_portal(eeg_file.file.name)
-                            portal_file_id_list.append(portal_file['id'])
-
-                        send_eeg_data_to_portal(
-                            portal_participant_list[eeg_data.subject_of_group.id],
-                            portal_step_list[eeg_data.data_configuration_tree.id],
-                            portal_file_id_list,
-                            list_of_eeg_setting[eeg_data.eeg_setting.id],
-                            eeg_data)
-
-                    # Emg data
-                    emg_data_list = EMGData.objects.filter(subject_of_group__group=group)
+                        data_sends.append(('eeg_data:%s' % eeg_data.id, send_eeg_data_to_portal, (
+                            portal_participant_list[eeg_data.subject_of_group_id],
+                            portal_step_list[eeg_data.data_configuration_tree_id],
+                            portal_file_id_list(eeg_data),
+                            list_of_eeg_setting[eeg_data.eeg_setting_id],
+                            eeg_data)))
 
                     for emg_data in emg_data_list:
-
-                        portal_file_id_list = []
-                        for emg_file in emg_data.emg_files.all():
-                            portal_file = send_file_to_portal(emg_file.file.name)
-                            portal_file_id_list.append(portal_file['id'])
-
-                        send_emg_data_to_portal(
-                            portal_participant_list[emg_data.subject_of_group.id],
-                            portal_step_list[emg_data.data_configuration_tree.id],
-                            portal_file_id_list,
-                            list_of_emg_setting[emg_data.emg_setting.id],
-                            emg_data)
-
-                    # Tms data
-                    tms_data_files = TMSData.objects.filter(subject_of_group__group=group)
-
-                    for tms_data_file in tms_data_files:
-                        send_tms_data_to_portal(
-                            portal_participant_list[tms_data_file.subject_of_group.id],
-                            portal_step_list[tms_data_file.data_configuration_tree.id],
-                            list_of_tms_setting[tms_data_file.tms_setting.id],
-                            tms_data_file)
-
-                    # Digital game phase data
-                    digital_game_phase_data_list = DigitalGamePhaseData.objects.filter(subject_of_group__group=group)
+                        data_sends.append(('emg_data:%s' % emg_data.id, send_emg_data_to_portal, (
+                            portal_participant_list[emg_data.subject_of_group_id],
+                            portal_step_list[emg_data.data_configuration_tree_id],
+                            portal_file_id_list(emg_data),
+                            list_of_emg_setting[emg_data.emg_setting_id],
+                            emg_data)))
+
+                    for tms_data_file in tms_data_list:
+                        data_sends.append(('tms_data:%s' % tms_data_file.id, send_tms_data_to_portal, (
+                            portal_participant_list[tms_data_file.subject_of_group_id],
+                            portal_step_list[tms_data_file.data_configuration_tree_id],
+                            list_of_tms_setting[tms_data_file.tms_setting_id],
+                            tms_data_file)))
 
                     for digital_game_phase_data in digital_game_phase_data_list:
-
-                        portal_file_id_list = []
-                        for digital_game_phase_file in digital_game_phase_data.digital_game_phase_files.all():
-                            portal_file = send_file_to_portal(digital_game_phase_file.file.name)
-                            portal_file_id_list.append(portal_file['id'])
-
-                        send_digital_game_phase_data_to_portal(
-                            portal_participant_list[digital_game_phase_data.subject_of_group.id],
-                            portal_step_list[digital_game_phase_data.data_configuration_tree.id],
-                            portal_file_id_list,
-                            digital_game_phase_data)
+                        data_sends.append((
+                            'digital_game_phase_data:%s' % digital_game_phase_data.id,
+                            send_digital_game_phase_data_to_portal, (
+                                portal_participant_list[digital_game_phase_data.subject_of_group_id],
+                                portal_step_list[digital_game_phase_data.data_configuration_tree_id],
+                                portal_file_id_list(digital_game_phase_data),
+                                digital_game_phase_data)))
 
                     # Questionnaire response
                     surveys = Questionnaires()
@@ -1270,6 +1308,10 @@ def send_all_experiments_to_portal():
                         questionnaire_responses = QuestionnaireResponse.objects.filter(subject_of_group__group=group)
 
                         for questionnaire_response in questionnaire_responses:
+                            key = 'questionnaire_response:%s' % questionnaire_response.id
+                            if sending.is_sent(key):
+                                continue
+
                             component_id = questionnaire_response.data_configuration_tree.component_configuration.component_id
                             questionnaire = Questionnaire.objects.get(pk=component_id)
                             limesurvey_id = questionnaire.survey.lime_survey_id
@@ -1315,55 +1357,40 @@ def send_all_experiments_to_portal():
                                             limesurvey_response['questions'].append(question_name)
                                             limesurvey_response['answers'].append(responses_list[1][question_index])
 
-                            send_questionnaire_response_to_portal(
-                                portal_participant_list[questionnaire_response.subject_of_group.id],
-                                portal_step_list[questionnaire_response.data_configuration_tree.id],
+                            data_sends.append((key, send_questionnaire_response_to_portal, (
+                                portal_participant_list[questionnaire_response.subject_of_group_id],
+                                portal_step_list[questionnaire_response.data_configuration_tree_id],
                                 json.dumps(limesurvey_response),
-                                questionnaire_response)
+                                questionnaire_response)))
 
                         surveys.release_session_key()
 
                     # additional data
-                    additional_data_list = \
-                        AdditionalData.objects.filter(subject_of_group__group=group)
-
                     for additional_data in additional_data_list:
-
-                        portal_file_id_list = []
-                        for additional_data_file in additional_data.additional_data_files.all():
-                            portal_file = send_file_to_portal(additional_data_file.file.name)
-                            portal_file_id_list.append(portal_file['id'])
-
                         # TODO: send additional_file associated to the whole experiment
-                        send_additional_data_to_portal(
-                            portal_participant_list[additional_data.subject_of_group.id],
+                        data_sends.append(('additional_data:%s' % additional_data.id, send_additional_data_to_portal, (
+                            portal_participant_list[additional_data.subject_of_group_id],
                             portal_step_list[
-                                additional_data.data_configuration_tree.id
-                            ] if additional_data.data_configuration_tree else
+                                additional_data.data_configuration_tree_id
+                            ] if additional_data.data_configuration_tree_id else
                             None,
-                            portal_file_id_list,
-                            additional_data
-                        )
+                            portal_file_id_list(additional_data),
+                            additional_data)))
 
                     # Generic data collection data
-                    generic_data_collection_data_list = GenericDataCollectionData.objects.filter(
-                        subject_of_group__group=group)
-
                     for generic_data_collection_data in generic_data_collection_data_list:
+                        data_sends.append((
+                            'generic_data_collection_data:%s' % generic_data_collection_data.id,
+                            send_generic_data_collection_data_to_portal, (
+                                portal_participant_list[generic_data_collection_data.subject_of_group_id],
+                                portal_step_list[generic_data_collection_data.data_configuration_tree_id],
+                                portal_file_id_list(generic_data_collection_data),
+                                generic_data_collection_data)))
 
-                        portal_file_id_list = []
-                        for generic_data_collection_file in generic_data_collection_data.generic_data_collection_files.all():
-                            portal_file = send_file_to_portal(generic_data_collection_file.file.name)
-                            portal_file_id_list.append(portal_file['id'])
+                    sending.send_concurrently(data_sends)
 
-                        send_generic_data_collection_data_to_portal(
-                            portal_participant_list[generic_data_collection_data.subject_of_group.id],
-                            portal_step_list[generic_data_collection_data.data_configuration_tree.id],
-                            portal_file_id_list, generic_data_collection_data)
-
-                    send_experimental_protocol_to_portal(
-                        portal_group_id=portal_group['id'], textual_description=textual_description,
-                        image=image, root_step_id=root_step_id)
+                    sending.send('experimental_protocol:%s' % group.id, send_experimental_protocol_to_portal,
+                                 portal_group_id, textual_description, image, root_step_id)
 
             # End of sending
             send_experiment_end_message_to_portal(schedule_of_sending.experiment)
@@ -1372,6 +1399,7 @@ def send_all_experiments_to_portal():
             schedule_of_sending.status = 'sent'
             schedule_of_sending.sending_datetime = datetime.now() + timedelta(seconds=5)
             schedule_of_sending.save()
+            sending.finish()
 
             # Update the last sending date
             experiment = schedule_of_sending.experiment
@@ -4774,7 +4802,7 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
         subject_list = SubjectOfGroup.objects.filter(group=group).order_by('subject__patient__name')
 
     subject_list_with_status = []
-    surveys = Questionnaires()
+    surveys = ConcurrentQuestionnaires()
     limesurvey_available = check_limesurvey_access(request, surveys)
 
     can_remove = True
@@ -4806,41 +4834,83 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
             if 'goalkeeper' in settings.DATABASES and GoalkeeperGameLog.objects.using('goalkeeper').first():
                 goalkeeper = True
 
+        # Data configuration tree of each step of the experimental protocol of the group with data collection
+        data_configuration_tree_ids = list_data_configuration_trees(
+            [item[0] for item in configuration]
+            for list_of_configuration in (
+                list_of_questionnaires_configuration, list_of_eeg_configuration, list_of_emg_configuration,
+                list_of_tms_configuration, list_of_digital_game_phase_configuration,
+                list_of_generic_data_collection_configuration)
+            for configuration in list_of_configuration
+        )
+
+        # Path, component configuration and LimeSurvey id of each questionnaire in the experimental protocol of
+        # the group
+        questionnaires_of_protocol = []
+        for questionnaire_configuration in list_of_questionnaires_configuration:
+            path = [item[0] for item in questionnaire_configuration]
+            component_configuration = get_object_or_404(ComponentConfiguration, pk=path[-1])
+            questionnaires_of_protocol.append((
+                data_configuration_tree_ids.get(tuple(path)),
+                component_configuration,
+                Questionnaire.objects.get(id=component_configuration.component.id).survey.lime_survey_id
+            ))
+
+        # Get the responses of each subject to each questionnaire. Responses are only checked if there are
+        # enough of them; this is a shortcut that allows to avoid the delay of the connection to LimeSurvey.
+        responses_of_subjects = {}
+        for subject_of_group in subject_list:
+            for index, (data_configuration_tree_id, questionnaire_configuration, lime_survey_id) in \
+                    enumerate(questionnaires_of_protocol):
+                subject_responses = list(QuestionnaireResponse.objects.filter(
+                    subject_of_group=subject_of_group, data_configuration_tree_id=data_configuration_tree_id))
+
+                if (questionnaire_configuration.number_of_repetitions is None and len(subject_responses) > 0) or \
+                        (questionnaire_configuration.number_of_repetitions is not None and
+                         len(subject_responses) >= questionnaire_configuration.number_of_repetitions):
+                    responses_of_subjects[subject_of_group.id, index] = subject_responses
+
+        # Check if the responses not completed yet were completed, reading the completion of all the tokens of
+        # each survey at once, unless it was read recently
+        responses_to_check = [
+            (subject_response, questionnaires_of_protocol[index][2])
+            for (subject_of_group_id, index), subject_responses in responses_of_subjects.items()
+            for subject_response in subject_responses
+            if subject_response.is_completed == "N" or subject_response.is_completed == ""
+        ]
+        token_completion = TokenCompletionMirror(surveys)
+        token_completion.refresh(lime_survey_id for subject_response, lime_survey_id in responses_to_check)
+        for subject_response, lime_survey_id in responses_to_check:
+            if not token_completion.failed(lime_survey_id):
+                token_completion.completed(lime_survey_id, subject_response)
+
+        # Check the responses of the surveys whose tokens could not be listed one by one, at the same time
+        responses_to_check = [
+            (subject_response, lime_survey_id) for subject_response, lime_survey_id in responses_to_check
+            if token_completion.failed(lime_survey_id)
+        ]
+        completed_list = surveys.gather(
+            ('get_participant_properties', lime_survey_id, subject_response.token_id, "completed")
+            for subject_response, lime_survey_id in responses_to_check
+        )
+        for (subject_response, lime_survey_id), is_completed in zip(responses_to_check, completed_list):
+            subject_response.is_completed = is_completed or ""
+            subject_response.save()
+
         # For each subject of the group...
         for subject_of_group in subject_list:
 
             number_of_questionnaires_filled = 0
 
             # For each questionnaire in the experimental protocol of the group...
-            for questionnaire_configuration in list_of_questionnaires_configuration:
-                # Get the responses
-                path = [item[0] for item in questionnaire_configuration]
-                data_configuration_tree_id = list_data_configuration_tree(path[-1], path)
-                subject_responses = QuestionnaireResponse.objects. \
-                    filter(subject_of_group=subject_of_group,
-                           data_configuration_tree_id=data_configuration_tree_id)
-
-                questionnaire_configuration = get_object_or_404(ComponentConfiguration, pk=path[-1])
-                # This is a shortcut that allows to avoid the delay of the connection to LimeSurvey.
-                if (questionnaire_configuration.number_of_repetitions is None and subject_responses.count() > 0) or \
-                        (questionnaire_configuration.number_of_repetitions is not None and
-                         subject_responses.count() >= questionnaire_configuration.number_of_repetitions):
+            for index, (data_configuration_tree_id, questionnaire_configuration, lime_survey_id) in \
+                    enumerate(questionnaires_of_protocol):
+                if (subject_of_group.id, index) in responses_of_subjects:
 
                     # Count the number of completed responses
                     amount_of_completed_responses = 0
 
-                    for subject_response in subject_responses:
-                        # Check if completed
-                        if subject_response.is_completed == "N" or subject_response.is_completed == "":
-                            is_completed = surveys.get_participant_properties(
-                                Questionnaire.objects.get(
-                                    id=questionnaire_configuration.component.id).survey.lime_survey_id,
-                                subject_response.token_id,
-                                "completed") or ""
-
-                            subject_response.is_completed = is_completed
-                            subject_response.save()
-
+                    for subject_response in responses_of_subjects[subject_of_group.id, index]:
                         if subject_response.is_completed == "N" or subject_response.is_completed == "":
                             # If there is an incomplete response for a questionnaire, this questionnaire is counted
                             # as not completed.
@@ -4869,7 +4939,7 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
             # for each component_configuration of eeg...
             for eeg_configuration in list_of_eeg_configuration:
                 path = [item[0] for item in eeg_configuration]
-                data_configuration_tree_id = list_data_configuration_tree(path[-1], path)
+                data_configuration_tree_id = data_configuration_tree_ids.get(tuple(path))
                 eeg_data_files = \
                     EEGData.objects.filter(subject_of_group=subject_of_group,
                                            data_configuration_tree_id=data_configuration_tree_id)
@@ -4886,7 +4956,7 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
             # for each component_configuration of emg...
             for emg_configuration in list_of_emg_configuration:
                 path = [item[0] for item in emg_configuration]
-                data_configuration_tree_id = list_data_configuration_tree(path[-1], path)
+                data_configuration_tree_id = data_configuration_tree_ids.get(tuple(path))
                 emg_data_files = \
                     EMGData.objects.filter(subject_of_group=subject_of_group,
                                            data_configuration_tree_id=data_configuration_tree_id)
@@ -4903,7 +4973,7 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
             # for each component_configuration of tms...
             for tms_configuration in list_of_tms_configuration:
                 path = [item[0] for item in tms_configuration]
-                data_configuration_tree_id = list_data_configuration_tree(path[-1], path)
+                data_configuration_tree_id = data_configuration_tree_ids.get(tuple(path))
                 tms_data_files = \
                     TMSData.objects.filter(subject_of_group=subject_of_group,
                                            data_configuration_tree_id=data_configuration_tree_id)
@@ -4920,7 +4990,7 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
             # for each component_configuration of tms...
             for digital_game_phase_configuration in list_of_digital_game_phase_configuration:
                 path = [item[0] for item in digital_game_phase_configuration]
-                data_configuration_tree_id = list_data_configuration_tree(path[-1], path)
+                data_configuration_tree_id = data_configuration_tree_ids.get(tuple(path))
                 digital_game_phase_data_files = \
                     DigitalGamePhaseData.objects.filter(subject_of_group=subject_of_group,
                                                         data_configuration_tree_id=data_configuration_tree_id)
@@ -4938,7 +5008,7 @@ def subjects(request, group_id, template_name="experiment/subjects.html"):
             # for each component_configuration of tms...
             for generic_data_collection_configuration in list_of_generic_data_collection_configuration:
                 path = [item[0] for item in generic_data_collection_configuration]
-                data_configuration_tree_id = list_data_configuration_tree(path[-1], path)
+                data_configuration_tree_id = data_configuration_tree_ids.get(tuple(path))
                 generic_data_collection_data_files = \
                     GenericDataCollectionData.objects.filter(
                         subject_of_group=subject_of_group, data_configuration_tree_id=data_configuration_tree_id)
@@ -5721,30 +5791,9 @@ def questionnaire_response_view(
     token_id = questionnaire_response.token_id
     language_code = request.LANGUAGE_CODE
 
-    survey_title_key = \
-        request.LANGUAGE_CODE + "-" + str(limesurvey_id) + "-" + str(token_id)\
-        + "_survey_title"
-    groups_of_questions_key = \
-        request.LANGUAGE_CODE + "-" + str(limesurvey_id) + "-" + str(token_id)\
-        + "_group_of_questions"
-
-    # TODO (NES-991): BROKEN! Made a test and fix this before close this issue.
-    #  Before that we are putting a generic exception
-    try:
-        survey_title = cache.get(survey_title_key)
-        groups_of_questions = cache.get(groups_of_questions_key)
-    except:
-        survey_title = None
-        groups_of_questions = None
-
-    if not survey_title and not groups_of_questions:
-        # Get the responses for each question of the questionnaire.
-        survey_title, groups_of_questions = get_questionnaire_responses(
-            language_code, limesurvey_id, token_id, request)
-
-        # TODO (NES-991): see BROKEN! above
-        # cache.set(survey_title_key, survey_title)
-        # cache.set(groups_of_questions_key, groups_of_questions)
+    # Get the responses for each question of the questionnaire.
+    survey_title, groups_of_questions = get_questionnaire_responses(
+        language_code, limesurvey_id, token_id, request)
 
     origin = get_origin(request)
 
@@ -6114,12 +6163,12 @@ def subject_eeg_view(request, group_id, subject_id,
 
                 # v1.5
                 # can export to nwb?
-                if eeg_file.eeg_reading.file_format and eeg_file.eeg_reading.reading:
+                if eeg_file.eeg_reading.file_format and eeg_file.eeg_reading.is_valid:
                     if eeg_file.eeg_reading.file_format.nes_code == "MNE-RawFromEGI" and \
                             hasattr(eeg_data.eeg_setting, 'eeg_amplifier_setting') and \
                             eeg_data.eeg_setting.eeg_amplifier_setting.number_of_channels_used and \
                             eeg_data.eeg_setting.eeg_amplifier_setting.number_of_channels_used == \
-                            len(mne.pick_types(eeg_file.eeg_reading.reading.info, eeg=True)):
+                            eeg_file.eeg_reading.header['number_of_eeg_channels']:
 
                         eeg_file.can_export_to_nwb = True
 
@@ -6176,27 +6225,29 @@ def create_data_configuration_tree(list_of_path):
 
 
 def list_data_configuration_tree(eeg_configuration_id, list_of_path):
-    data_configuration_tree = DataConfigurationTree.objects.filter(component_configuration_id=eeg_configuration_id)
-    list_of_path_in_db = []
-    data_configuration_tree_id = None
+    """
+    :param eeg_configuration_id: id of the last component configuration of the path
+    :param list_of_path: ids of the component configurations from the root
+    :return: id of the data configuration tree of the path, or None
+    """
+    return DataConfigurationTree.objects.filter(
+        component_configuration_id=eeg_configuration_id, path=DataConfigurationTree.make_path(list_of_path)
+    ).order_by('id').values_list('id', flat=True).first()
 
-    if data_configuration_tree:
-        for item in data_configuration_tree:
-            list_of_path_in_db.insert(0, item.component_configuration_id)
-            parent = item.parent_id
-            data_configuration_tree_id = item.id
-            while parent:
-                path = DataConfigurationTree.objects.get(id=parent)
-                list_of_path_in_db.insert(0, path.component_configuration_id)
-                parent = path.parent_id
 
-            if list_of_path_in_db == list_of_path:
-                break
-            else:
-                list_of_path_in_db = []
-                data_configuration_tree_id = None
+def list_data_configuration_trees(list_of_paths):
+    """
+    :param list_of_paths: list of paths, each a list of ids of the component configurations from the root
+    :return: dict of the id of the data configuration tree of each path found, by the path as a tuple
+    """
+    paths = {DataConfigurationTree.make_path(list_of_path): tuple(list_of_path) for list_of_path in list_of_paths}
 
-    return data_configuration_tree_id
+    data_configuration_tree_ids = {}
+    for data_configuration_tree_id, path_of_tree in DataConfigurationTree.objects.filter(
+            path__in=list(paths)).order_by('id').values_list('id', 'path'):
+        data_configuration_tree_ids.setdefault(paths[path_of_tree], data_configuration_tree_id)
+
+    return data_configuration_tree_ids
 
 
 @login_required
@@ -6283,117 +6334,169 @@ def subject_eeg_data_create(request, group_id, subject_id, eeg_configuration_id,
 
 # v1.5
 def get_sensors_position(eeg_data):
-    # Electrode localization image generation. Validate if EGI
-    reading = None
-    file_path = None
+    """Electrode localization image, made once for each version of the file
+    (see experiment.eeg_cache)
+    :param eeg_data: EEGData instance
+    :return: path of the image, or None if it can not be made
+    """
+    sensors_eeg_file = None
 
     # Getting the eeg_file, if exists
     eeg_files = eeg_data.eeg_files.all()
+    nes_code = eeg_data.file_format.nes_code
 
     if len(eeg_files) == 1:
-        for eeg_file in eeg_files:
-            nes_code = eeg_file.eeg_data.file_format.nes_code
-            if nes_code == 'MNE-RawFromEGI':
-                reading = eeg_data_reading(eeg_file, preload=False)
+        if nes_code == 'MNE-RawFromEGI':
+            sensors_eeg_file = eeg_files[0]
     elif len(eeg_files) == 3:
         for eeg_file in eeg_files:
-            nes_code = eeg_file.eeg_data.file_format.nes_code
             file_extension = eeg_file.file.path.split('.')[-1]
             if nes_code == 'MNE-RawFromBrainVision' and file_extension == 'vhdr':
-                reading = eeg_data_reading(eeg_file, preload=False)
+                sensors_eeg_file = eeg_file
 
-    if reading:
-        raw = reading.reading
+    if not sensors_eeg_file:
+        return None
 
-        if raw is not None:
-            picks = mne.pick_types(raw.info, eeg=True)
-            ch_names = raw.info['ch_names']
-            channels = len(picks)
-            montage = ""
+    file_path = eeg_cache.get_file_path(sensors_eeg_file, 'sensors_position.png')
+    if path.exists(file_path):
+        return file_path
 
-            # If EGI 129 channels
-            if nes_code == 'MNE-RawFromEGI':
-                if channels == 129:
-                    montage = mne.channels.read_montage('GSN-HydroCel-129')
+    # False when it is known the image can not be made for the file
+    if eeg_cache.get_value(sensors_eeg_file, 'sensors_position') is False:
+        return None
 
-                if channels == 128:
-                    montage = mne.channels.read_montage('GSN-HydroCel-128')
+    saved = save_sensors_position(sensors_eeg_file, nes_code, file_path)
+    eeg_cache.set_value(sensors_eeg_file, 'sensors_position', saved)
 
-                if montage != "":
-                    i = 0
-                    list1 = []
-                    list2 = []
+    return file_path if saved else None
 
-                    for ch_name in ch_names:
-                        i = i + 1
-                        if i < 10:
-                            label = 'EEG' + ' 00' + str(i)
-                        if 9 < i < 100:
-                            label = 'EEG' + ' 0' + str(i)
-                        if 99 < i < channels:
-                            label = 'EEG' + ' ' + str(i)
 
-                        if ch_name == label:
-                            list1.insert(i, 'E' + str(i))
-                            list2.insert(i, ch_name)
+def save_sensors_position(eeg_file, nes_code, file_path):
+    """Electrode localization image generation. Validate if EGI
+    :param eeg_file: EEGFile instance
+    :param nes_code: code of the file format
+    :param file_path: path of the png file
+    :return: True if the image was saved
+    """
+    raw = read_eeg_file(eeg_file, preload=False)
 
-                    list1.insert(i + 1, 'Cz')
-                    list2.insert(i + 1, 'E' + str(channels))
-                    mapping = dict(zip(list2, list1))
+    if raw is None:
+        return False
 
-                    raw.rename_channels(mapping)
-            if nes_code == 'MNE-RawFromBrainVision':
-                montage = mne.channels.read_montage('standard_1020')
+    picks = mne.pick_types(raw.info, eeg=True)
+    ch_names = raw.info['ch_names']
+    channels = len(picks)
+    montage = ""
 
-            if montage != '':
+    # If EGI 129 channels
+    if nes_code == 'MNE-RawFromEGI':
+        if channels == 129:
+            montage = mne.channels.read_montage('GSN-HydroCel-129')
 
-                raw.set_montage(montage)
+        if channels == 128:
+            montage = mne.channels.read_montage('GSN-HydroCel-128')
 
-                file_name = 'sensors_position_' + str(eeg_data.id) + ".png"
-                errors, path_complete = create_directory(settings.MEDIA_ROOT, "temp")
+        if montage != "":
+            i = 0
+            list1 = []
+            list2 = []
 
-                # The operation below ensures that the properly backend is set
-                import matplotlib as mpl
-                mpl.use('agg')
+            for ch_name in ch_names:
+                i = i + 1
+                if i < 10:
+                    label = 'EEG' + ' 00' + str(i)
+                if 9 < i < 100:
+                    label = 'EEG' + ' 0' + str(i)
+                if 99 < i < channels:
+                    label = 'EEG' + ' ' + str(i)
 
-                fig = raw.plot_sensors(
-                    ch_type='eeg', show_names=True, show=False, title="Sensor positions", ch_groups='position')
-                fig.savefig(path.join(path_complete, file_name))
+                if ch_name == label:
+                    list1.insert(i, 'E' + str(i))
+                    list2.insert(i, ch_name)
 
-                file_path = path.join(settings.MEDIA_ROOT, 'temp', file_name)
+            list1.insert(i + 1, 'Cz')
+            list2.insert(i + 1, 'E' + str(channels))
+            mapping = dict(zip(list2, list1))
 
-    return file_path
+            raw.rename_channels(mapping)
+    if nes_code == 'MNE-RawFromBrainVision':
+        montage = mne.channels.read_montage('standard_1020')
 
+    if montage == '':
+        return False
 
-def eeg_data_reading(eeg_file: EEGFile, preload=False):
+    raw.set_montage(montage)
 
-    eeg_reading = EEGReading()
+    # The operation below ensures that the properly backend is set
+    import matplotlib as mpl
+    mpl.use('agg')
+
+    fig = raw.plot_sensors(
+        ch_type='eeg', show_names=True, show=False, title="Sensor positions", ch_groups='position')
+    fig.savefig(file_path)
+
+    return True
+
+
+def read_eeg_file(eeg_file, preload=False):
+    """
+    :param eeg_file: EEGFile instance
+    :param preload: load the data of the reading in memory
+    :return: MNE Raw instance, or None if the file could not be read in its
+    format
+    """
+    reading = None
 
     # For known formats, try to access data in order to validate the format
 
     # v1.5
     if eeg_file.eeg_data.file_format.nes_code == "MNE-RawFromEGI":
-        eeg_reading.file_format = eeg_file.eeg_data.file_format
-
         try:
             # Trying to read the segments
             reading = mne.io.read_raw_egi(eeg_file.file.path, preload=preload)
         except:
             reading = None
 
-        eeg_reading.reading = reading
-
     if eeg_file.eeg_data.file_format.nes_code == "MNE-RawFromBrainVision":
-
-        eeg_reading.file_format = eeg_file.eeg_data.file_format
-
         try:
             # Trying to read the segments
             reading = mne.io.read_raw_brainvision(eeg_file.file.path, preload=preload, stim_channel=False)
         except:
             reading = None
 
-        eeg_reading.reading = reading
+    return reading
+
+
+def get_eeg_reading_header(reading):
+    """
+    :param reading: MNE Raw instance, or None
+    :return: dict with what views and exports use of the reading
+    """
+    if reading is None:
+        return {'valid': False}
+
+    return {
+        'valid': True,
+        'ch_names': list(reading.info['ch_names']),
+        'sampling_rate': reading.info['sfreq'],
+        'number_of_samples': reading.n_times,
+        'number_of_eeg_channels': len(mne.pick_types(reading.info, eeg=True)),
+    }
+
+
+def eeg_data_reading(eeg_file: EEGFile, preload=False):
+    """
+    :param eeg_file: EEGFile instance
+    :param preload: load the data in memory when the reading is used
+    :return: EEGReading instance, with the header read from the cache of the
+    file
+    """
+    eeg_reading = EEGReading(eeg_file, preload)
+
+    if eeg_file.eeg_data.file_format.nes_code in ("MNE-RawFromEGI", "MNE-RawFromBrainVision"):
+        eeg_reading.file_format = eeg_file.eeg_data.file_format
+        eeg_reading.header = eeg_cache.get_or_load(
+            eeg_file, 'header', lambda: get_eeg_reading_header(eeg_reading.reading))
 
     return eeg_reading
 
@@ -6431,7 +6534,8 @@ def eeg_data_view(request, eeg_data_id, tab, template_name="experiment/subject_e
     # Geração da imagem de localização dos electrodos (NES v1.5)
     sensors_positions_filepath = get_sensors_position(eeg_data)
     if sensors_positions_filepath:
-        sensors_positions_relativepath = path.join(settings.MEDIA_URL, 'temp', path.basename(sensors_positions_filepath))
+        sensors_positions_relativepath = path.join(
+            settings.MEDIA_URL, path.relpath(sensors_positions_filepath, settings.MEDIA_ROOT))
     else:
         sensors_positions_relativepath = None
 
@@ -6445,6 +6549,7 @@ def eeg_data_view(request, eeg_data_id, tab, template_name="experiment/subject_e
 
             # removing uploaded files
             for eeg_uploaded_file in eeg_data.eeg_files.all():
+                eeg_cache.remove_files(eeg_uploaded_file)
                 eeg_uploaded_file.file.delete()
 
             eeg_data.delete()
@@ -6531,6 +6636,7 @@ def eeg_data_edit(request, eeg_data_id, tab, template_name="experiment/subject_e
                     for current_eeg_file in eeg_data.eeg_files.all():
                         if "remove_eeg_file_" + str(current_eeg_file.id) in request.POST:
                             has_changed = True
+                            eeg_cache.remove_files(current_eeg_file)
                             current_eeg_file.delete()
 
                     # new files to upload
@@ -6892,9 +6998,8 @@ def create_nwb_file(eeg_data, eeg_reading, process_requisition, request, filenam
         if eeg_reading.file_format.nes_code == "MNE-RawFromEGI":
 
             # v1.5
-            number_of_channels = len(mne.pick_types(eeg_reading.reading.info, eeg=True))
-
-            number_of_samples = len(eeg_reading.reading._data[0])
+            array_data = get_nwb_acquisition_data(eeg_reading.reading)
+            number_of_samples, number_of_channels = array_data.shape
 
             sampling_rate = 0
             if hasattr(eeg_data.eeg_setting, 'eeg_amplifier_setting') and \
@@ -6903,14 +7008,6 @@ def create_nwb_file(eeg_data, eeg_reading, process_requisition, request, filenam
 
             timestamps = np.arange(number_of_samples) * ((1 / sampling_rate) if sampling_rate else 0)
 
-            # v1.5
-            array_data = np.zeros((number_of_samples, number_of_channels))
-            for index_channel in range(number_of_channels):
-                channel_reading = \
-                    eeg_reading.reading._data[mne.pick_types(eeg_reading.reading.info, eeg=True)[index_channel]]
-                for index, value in enumerate(channel_reading):
-                    array_data[index][index_channel] = value
-
             acquisition = neurodata.create_timeseries("ElectricalSeries", "data_collection", "acquisition")
             acquisition.set_data(array_data, resolution=1.2345e-6)
             acquisition.set_time(timestamps)
@@ -6924,6 +7021,29 @@ def create_nwb_file(eeg_data, eeg_reading, process_requisition, request, filenam
     return neurodata.file_name
 
 
+def get_nwb_acquisition_data(raw):
+    """Get the samples of the EEG channels of a reading with one row per
+    sample, as NWB ElectricalSeries stores them. The channels are transposed
+    by NumPy at once, and are not copied before that when they are
+    contiguous in the reading, so time and memory grow linearly with the
+    size of the reading.
+    :param raw: mne.io.Raw reading, with data loaded
+    :return: array (number of samples, number of EEG channels)
+    """
+    picks = mne.pick_types(raw.info, eeg=True)
+    number_of_samples = raw._data.shape[1]
+
+    if not len(picks):
+        return np.zeros((number_of_samples, 0))
+
+    if np.array_equal(picks, np.arange(picks[0], picks[0] + len(picks))):
+        channels = raw._data[picks[0]:picks[0] + len(picks)]
+    else:
+        channels = raw._data[picks]
+
+    return np.ascontiguousarray(channels.T, dtype=np.float64)
+
+
 def get_nwb_eeg_filter_description(eeg_filter_setting):
     response = _("Filter type:") + eeg_filter_setting.eeg_filter_type.name
     if eeg_filter_setting.eeg_filter_type.description:
@@ -9195,32 +9315,18 @@ def search_patients_ajax(request):
 
         if request.user.has_perm('patient.sensitive_data_patient'):
             if search_text:
-                if re.match('P{1}[0-9]', search_text):
-                    patient_list = \
-                        Patient.objects.filter(code__icontains=search_text).exclude(removed=True).order_by('code')
-                elif re.match('[a-zA-Z ]+', search_text):
-                    patient_list = \
-                        Patient.objects.filter(name__icontains=search_text).exclude(removed=True).order_by('name')
-                else:
-                    patient_list = \
-                        Patient.objects.filter(cpf__icontains=search_text).exclude(removed=True).order_by('name')
-
-                subjects_of_group = SubjectOfGroup.objects.filter(group_id=group_id)
-                for subject in subjects_of_group:
-                    if subject.subject.patient in patient_list:
-                        patient_list = patient_list.exclude(id=subject.subject.patient.id)
+                try:
+                    page = int(request.POST.get('page', 1))
+                except ValueError:
+                    page = 1
+                patient_list = PatientSearchToken.search(search_text, page, exclude_group_id=group_id)
 
             return render_to_response('experiment/ajax_search_patients.html',
                                       {'patients': patient_list, 'group_id': group_id})
         else:
             if search_text:
-                patient_list = \
-                    Patient.objects.filter(code__iexact=search_text).exclude(removed=True).order_by('code')
-
-                subjects_of_group = SubjectOfGroup.objects.filter(group_id=group_id)
-                for subject in subjects_of_group:
-                    if subject.subject.patient in patient_list:
-                        patient_list = patient_list.exclude(id=subject.subject.patient.id)
+                patient_list = Patient.objects.filter(code__iexact=search_text).exclude(removed=True).exclude(
+                    subject__subjectofgroup__group_id=group_id).order_by('code')
 
             return render_to_response('experiment/ajax_search_patients_not_sensitive.html',
                                       {'patients': patient_list, 'group_id': group_id})
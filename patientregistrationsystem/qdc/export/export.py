@@ -10,6 +10,9 @@ from csv import writer
 from datetime import date, datetime, timedelta
 from sys import modules
 from os import path, makedirs
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+import numpy as np
 
 from django.conf import settings
 from django.core.files import File
@@ -20,7 +23,8 @@ from django.apps import apps
 from django.shortcuts import get_object_or_404
 from django.template.defaultfilters import slugify
 
-from export.export_utils import create_list_of_trees, can_export_nwb
+from export.export_utils import can_export_nwb
+from experiment.protocol_index import create_list_of_trees
 from plugin.models import RandomForests
 
 from survey.survey_utils import HEADER_EXPLANATION_FIELDS, QUESTION_TYPES
@@ -43,9 +47,10 @@ from experiment.models import \
 from experiment.views import get_block_tree, get_experimental_protocol_image, \
     get_description_from_experimental_protocol_tree, get_sensors_position, \
     create_nwb_file, \
-    list_data_configuration_tree, date_of_first_data_collection
+    list_data_configuration_tree, dates_of_first_data_collection
 
-from survey.abc_search_engine import Questionnaires
+from survey.abc_search_engine import Questionnaires, ConcurrentQuestionnaires
+from survey.token_completion import TokenCompletionMirror
 from survey.views import limesurvey_available
 from survey.survey_utils import QuestionnaireUtils
 
@@ -53,6 +58,12 @@ DEFAULT_LANGUAGE = 'pt-BR'
 
 METADATA_DIRECTORY = 'Questionnaire_metadata'
 
+# Files already compressed are stored in the zip file as they are
+COMPRESSED_FILE_EXTENSIONS = [
+    '.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.png', '.jpg', '.jpeg', '.gif', '.mp3', '.mp4', '.avi',
+    '.mkv', '.nwb', '.h5', '.hdf5', '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods'
+]
+
 INPUT_DATA_KEYS = [
     'base_directory', 'export_per_participant', 'export_per_questionnaire',
     'per_participant_directory', 'per_questionnaire_directory', 'export_filename',
@@ -136,34 +147,92 @@ def save_to_csv(complete_filename, rows_to_be_saved, filesformat_type, mode='w')
             export_writer.writerow(row)
 
 
+class ResponsesMatrix:
+    """Answers exported from LimeSurvey (csv rows) in a numpy array of
+    objects, with the columns indexed by their heading, so that columns are
+    selected and filled without going through the rows one by one
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: iterable of csv rows with the headings in first row and
+        the answers in the other rows; empty rows, as the last one exported
+        by LimeSurvey, are left out
+        """
+        rows = iter(rows)
+        self.header = next(rows, [])
+        self.columns = {}
+        for index, heading in enumerate(self.header):
+            self.columns.setdefault(heading, index)
+        answers = [row for row in rows if row]
+        self.answers = np.empty((len(answers), len(self.header)), dtype=object)
+        if answers:
+            self.answers[:] = answers
+
+    def __len__(self):
+        return len(self.answers)
+
+    def column_indices(self, headings):
+        """
+        :param headings: list of headings
+        :return: array with the index of each heading that is in the header
+        """
+        return np.array(
+            [self.columns[heading] for heading in headings if heading in self.columns], dtype=int)
+
+    def question_columns(self, question_titles):
+        """
+        :param question_titles: list of question codes
+        :return: array with the indices of the columns of the questions,
+        including the columns of their subquestions ('question[subquestion]')
+        """
+        parent_questions = np.array(extract_parent_questions([self.header]), dtype=object)
+        return np.flatnonzero(np.isin(parent_questions, list(question_titles)))
+
+    def column(self, heading):
+        """
+        :param heading: heading of a column
+        :return: array with the answers of the column
+        """
+        return self.answers[:, self.columns[heading]]
+
+    def fill_empty(self, columns, value):
+        """Replace the empty answers of the columns by value
+        :param columns: array with the indices of the columns
+        :param value: answer for the empty answers
+        """
+        selected = self.answers[:, columns]
+        selected[selected == ''] = value
+        self.answers[:, columns] = selected
+
+    def rows(self):
+        """
+        :return: list of rows with the answers
+        """
+        return self.answers.tolist()
+
+
 def replace_multiple_choice_question_answers(responses_short, question_list):
     """Get responses list that are multiple choices/multiple choices with
     comments question types (from question_list), and replaces the options
     that was not selected by participants with a 'N' (options that was
     selected have 'Y' - or 'S' in Portuguese - filled.
-    :param responses_short: double array with questions in first line and
-    answers in the other lines. It's modified.
+    :param responses_short: ResponsesMatrix or double array with questions in
+    first line and answers in the other lines. It's modified.
     :param question_list: list of multiple choice/multiple choice with
     comments questions types
     """
-    parent_questions = extract_parent_questions(responses_short)
-
-    col = 0
-    max_col = len(parent_questions)
-    max_row = len(responses_short)
-    while col < max_col:
-        question = parent_questions[col]
-        if question in [
-            q['title'] for q in question_list if q['title'] == question
-        ]:
-            while col < max_col and question == parent_questions[col]:
-                # responses_short has 1 extra row
-                for row in range(1, max_row - 1):
-                    if responses_short[row][col] == '':
-                        responses_short[row][col] = 'N'
-                col += 1
-        else:
-            col += 1
+    if isinstance(responses_short, ResponsesMatrix):
+        responses = responses_short
+    else:
+        responses = ResponsesMatrix(responses_short)
+
+    responses.fill_empty(responses.question_columns(question['title'] for question in question_list), 'N')
+
+    if responses is not responses_short:
+        # responses_short has 1 extra row
+        for line, answers in zip(responses_short[1:-1], responses.rows()):
+            line[:] = answers
 
 
 def extract_parent_questions(responses_short):
@@ -240,8 +309,46 @@ class ExportExecution:
         self.questionnaires_experiment_responses = {}
         self.root_directory = ''
         self.participants_filtered_data = []
+        # Rows of the participants data by participant code, built once by
+        # set_participant_rows
+        self.participant_rows_by_code = {}
         self.per_group_data = {}
         self.questionnaire_utils = QuestionnaireUtils()
+        self.progress = None
+        # Files stored by NES included in the export, by their name in the
+        # export directory
+        self.linked_files = {}
+
+    def report_progress(self, stage, done=0, total=0):
+        """Report the stage of the export, and how much of it is done, to
+        the function given by export_create, if any
+        """
+        if self.progress:
+            self.progress(stage, done, total)
+
+    def link_file(self, source_filename, export_filename):
+        """Include in the export a file stored by NES without copying it:
+        the file is read from where it is stored when the zip file is
+        written
+        :param source_filename: path of the file stored by NES
+        :param export_filename: path of the file in the export directory
+        """
+        self.linked_files[export_filename] = source_filename
+
+    def write_zip_file(self, zip_filename):
+        """Write the files to zip into the zip file, reading the files
+        linked from where they are stored. Files are read in chunks by
+        ZipFile, so the memory used does not depend on their size.
+        :param zip_filename: path of the zip file
+        """
+        with ZipFile(zip_filename, 'w', ZIP_DEFLATED, allowZip64=True) as zip_file:
+            for index, (filename, directory, *resource) in enumerate(self.files_to_zip_list):
+                self.report_progress('zip', index, len(self.files_to_zip_list))
+                fdir, fname = path.split(filename)
+                extension = path.splitext(fname)[1].lower()
+                zip_file.write(
+                    self.linked_files.get(filename, filename).encode('utf-8'), path.join(directory, fname),
+                    ZIP_STORED if extension in COMPRESSED_FILE_EXTENSIONS else ZIP_DEFLATED)
 
     @staticmethod
     def _temp_method_to_remove_undesirable_line(fields):
@@ -392,6 +499,8 @@ class ExportExecution:
         :param subjects_of_groups: participants
         """
         surveys = Questionnaires()
+        # The completion of the tokens of each survey is read once per export
+        token_completion = TokenCompletionMirror(surveys, sync_interval=0)
         header_step_list = ['Step', 'Step identification', 'Path questionnaire', 'Data completed']
         for group_id in groups:
             group = get_object_or_404(Group, pk=group_id)
@@ -460,8 +569,8 @@ class ExportExecution:
                                             subject_of_group=subject_of_group)
                                     for questionnaire_response in experiment_questionnaire_response_list:
                                         token_id = questionnaire_response.token_id
-                                        completed = surveys.get_participant_properties(
-                                            questionnaire_id, token_id, 'completed')
+                                        completed = token_completion.completed(
+                                            questionnaire_id, questionnaire_response)
                                         # load complete questionnaires data
                                         if completed is not None and completed != 'N' and completed != '':
                                             subject_code = questionnaire_response.subject_of_group.subject.patient.code
@@ -871,16 +980,27 @@ class ExportExecution:
 
         return participant_list
 
+    def set_participant_rows(self, export_rows_participants):
+        """Set the participants data, header first, and index its rows by
+        participant code, the first field of the rows
+        :param export_rows_participants: list returned by process_participant_data
+        """
+        self.get_input_data('participants')['data_list'] = export_rows_participants
+        self.participant_rows_by_code = {}
+        for row in export_rows_participants[1:]:
+            self.participant_rows_by_code.setdefault(row[0], row)
+
     def get_participant_row_data(self, subject_code):
-        participant_rows = []
-        participant_data_list = self.get_input_data('participants')['data_list']
-        header = participant_data_list[0]
-        for sublist in participant_data_list[1:len(participant_data_list)]:
-            if subject_code in sublist:
-                participant_rows.append(sublist)
-                participant_rows.insert(0, header)
+        """
+        :param subject_code: participant code
+        :return: [header, row] of the participant data, or [] if the
+        participant is not exported
+        """
+        row = self.participant_rows_by_code.get(subject_code)
+        if row is None:
+            return []
 
-        return participant_rows
+        return [self.get_input_data('participants')['data_list'][0], row]
 
     def get_per_participant_data(self, participant=None, questionnaire=None):
         if questionnaire:
@@ -1036,13 +1156,14 @@ class ExportExecution:
         export_fields_list.append(export_row_list)
 
         # Including the responses
-        for fields in fields_description[1:fields_description.__len__()]:
-            participation_code = fields[len(fields) - 1]
+        participant_rows_by_code = {}
+        for participant_fields in export_participant_row[1:]:
+            participant_rows_by_code.setdefault(participant_fields[-1], []).append(participant_fields)
+        for fields in fields_description[1:]:
+            participation_code = fields[-1]
             export_row_list = fields[0:len(fields) - 1]
-            for participant_fields in export_participant_row[1:export_participant_row.__len__()]:
-                if participation_code == participant_fields[len(participant_fields) - 1]:
-                    for field in participant_fields:
-                        export_row_list.append(field)
+            for participant_fields in participant_rows_by_code.get(participation_code, []):
+                export_row_list.extend(participant_fields)
             export_fields_list.append(export_row_list)
 
         return export_fields_list
@@ -1682,7 +1803,8 @@ class ExportExecution:
 
             questionnaire_lime_survey = Questionnaires()
 
-            for participant_code in self.get_per_participant_data():
+            for index, participant_code in enumerate(self.get_per_participant_data()):
+                self.report_progress('per_participant', index, len(self.get_per_participant_data()))
                 # path ex. Participant_P123
                 path_participant = prefix_filename_participant + str(participant_code)
                 # path ex. data/Per_participant/Participant_P123/
@@ -1900,11 +2022,16 @@ class ExportExecution:
         error_msg = ''
         questionnaire_lime_survey = Questionnaires()
 
+        participants_done = 0
+        participants_total = sum(
+            len(group_data['data_per_participant']) for group_data in self.per_group_data.values())
         for group_id in self.per_group_data:
             header_saved = False
             participant_list = self.per_group_data[group_id]['data_per_participant']
             # Participant data
             for participant_code in participant_list:
+                self.report_progress('per_participant', participants_done, participants_total)
+                participants_done += 1
                 prefix_filename_participant = 'Participant_'
                 # Ex. Participant_P123
                 participant_name = prefix_filename_participant + str(participant_code)
@@ -2075,10 +2202,7 @@ class ExportExecution:
                                 complete_sensor_position_filename = path.join(
                                     path_per_eeg_data, sensor_position_filename)
 
-                                with open(sensors_positions_image, 'rb') as f:
-                                    data = f.read()
-                                with open(complete_sensor_position_filename, 'wb') as f:
-                                    f.write(data)
+                                self.link_file(sensors_positions_image, complete_sensor_position_filename)
 
                                 self.files_to_zip_list.append([
                                     complete_sensor_position_filename, export_eeg_data_directory,
@@ -2103,10 +2227,7 @@ class ExportExecution:
                                     'description': 'Data Collection (format: %s)' % file_format_nes_code
                                 }
 
-                                with open(path_eeg_data_file, 'rb') as f:
-                                    data = f.read()
-                                with open(complete_eeg_data_filename, 'wb') as f:
-                                    f.write(data)
+                                self.link_file(path_eeg_data_file, complete_eeg_data_filename)
 
                                 self.files_to_zip_list.append([
                                     complete_eeg_data_filename, export_eeg_data_directory, datapackage_resource
@@ -2206,10 +2327,7 @@ class ExportExecution:
                                     'description': 'Data Collection (format: %s)' % file_format_nes_code
                                 }
 
-                                with open(url, 'rb') as f:
-                                    data = f.read()
-                                with open(complete_emg_data_filename, 'wb') as f:
-                                    f.write(data)
+                                self.link_file(url, complete_emg_data_filename)
 
                                 self.files_to_zip_list.append([
                                     complete_emg_data_filename, export_emg_data_directory, datapackage_resource
@@ -2289,10 +2407,7 @@ class ExportExecution:
                                     path_hot_spot_image = path.join(
                                         settings.MEDIA_ROOT,
                                         hotspot_image)
-                                    with open(path_hot_spot_image, 'rb') as f:
-                                        data = f.read()
-                                    with open(complete_hotspot_filename, 'wb') as f:
-                                        f.write(data)
+                                    self.link_file(path_hot_spot_image, complete_hotspot_filename)
 
                                     self.files_to_zip_list.append([
                                         complete_hotspot_filename, export_tms_step_directory,
@@ -2371,10 +2486,7 @@ class ExportExecution:
                                     complete_goalkeeper_game_filename = path.join(
                                         path_per_goalkeeper_game_data, filename)
 
-                                    with open(path_context_tree_file, 'rb') as f:
-                                        data = f.read()
-                                    with open(complete_goalkeeper_game_filename, 'wb') as f:
-                                        f.write(data)
+                                    self.link_file(path_context_tree_file, complete_goalkeeper_game_filename)
 
                                     self.files_to_zip_list.append([
                                         complete_goalkeeper_game_filename, export_goalkeeper_data_directory,
@@ -2392,7 +2504,7 @@ class ExportExecution:
 
                                     complete_digital_filename = path.join(goalkeeper_game_directory, export_filename)
 
-                                    with open(complete_goalkeeper_game_filename, 'r') as infile, \
+                                    with open(path_context_tree_file, 'r') as infile, \
                                             open(complete_digital_filename, 'a') as outfile:
                                         header = next(infile)
 
@@ -2460,10 +2572,7 @@ class ExportExecution:
                                                % (file_format_nes_code, information_type)
                             }
 
-                            with open(path_generic_data_collection_file, 'rb') as f:
-                                data = f.read()
-                            with open(complete_generic_data_filename, 'wb') as f:
-                                f.write(data)
+                            self.link_file(path_generic_data_collection_file, complete_generic_data_filename)
                             self.files_to_zip_list.append([
                                 complete_generic_data_filename, export_generic_data_directory, datapackage_resource
                             ])
@@ -2517,10 +2626,7 @@ class ExportExecution:
                             # Path ex. data/Experiment_data/Group_XXX/Per_participant/Participant_123/
                             # Step_X_COMPONENT_TYPE/file_name.format_type
                             complete_additional_data_filename = path.join(path_per_additional_data, filename)
-                            with open(path_additional_data_file, 'rb') as f:
-                                data = f.read()
-                            with open(complete_additional_data_filename, 'wb') as f:
-                                f.write(data)
+                            self.link_file(path_additional_data_file, complete_additional_data_filename)
 
                             self.files_to_zip_list.append([
                                 complete_additional_data_filename, export_additional_data_directory,
@@ -2588,33 +2694,28 @@ class ExportExecution:
 
     @staticmethod
     def calculate_age_by_participant(participants_list):
+        """
+        :param participants_list: list of tuples (a, b, c,): a: patient id;
+        b, c, subjects of group of the patient, if any, from which the age is
+        calculated at the first data collection
+        :return: dict with the age by patient code
+        """
+        participants_list = list(participants_list)
+        first_data_collections = dates_of_first_data_collection(
+            {subject_of_group_id for participant in participants_list for subject_of_group_id in participant[1:]})
+        patients = Patient.objects.in_bulk([participant[0] for participant in participants_list])
+
         age_value_dict = {}
         for participant in participants_list:
-            # (a, b, c,) -> patient is subject of a group: a: patient; b, c,
-            #  are subjects of group
-            # (a,) -> patient comes from exporting Per participant
-            length_tupple = len(participant)
-            if length_tupple > 1:
-                # put first data collection 1 day ahead for first iteration
-                first_data_collection = date.today() + timedelta(days=1)
-                for i in range(1, length_tupple):
-                    date_data_collection = \
-                        date_of_first_data_collection(participant[i])
-                    # subject of group has no data collection
-                    if date_data_collection:
-                        first_data_collection = min(
-                            first_data_collection,
-                            date_of_first_data_collection(participant[i])
-                        )
-                # if first_data_collection = date.today() + timedelta(days=1),
-                # there're no data collections for all subjects of groups
-                if first_data_collection > date.today():
-                    first_data_collection = None
-            else:
-                first_data_collection = None
-            subject = get_object_or_404(Patient, pk=participant[0])
-            date_ = \
-                first_data_collection if first_data_collection else date.today()
+            # Patients not found are not exported by process_participant_data either
+            if participant[0] not in patients:
+                continue
+            subject = patients[participant[0]]
+            # There are no data collections when the patient comes from
+            # exporting Per participant, or the subjects of group have none
+            dates = [first_data_collections[subject_of_group_id] for subject_of_group_id in participant[1:]
+                     if subject_of_group_id in first_data_collections]
+            date_ = min(dates) if dates and min(dates) <= date.today() else date.today()
             age_value = format(
                 (date_ - subject.date_birth) / timedelta(days=365.2425),
                 '.4'
@@ -2626,17 +2727,25 @@ class ExportExecution:
 
     @staticmethod
     def add_subject_of_group(participants, group_ids):
-        for group_id in group_ids:
-            group = Group.objects.get(id=group_id)
-            # Patient.objects.filter(subject__subjectofgroup__group=group).values('id')
-            subjects_of_group = group.subjectofgroup_set.all()
-            for sog in subjects_of_group:
-                patient_sog = sog.subject.patient
-                for i in range(len(participants)):
-                    if participants[i][0] == patient_sog.id:
-                        participants[i] = participants[i] + (sog.id,)
-
-        return participants
+        """
+        :param participants: list of tuples (patient id,)
+        :param group_ids: ids of the groups exported
+        :return: list of tuples (patient id, subject of group ids...), with
+        the subjects of group of the patient in the groups, in group order
+        """
+        group_order = {int(group_id): index for index, group_id in enumerate(group_ids)}
+        subjects_of_groups = sorted(
+            SubjectOfGroup.objects.filter(group_id__in=group_order).values_list(
+                'group_id', 'id', 'subject__patient_id'),
+            key=lambda subject_of_group: (group_order[subject_of_group[0]], subject_of_group[1]))
+
+        subjects_of_groups_by_patient = {}
+        for group_id, subject_of_group_id, patient_id in subjects_of_groups:
+            subjects_of_groups_by_patient.setdefault(patient_id, []).append(subject_of_group_id)
+
+        return [
+            participant + tuple(subjects_of_groups_by_patient.get(participant[0], [])) for participant in participants
+        ]
 
     def process_participant_data(self, participants_output_fields, participants, language, participants_plugin=False):
         # TODO: fix translation model functionality
@@ -2688,13 +2797,8 @@ class ExportExecution:
         return export_rows_participants
 
     def get_participant_data_per_code(self, subject_code, questionnaire_response_fields):
-        db_data = []
-        for record in self.get_input_data('participants')['data_list']:
-            if record[-1] == subject_code:
-                db_data = record
-
         # append participant data to questionnaire response
-        for field in db_data:
+        for field in self.participant_rows_by_code.get(subject_code, []):
             questionnaire_response_fields.append(field)
 
         return questionnaire_response_fields
@@ -3128,10 +3232,7 @@ class ExportExecution:
                     complete_protocol_image_filename = path.join(
                         directory_experimental_protocol, PROTOCOL_IMAGE_FILENAME)
                     image_protocol = experimental_protocol_image
-                    with open(image_protocol, 'rb') as f:
-                        data = f.read()
-                    with open(complete_protocol_image_filename, 'wb') as f:
-                        f.write(data)
+                    self.link_file(image_protocol, complete_protocol_image_filename)
                     filename, extension = PROTOCOL_IMAGE_FILENAME.split('.')
                     self.files_to_zip_list.append([
                         complete_protocol_image_filename, export_directory_experimental_protocol,
@@ -3238,10 +3339,7 @@ class ExportExecution:
                         unique_name = slugify(filename)
                         # TODO (NES-987): change context_tree.setting_file.name.split('/')[-1]
                         complete_context_tree_filename = path.join(directory_experimental_protocol, filename)
-                        with open(path.join(context_tree_filename), 'rb') as f:
-                            data = f.read()
-                        with open(complete_context_tree_filename, 'wb') as f:
-                            f.write(data)
+                        self.link_file(context_tree_filename, complete_context_tree_filename)
 
                         self.files_to_zip_list.append([
                             complete_context_tree_filename, export_directory_experimental_protocol,
@@ -3279,10 +3377,7 @@ class ExportExecution:
 
                         complete_additional_data_filename = path.join(path_additional_data, filename)
 
-                        with open(path_additional_file, 'rb') as f:
-                            data = f.read()
-                        with open(complete_additional_data_filename, 'wb') as f:
-                            f.write(data)
+                        self.link_file(path_additional_file, complete_additional_data_filename)
 
                         self.files_to_zip_list.append([
                             complete_additional_data_filename, export_directory_additional_data,
@@ -3327,10 +3422,7 @@ class ExportExecution:
                                 'description': 'Stimulus type: %s' % stimulus_data['stimulus_file'].stimulus_type.name
                             }
 
-                            with open(path_stimulus_filename, 'rb') as f:
-                                data = f.read()
-                            with open(complete_stimulus_data_filename, 'wb') as f:
-                                f.write(data)
+                            self.link_file(path_stimulus_filename, complete_stimulus_data_filename)
 
                             self.files_to_zip_list.append([
                                 complete_stimulus_data_filename, export_directory_stimulus_data, datapackage_resource
@@ -3357,22 +3449,46 @@ class ExportExecution:
         self.files_to_zip_list.append([file_path, ''])
 
     @staticmethod
-    def find_duplicates(fill_list1, fill_list2):
+    def find_duplicates(responses1, responses2):
+        """
+        :param responses1: ResponsesMatrix with the answers in one response type
+        :param responses2: ResponsesMatrix with the answers in other response
+        type
+        :return: set with the indices of the columns whose answers in the
+        first row differ between the response types
+        """
+        if not len(responses1):
+            return set()
 
-        line1 = fill_list1[1]
-        line2 = fill_list2[1]
+        return set(np.flatnonzero(responses1.answers[0] != responses2.answers[0]).tolist())
 
-        index = 0
-        total = len(line1)
+    @staticmethod
+    def filter_responses(responses1, responses2, subscripts):
+        """Answers of each token in the columns subscripts, followed, in the
+        columns whose answers differ between the response types, by the
+        answer in the second response type
+        :param responses1: ResponsesMatrix with the answers in the first
+        response type
+        :param responses2: ResponsesMatrix with the answers in the second
+        response type
+        :param subscripts: array with the indices of the columns
+        :return: dict with the list of answers by token, and set with the
+        headings of the columns that differ between the response types
+        """
+        duplicate_indices = ExportExecution.find_duplicates(responses1, responses2)
+        if not len(responses1):
+            return {}, set()
 
-        duplicate_list = []
+        duplicated = np.isin(subscripts, list(duplicate_indices))
+        # Each duplicated column is followed by its answer in responses2
+        positions = np.arange(len(subscripts)) + np.cumsum(duplicated) - duplicated
+        filtered = np.empty((len(responses1), len(subscripts) + int(duplicated.sum())), dtype=object)
+        filtered[:, positions] = responses1.answers[:, subscripts]
+        filtered[:, positions[duplicated] + 1] = responses2.answers[:, subscripts[duplicated]]
 
-        while index != total:
-            if line1[index] != line2[index]:
-                duplicate_list.append(index)
-            index += 1
+        header_filtered = {responses1.header[index] for index in subscripts[duplicated]}
 
-        return duplicate_list
+        return dict(zip(responses1.column('token').tolist(), filtered.tolist())), header_filtered
 
     def get_response_type(self):
 
@@ -3399,9 +3515,15 @@ class ExportExecution:
         return filesformat_type
 
     def get_questionnaires_responses(self, heading_type):
-        questionnaire_lime_survey = Questionnaires()
+        questionnaire_lime_survey = ConcurrentQuestionnaires()
         response_type = self.get_response_type()
         self.questionnaires_responses = {}
+        # The completion of the tokens of each survey is read once per export
+        token_completion = TokenCompletionMirror(questionnaire_lime_survey, sync_interval=0)
+        if limesurvey_available(questionnaire_lime_survey):
+            token_completion.refresh(
+                int(questionnaire_id) for group_id in self.get_input_data('questionnaires_from_experiments')
+                for questionnaire_id in self.get_input_data('questionnaires_from_experiments')[group_id])
         for group_id in self.get_input_data('questionnaires_from_experiments'):
             for questionnaire_id in self.get_input_data('questionnaires_from_experiments')[group_id]:
                 language_list = self.get_input_data('questionnaire_language')[questionnaire_id]['language_list']
@@ -3412,11 +3534,11 @@ class ExportExecution:
                 # TODO: This if is the first thing to do not inside for.
                 # TODO: Put this as the first line of method.
                 if limesurvey_available(questionnaire_lime_survey):
+                    responses_from_lime_survey = self.get_responses_from_lime_survey(
+                        questionnaire_lime_survey, questionnaire_id, language_list, fields, response_type)
                     data_from_lime_survey = {}
                     for language in language_list:
-                        responses_string1 = questionnaire_lime_survey.get_responses(
-                            questionnaire_id, language, response_type[0])
-                        fill_list1 = QuestionnaireUtils.responses_to_csv(responses_string1)
+                        responses1 = ResponsesMatrix(responses_from_lime_survey.pop((language, response_type[0])))
 
                         # Multiple choice answers need replacement
                         # TODO (NES-991): make a test for getting multiple choice questions
@@ -3424,51 +3546,25 @@ class ExportExecution:
                             questionnaire_lime_survey, questionnaire_id,
                             language, ['M', 'P'])
                         replace_multiple_choice_question_answers(
-                            fill_list1, multiple_choice_questions)
+                            responses1, multiple_choice_questions)
 
                         # Read 'long' information, if necessary
                         if len(response_type) > 1:
-                            responses_string2 = questionnaire_lime_survey.get_responses(
-                                questionnaire_id, language, response_type[1])
-                            fill_list2 = QuestionnaireUtils.responses_to_csv(
-                                responses_string2)
+                            responses2 = ResponsesMatrix(responses_from_lime_survey.pop((language, response_type[1])))
                             # Multiple choice answers need replacement
                             # TODO (NES-991): make a test for getting multiple choice questions
                             error, multiple_choice_questions = QuestionnaireUtils.get_questions(
                                 questionnaire_lime_survey, questionnaire_id, language)
                             replace_multiple_choice_question_answers(
-                                fill_list2, multiple_choice_questions)
+                                responses2, multiple_choice_questions)
                         else:
-                            fill_list2 = fill_list1
+                            responses2 = responses1
 
                         # Filter fields
-                        subscripts = []
-
-                        for field in fields:
-                            if field in fill_list1[0]:
-                                subscripts.append(fill_list1[0].index(field))
-
-                        data_from_lime_survey[language] = {}
-
-                        duplicate_indices = self.find_duplicates(fill_list1, fill_list2)
-
-                        line_index = 1
-                        line_total = len(fill_list1) - 1
-                        header_filtered = set()
-                        while line_index < line_total:
-                            data_fields_filtered = []
-                            line1 = fill_list1[line_index]
-                            line2 = fill_list2[line_index]
+                        subscripts = responses1.column_indices(fields)
 
-                            for index in subscripts:
-                                data_fields_filtered.append(line1[index])
-                                if index in duplicate_indices:
-                                    data_fields_filtered.append(line2[index])
-                                    header_filtered.add(fill_list1[0][index])
-
-                            token = line1[fill_list1[0].index('token')]
-                            data_from_lime_survey[language][token] = list(data_fields_filtered)
-                            line_index += 1
+                        data_from_lime_survey[language], header_filtered = self.filter_responses(
+                            responses1, responses2, subscripts)
                     self.questionnaire_utils.redefine_header_and_fields_experiment(
                         questionnaire_id, header_filtered, fields, headers)
 
@@ -3482,8 +3578,7 @@ class ExportExecution:
                         ]['questionnaires_per_group'][int(questionnaire_id)]['token_list']
                         for questionnaire_data in questionnaire_list:
                             token_id = questionnaire_data['token_id']
-                            completed = questionnaire_lime_survey.get_participant_properties(
-                                questionnaire_id, token_id, 'completed')
+                            completed = token_completion.token_completed(int(questionnaire_id), token_id)
                             if completed is not None and completed != 'N' and completed != '':
                                 token = questionnaire_lime_survey.get_participant_properties(
                                     questionnaire_id, token_id, 'token')
@@ -3501,6 +3596,28 @@ class ExportExecution:
                                     self.questionnaires_responses[questionnaire_id][token_id][language] = \
                                         fields_filtered_list
 
+    def get_responses_from_lime_survey(self, questionnaire_lime_survey, questionnaire_id, language_list, fields,
+                                       response_type):
+        """Get the responses of one questionnaire in each language and
+        response type at the same time. Only the responses of one
+        questionnaire are gathered at a time, and their rows are decoded only
+        when they are read.
+        :param questionnaire_lime_survey: ConcurrentQuestionnaires instance
+        :param questionnaire_id: LimeSurvey survey id
+        :param language_list: languages of the responses
+        :param fields: fields of the questionnaire exported
+        :param response_type: list of response types
+        :return: dict with the responses (generator of the rows with the
+        fields and the token, None if they could not be read) by language
+        and response type
+        """
+        keys = [(language, response_type_) for language in language_list for response_type_ in response_type[:2]]
+        responses = questionnaire_lime_survey.gather(
+            ('get_responses_rows', questionnaire_id, language, response_type_, 'code', fields + ['token'])
+            for language, response_type_ in keys)
+
+        return dict(zip(keys, responses))
+
     def define_experiment_questionnaire(self, questionnaire, questionnaire_lime_survey):
         questionnaire_id = questionnaire['id']
         language = questionnaire['language']
@@ -3529,48 +3646,24 @@ class ExportExecution:
 
         if available:
             # read all data for questionnaire_id from LimeSurvey
-            responses_string1 = questionnaire_lime_survey.get_responses(
-                questionnaire_id, language, response_type[0]
-            )
-            # all the answer from the questionnaire_id in csv format
-            fill_list1 = QuestionnaireUtils.responses_to_csv(responses_string1)
+            # all the answer from the questionnaire_id in csv format, only
+            # the columns of the fields selected
+            responses1 = ResponsesMatrix(questionnaire_lime_survey.get_responses_rows(
+                questionnaire_id, language, response_type[0], columns=fields + ['token']
+            ))
 
             # read 'long' information, if necessary
             if len(response_type) > 1:
-                responses_string2 = questionnaire_lime_survey.get_responses(questionnaire_id, language,
-                                                                            response_type[1])
-                fill_list2 = QuestionnaireUtils.responses_to_csv(responses_string2)
+                responses2 = ResponsesMatrix(questionnaire_lime_survey.get_responses_rows(
+                    questionnaire_id, language, response_type[1], columns=fields + ['token']))
             else:
-                fill_list2 = fill_list1
+                responses2 = responses1
 
             # filter fields
-            subscripts = []
-            # identify the index of the fields selected on the fill_list1[0]
-            for field in fields:
-                if field in fill_list1[0]:
-                    subscripts.append(fill_list1[0].index(field))
-
-            data_from_lime_survey = {}
-
-            duplicate_indices = self.find_duplicates(fill_list1, fill_list2)
-
-            line_index = 1
-            line_total = len(fill_list1) - 1
-            header_filtered = set()
-            while line_index < line_total:
-                data_fields_filtered = []
-                line1 = fill_list1[line_index]
-                line2 = fill_list2[line_index]
-
-                for index in subscripts:
-                    data_fields_filtered.append(line1[index])
-                    if index in duplicate_indices:
-                        data_fields_filtered.append(line2[index])
-                        header_filtered.add(fill_list1[0][index])
-
-                token = line1[fill_list1[0].index('token')]
-                data_from_lime_survey[token] = list(data_fields_filtered)
-                line_index += 1
+            # identify the index of the fields selected on the header
+            subscripts = responses1.column_indices(fields)
+
+            data_from_lime_survey, header_filtered = self.filter_responses(responses1, responses2, subscripts)
             # self.update_questionnaire_experiment_rules(questionnaire_id)
 
             token = questionnaire_lime_survey.get_participant_properties(questionnaire_id, token_id, 'token')
@@ -3647,11 +3740,13 @@ class ExportExecution:
 
         if questionnaire_exists and available:
             # Read all data for questionnaire_id from LimeSurvey
-            result = questionnaire_lime_survey.get_responses(questionnaire_id, language, response_type[0])
+            # Only the columns of the fields selected
+            result = questionnaire_lime_survey.get_responses_rows(
+                questionnaire_id, language, response_type[0], columns=fields + ['token'])
             if result is None:
                 return Questionnaires.ERROR_CODE
 
-            fill_list1 = QuestionnaireUtils.responses_to_csv(result)
+            responses1 = ResponsesMatrix(result)
 
             # Multiple choice answers need replacement
             # TODO (NES-991): make a test for getting multiple choice questions
@@ -3660,53 +3755,27 @@ class ExportExecution:
             if error:
                 return error
             replace_multiple_choice_question_answers(
-                fill_list1, multiple_choice_questions)
+                responses1, multiple_choice_questions)
 
             # Read 'long' information, if necessary
             if len(response_type) > 1:
-                responses_string2 = questionnaire_lime_survey.get_responses(
-                    questionnaire_id, language, response_type[1])
-                fill_list2 = QuestionnaireUtils.responses_to_csv(
-                    responses_string2)
+                responses2 = ResponsesMatrix(questionnaire_lime_survey.get_responses_rows(
+                    questionnaire_id, language, response_type[1], columns=fields + ['token']))
                 # Multiple choice answers need replacement
                 # TODO (NES-991): make a test for getting multiple choice questions
                 error, multiple_choice_questions = QuestionnaireUtils.get_questions(
                     questionnaire_lime_survey, questionnaire_id, language)
                 replace_multiple_choice_question_answers(
-                    fill_list1, multiple_choice_questions)
+                    responses1, multiple_choice_questions)
             else:
-                fill_list2 = fill_list1
+                responses2 = responses1
 
             # filter fields
-            subscripts = []
-
-            for field in fields:
-                if field in fill_list1[0]:
-                    subscripts.append(fill_list1[0].index(field))
+            subscripts = responses1.column_indices(fields)
 
             # If responses exists
-            if subscripts:
-                data_from_lime_survey = {}
-
-                duplicate_indices = self.find_duplicates(fill_list1, fill_list2)
-
-                line_index = 1
-                line_total = len(fill_list1) - 1
-                header_filtered = set()
-                while line_index < line_total:
-                    data_fields_filtered = []
-                    line1 = fill_list1[line_index]
-                    line2 = fill_list2[line_index]
-
-                    for index in subscripts:
-                        data_fields_filtered.append(line1[index])
-                        if index in duplicate_indices:
-                            data_fields_filtered.append(line2[index])
-                            header_filtered.add(fill_list1[0][index])
-
-                    token = line1[fill_list1[0].index('token')]
-                    data_from_lime_survey[token] = list(data_fields_filtered)
-                    line_index += 1
+            if len(subscripts):
+                data_from_lime_survey, header_filtered = self.filter_responses(responses1, responses2, subscripts)
 
                 self.update_questionnaire_rules(questionnaire_id)
 
@@ -0,0 +1,237 @@
+"""Queue of exports made in background, so that large exports do not have to
+finish within the HTTP request that asked for them.
+
+The queue is the ExportJob table: a job is created for an Export with the
+data of the request export_create needs, and is made by the first worker
+that claims it. Workers are threads of the web process (settings
+EXPORT_WORKERS) or the run_export_jobs management command. While a job
+is made, a heartbeat thread of its worker saves that the worker is alive;
+jobs whose worker missed MISSED_HEARTBEATS heartbeats are taken as left by
+a worker that stopped, and are put back in the queue. Stages finished are not
+kept: an interrupted job is made again from the start, at most MAX_ATTEMPTS
+times.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from os import path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone, translation
+from django.utils.translation import ugettext as _
+
+from experiment import protocol_index
+
+from .models import ExportJob
+
+EXPORT_WORKERS = 2
+# Seconds between the heartbeats of the worker making a job
+HEARTBEAT_SECONDS = 30
+# Heartbeats missed after which a running job is taken as interrupted
+MISSED_HEARTBEATS = 4
+MAX_ATTEMPTS = 3
+
+# Session data read by export_create and ExportExecution
+SESSION_KEYS = ('filtered_participant_data', 'group_selected_list', 'license')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_export_workers():
+    """
+    :return: number of threads of the process making export jobs; 0 if
+    exports are made in the request
+    """
+    return getattr(settings, 'EXPORT_WORKERS', EXPORT_WORKERS)
+
+
+class ExportMessages(list):
+    """Message storage of ExportRequest, keeping the messages export_create
+    gives to the user
+    """
+
+    def add(self, level, message, extra_tags=''):
+        self.append(str(message))
+
+
+class ExportRequest(HttpRequest):
+    """Request with what export_create reads from the request that queued
+    the export job
+    """
+
+    def __init__(self, user, parameters):
+        super(ExportRequest, self).__init__()
+        self.user = user
+        self.LANGUAGE_CODE = parameters['language_code']
+        self.session = parameters['session']
+        self.POST = QueryDict(mutable=True)
+        for key, values in parameters['post'].items():
+            self.POST.setlist(key, values)
+        self.method = 'POST'
+        self.host = parameters['host']
+        self._messages = ExportMessages()
+
+    def get_host(self):
+        return self.host
+
+
+def enqueue_export(request, export_instance, input_filename):
+    """Queue the export, to be made by export_create in background
+    :param request: request asking for the export
+    :param export_instance: Export instance
+    :param input_filename: json file describing what is exported
+    :return: ExportJob instance
+    """
+    post = dict(request.POST.lists())
+    post.pop('csrfmiddlewaretoken', None)
+    parameters = {
+        'input_filename': input_filename,
+        'language_code': request.LANGUAGE_CODE,
+        'session': {key: request.session[key] for key in SESSION_KEYS if key in request.session},
+        'post': post,
+        'host': request.get_host(),
+    }
+    export_job = ExportJob.objects.create(export=export_instance, parameters=json.dumps(parameters))
+    start_workers()
+
+    return export_job
+
+
+def start_workers():
+    """Make the workers of the process take the jobs in the queue, with the
+    interrupted jobs put back in the queue
+    """
+    global _executor
+
+    workers = get_export_workers()
+    if not workers:
+        return
+
+    requeue_interrupted_jobs()
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+
+    for _worker in range(workers):
+        _executor.submit(run_queued_jobs)
+
+
+def requeue_interrupted_jobs():
+    """Put back in the queue the running jobs whose worker missed
+    MISSED_HEARTBEATS heartbeats, failing the ones already tried MAX_ATTEMPTS
+    times. The jobs put back are made again from the start, as the stages
+    they finished are not kept.
+    :return: number of jobs put back in the queue
+    """
+    limit = timezone.now() - timedelta(seconds=HEARTBEAT_SECONDS * MISSED_HEARTBEATS)
+    interrupted = ExportJob.objects.filter(status='running', updated_datetime__lt=limit)
+    interrupted.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status='failed', error_message=_('Export was interrupted'), finished_datetime=timezone.now())
+
+    return interrupted.update(status='queued', stage='', done=0, total=0, updated_datetime=timezone.now())
+
+
+def claim_next_job():
+    """Take the oldest job in the queue. The job is claimed by a conditional
+    update, so that only one worker gets it.
+    :return: ExportJob instance, or None if the queue is empty
+    """
+    for job_id in ExportJob.objects.filter(status='queued').values_list('pk', flat=True):
+        claimed = ExportJob.objects.filter(pk=job_id, status='queued').update(
+            status='running', attempts=F('attempts') + 1, updated_datetime=timezone.now())
+        if claimed:
+            return ExportJob.objects.get(pk=job_id)
+
+    return None
+
+
+def run_queued_jobs():
+    """Make the jobs in the queue until it is empty
+    :return: number of jobs made
+    """
+    count = 0
+    try:
+        export_job = claim_next_job()
+        while export_job:
+            run_export_job(export_job)
+            count += 1
+            export_job = claim_next_job()
+    finally:
+        # Threads of the pool do not close their connection as the requests do
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+    return count
+
+
+class Heartbeat(threading.Thread):
+    """Thread saving every HEARTBEAT_SECONDS that the worker making a job is
+    alive, however long the job takes to report progress
+    """
+
+    def __init__(self, export_job):
+        super(Heartbeat, self).__init__(name='export-heartbeat-%s' % export_job.pk, daemon=True)
+        self.export_job = export_job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_SECONDS):
+                ExportJob.objects.filter(pk=self.export_job.pk, status='running').update(
+                    updated_datetime=timezone.now())
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_export_job(export_job):
+    """Make the export of a claimed job, saving its progress and result
+    :param export_job: ExportJob instance
+    """
+    # export.views imports this module
+    from export.views import export_create
+
+    # Workers are not reset between jobs as requests are
+    protocol_index.clear()
+
+    parameters = json.loads(export_job.parameters)
+    request = ExportRequest(export_job.export.user, parameters)
+
+    def progress(stage, done=0, total=0):
+        ExportJob.objects.filter(pk=export_job.pk).update(
+            stage=stage, done=done, total=total, updated_datetime=timezone.now())
+
+    heartbeat = Heartbeat(export_job)
+    heartbeat.start()
+    # Headers and answers are translated to the language of the request that
+    # queued the job, as the worker thread has none
+    translation.activate(parameters['language_code'])
+    try:
+        result = export_create(request, export_job.export_id, parameters['input_filename'], progress=progress)
+    except Exception as e:
+        # Any error must be saved in the job instead of stopping the worker
+        finish_export_job(export_job, 'failed', str(e))
+        return
+    finally:
+        translation.deactivate()
+        heartbeat.stop()
+
+    if isinstance(result, str) and result and path.exists(result):
+        finish_export_job(export_job, 'finished')
+    else:
+        finish_export_job(
+            export_job, 'failed', '\n'.join(request._messages) or _('Export data was not generated.'))
+
+
+def finish_export_job(export_job, status, error_message=''):
+    ExportJob.objects.filter(pk=export_job.pk).update(
+        status=status, error_message=error_message, updated_datetime=timezone.now(),
+        finished_datetime=timezone.now())
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from export.jobs import requeue_interrupted_jobs, run_queued_jobs
+
+
+class Command(BaseCommand):
+    help = 'Make the exports in the queue, waiting for new ones unless --once is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Stop when the queue is empty')
+        parser.add_argument('--interval', type=int, default=5, help='Seconds between checks of the queue')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Start of exports...')
+        while True:
+            requeue_interrupted_jobs()
+            count = run_queued_jobs()
+            if count:
+                self.stdout.write('%d exports made.' % count)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write('End of exports.')
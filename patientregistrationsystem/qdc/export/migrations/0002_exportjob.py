@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('export', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('export', models.OneToOneField(
+                    primary_key=True, serialize=False, related_name='job', to='export.Export',
+                    on_delete=django.db.models.deletion.CASCADE)),
+                ('status', models.CharField(
+                    max_length=50, default='queued',
+                    choices=[('queued', 'queued'), ('running', 'running'), ('finished', 'finished'),
+                             ('failed', 'failed')])),
+                ('stage', models.CharField(
+                    max_length=50, blank=True,
+                    choices=[('participants', 'Participants'), ('questionnaires', 'Questionnaires'),
+                             ('per_participant', 'Per participant data'), ('zip', 'Compressing files')])),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('parameters', models.TextField()),
+                ('error_message', models.TextField(blank=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('queued_datetime', models.DateTimeField(auto_now_add=True)),
+                ('updated_datetime', models.DateTimeField(auto_now=True)),
+                ('finished_datetime', models.DateTimeField(null=True)),
+            ],
+            options={
+                'ordering': ('queued_datetime',),
+            },
+        ),
+    ]
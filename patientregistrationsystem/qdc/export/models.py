@@ -2,6 +2,7 @@
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils.translation import ugettext_lazy as _
 
 
 def get_export_dir(instance, filename):
@@ -19,3 +20,38 @@ class Export(models.Model):
     def delete(self, *args, **kwargs):
         self.content.delete()
         super(Export, self).delete(*args, **kwargs)
+
+
+class ExportJob(models.Model):
+    """Export waiting in the queue, or being made, by a worker of
+    export.jobs
+    """
+    STATUS_OPTIONS = (
+        ("queued", _("queued")),
+        ("running", _("running")),
+        ("finished", _("finished")),
+        ("failed", _("failed")),
+    )
+    STAGE_OPTIONS = (
+        ("participants", _("Participants")),
+        ("questionnaires", _("Questionnaires")),
+        ("per_participant", _("Per participant data")),
+        ("zip", _("Compressing files")),
+    )
+    export = models.OneToOneField(Export, primary_key=True, related_name='job')
+    status = models.CharField(max_length=50, choices=STATUS_OPTIONS, default="queued")
+    stage = models.CharField(max_length=50, choices=STAGE_OPTIONS, blank=True)
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    # Request data export_create needs: language, session and posted values
+    parameters = models.TextField()
+    error_message = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    queued_datetime = models.DateTimeField(auto_now_add=True)
+    # Updated each time the job reports progress and by the heartbeat of its
+    # worker, to find jobs left running by a worker that stopped
+    updated_datetime = models.DateTimeField(auto_now=True)
+    finished_datetime = models.DateTimeField(null=True)
+
+    class Meta:
+        ordering = ('queued_datetime',)
@@ -0,0 +1,144 @@
+from django.test import TestCase
+
+from experiment.tests.tests_helper import ObjectsFactory, ExperimentTestCase, CountingList
+from export.export import ExportExecution, ResponsesMatrix, extract_parent_questions, \
+    replace_multiple_choice_question_answers
+from patient.tests.tests_orig import UtilTests
+
+
+class ParticipantRowsTest(ExperimentTestCase):
+
+    HEADER = ['participant_code', 'age', 'gender']
+
+    def setUp(self):
+        super(ParticipantRowsTest, self).setUp()
+
+        self.export = ExportExecution(self.user.id, 1)
+        self.export.input_data = {'participants': {'output_list': []}}
+
+    @staticmethod
+    def participant_rows(number_of_participants):
+        return [['P%d' % number, '30.1', 'female'] for number in range(number_of_participants)]
+
+    def test_participant_row_is_found_by_code(self):
+        rows = self.participant_rows(3)
+        self.export.set_participant_rows([self.HEADER] + rows)
+
+        self.assertEqual(self.export.get_participant_row_data('P1'), [self.HEADER, rows[1]])
+        self.assertEqual(self.export.get_participant_row_data('P9'), [])
+        self.assertEqual(self.export.get_participant_data_per_code('P2', ['answer']), ['answer'] + rows[2])
+
+    def test_subjects_of_groups_are_added_to_their_patients_in_one_query(self):
+        other_group = ObjectsFactory.create_group(self.experiment)
+        other_subject_of_group = ObjectsFactory.create_subject_of_group(other_group, self.subject)
+        other_patient = UtilTests().create_patient(changed_by=self.user)
+
+        with self.assertNumQueries(1):
+            participants = self.export.add_subject_of_group(
+                [(self.patient.id,), (other_patient.id,)], [str(self.group.id), str(other_group.id)])
+
+        self.assertEqual(participants, [
+            (self.patient.id, self.subject_of_group.id, other_subject_of_group.id), (other_patient.id,)
+        ])
+
+    def test_participant_rows_are_looked_up_without_going_through_the_rows(self):
+        rows = self.participant_rows(1000)
+        export_rows_participants = CountingList([self.HEADER] + rows)
+        self.export.set_participant_rows(export_rows_participants)
+
+        export_rows_participants.reads = 0
+        for row in rows:
+            self.export.get_participant_row_data(row[0])
+
+        # Only the header is read for each participant
+        self.assertEqual(export_rows_participants.reads, len(rows))
+
+
+class ResponsesMatrixTest(TestCase):
+
+    @staticmethod
+    def responses(number_of_questions, number_of_answers, response_type):
+        """Csv rows as exported from LimeSurvey: each question has two
+        subquestions, the first one answered by half of the participants
+        """
+        header = ['id', 'token'] + [
+            'q%d[%s]' % (question, subquestion) for question in range(number_of_questions) for subquestion in 'ab'
+        ]
+        answer = 'Y' if response_type == 'short' else 'Yes'
+        rows = [header]
+        for number in range(number_of_answers):
+            rows.append([str(number), 'token%d' % number] + [
+                answer if number % 2 == 0 and subquestion == 'a' else ''
+                for question in range(number_of_questions) for subquestion in 'ab'
+            ])
+        rows.append([])
+        return rows
+
+    @staticmethod
+    def filter_responses_by_lines(fill_list1, fill_list2, question_list, fields):
+        """Filter of the responses going through the lines of the csv, as done
+        before ResponsesMatrix
+        """
+        for fill_list in (fill_list1, fill_list2):
+            parent_questions = extract_parent_questions(fill_list)
+            for col, question in enumerate(parent_questions):
+                if question in [q['title'] for q in question_list if q['title'] == question]:
+                    for row in range(1, len(fill_list) - 1):
+                        if fill_list[row][col] == '':
+                            fill_list[row][col] = 'N'
+
+        subscripts = [fill_list1[0].index(field) for field in fields if field in fill_list1[0]]
+        duplicate_indices = [
+            index for index in range(len(fill_list1[1])) if fill_list1[1][index] != fill_list2[1][index]
+        ]
+        data_from_lime_survey = {}
+        header_filtered = set()
+        for line_index in range(1, len(fill_list1) - 1):
+            data_fields_filtered = []
+            for index in subscripts:
+                data_fields_filtered.append(fill_list1[line_index][index])
+                if index in duplicate_indices:
+                    data_fields_filtered.append(fill_list2[line_index][index])
+                    header_filtered.add(fill_list1[0][index])
+            data_from_lime_survey[fill_list1[line_index][fill_list1[0].index('token')]] = data_fields_filtered
+
+        return data_from_lime_survey, header_filtered
+
+    @staticmethod
+    def filter_responses(fill_list1, fill_list2, question_list, fields):
+        responses1 = ResponsesMatrix(fill_list1)
+        responses2 = ResponsesMatrix(fill_list2)
+        replace_multiple_choice_question_answers(responses1, question_list)
+        replace_multiple_choice_question_answers(responses2, question_list)
+
+        return ExportExecution.filter_responses(responses1, responses2, responses1.column_indices(fields))
+
+    def test_multiple_choice_answers_not_selected_are_replaced_in_csv_rows(self):
+        rows = self.responses(2, 2, 'short')
+        replace_multiple_choice_question_answers(rows, [{'title': 'q1'}])
+
+        self.assertEqual(rows, [
+            ['id', 'token', 'q0[a]', 'q0[b]', 'q1[a]', 'q1[b]'],
+            ['0', 'token0', 'Y', '', 'Y', 'N'],
+            ['1', 'token1', '', '', 'N', 'N'],
+            []
+        ])
+
+    def test_filtered_responses_are_the_same_as_filtered_by_lines(self):
+        number_of_questions = 300
+        question_list = [{'title': 'q%d' % question} for question in range(0, number_of_questions, 2)]
+        fields = ['token', 'q5[b]', 'missing'] + [
+            'q%d[%s]' % (question, subquestion) for question in range(number_of_questions) for subquestion in 'ab'
+        ]
+
+        results = []
+        for filter_responses in (self.filter_responses_by_lines, self.filter_responses):
+            fill_list1 = CountingList(self.responses(number_of_questions, 100, 'short'))
+            fill_list2 = CountingList(self.responses(number_of_questions, 100, 'long'))
+            results.append(filter_responses(fill_list1, fill_list2, question_list, fields))
+
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[1][0]['token0'][:5], ['token0', '', 'Y', 'Yes', 'N'])
+        self.assertIn('q0[a]', results[1][1])
+        # The rows of the csv are read once, to make the matrices
+        self.assertEqual((fill_list1.reads, fill_list2.reads), (len(fill_list1), len(fill_list2)))
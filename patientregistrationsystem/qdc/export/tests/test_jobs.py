@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone, translation
+
+from custom_user.tests_helper import create_user
+from export import jobs
+from export.models import Export, ExportJob
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ExportJobTest(TestCase):
+
+    def setUp(self):
+        self.user, self.user_passwd = create_user()
+        self.client.login(username=self.user.username, password=self.user_passwd)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_export_job(self, **kwargs):
+        parameters = {
+            'input_filename': 'json_export.json', 'language_code': 'en', 'session': {'license': 0},
+            'post': {'headings': ['code']}, 'host': 'testserver'
+        }
+        return ExportJob.objects.create(
+            export=Export.objects.create(user=self.user), parameters=json.dumps(parameters), **kwargs)
+
+    def test_claim_next_job_claims_oldest_queued_job_once(self):
+        export_job1 = self.create_export_job()
+        export_job2 = self.create_export_job()
+        self.create_export_job(status='finished')
+
+        self.assertEqual(jobs.claim_next_job(), export_job1)
+        self.assertEqual(jobs.claim_next_job(), export_job2)
+        self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(ExportJob.objects.get(pk=export_job1.pk).status, 'running')
+        self.assertEqual(ExportJob.objects.get(pk=export_job1.pk).attempts, 1)
+
+    def test_interrupted_jobs_are_queued_again_until_max_attempts(self):
+        export_job1 = self.create_export_job(status='running', attempts=1)
+        export_job2 = self.create_export_job(status='running', attempts=jobs.MAX_ATTEMPTS)
+        export_job3 = self.create_export_job(status='running', attempts=1)
+        ExportJob.objects.exclude(pk=export_job3.pk).update(
+            updated_datetime=timezone.now() - timedelta(
+                seconds=jobs.HEARTBEAT_SECONDS * jobs.MISSED_HEARTBEATS + 1))
+
+        self.assertEqual(jobs.requeue_interrupted_jobs(), 1)
+        self.assertEqual(ExportJob.objects.get(pk=export_job1.pk).status, 'queued')
+        self.assertEqual(ExportJob.objects.get(pk=export_job2.pk).status, 'failed')
+        self.assertEqual(ExportJob.objects.get(pk=export_job3.pk).status, 'running')
+
+    def test_job_without_progress_is_not_queued_again_while_its_worker_beats(self):
+        export_job = self.create_export_job(status='running', attempts=1)
+        ExportJob.objects.filter(pk=export_job.pk).update(updated_datetime=timezone.now() - timedelta(days=1))
+
+        heartbeat = jobs.Heartbeat(export_job)
+        # One heartbeat, made in this thread, before the job finishes
+        with patch.object(heartbeat.stopped, 'wait', side_effect=[False, True]), patch('export.jobs.connection'):
+            heartbeat.run()
+
+        self.assertEqual(jobs.requeue_interrupted_jobs(), 0)
+        self.assertEqual(ExportJob.objects.get(pk=export_job.pk).status, 'running')
+
+    @patch('export.views.export_create')
+    def test_run_export_job_saves_progress_and_result(self, mock_export_create):
+        export_job = self.create_export_job()
+        export_filename = os.path.join(TEMP_MEDIA_ROOT, 'export.zip')
+        progress_saved = []
+
+        def export_create(request, export_id, input_filename, progress):
+            self.assertEqual(request.user, self.user)
+            self.assertEqual(request.POST.get('headings'), 'code')
+            self.assertEqual(request.session['license'], 0)
+            progress('zip', 1, 2)
+            progress_saved.append(ExportJob.objects.get(pk=export_id))
+            open(export_filename, 'w').close()
+            return export_filename
+
+        mock_export_create.side_effect = export_create
+        self.assertEqual(jobs.run_queued_jobs(), 1)
+
+        self.assertEqual((progress_saved[0].stage, progress_saved[0].done, progress_saved[0].total), ('zip', 1, 2))
+        export_job = ExportJob.objects.get(pk=export_job.pk)
+        self.assertEqual(export_job.status, 'finished')
+        self.assertIsNotNone(export_job.finished_datetime)
+
+    @patch('export.views.export_create')
+    def test_run_export_job_saves_error_messages(self, mock_export_create):
+        export_job = self.create_export_job(status='running')
+
+        def export_create(request, export_id, input_filename, progress):
+            from django.contrib import messages
+            messages.error(request, 'Inconsistent data read from json file')
+
+        mock_export_create.side_effect = export_create
+        jobs.run_export_job(export_job)
+
+        export_job = ExportJob.objects.get(pk=export_job.pk)
+        self.assertEqual(export_job.status, 'failed')
+        self.assertEqual(export_job.error_message, 'Inconsistent data read from json file')
+
+    @patch('export.views.export_create')
+    def test_run_export_job_exports_in_the_language_of_the_request(self, mock_export_create):
+        export_job = self.create_export_job(status='running')
+        parameters = json.loads(export_job.parameters)
+        parameters['language_code'] = 'pt-br'
+        export_job.parameters = json.dumps(parameters)
+        languages = []
+
+        def export_create(request, export_id, input_filename, progress):
+            languages.append(translation.get_language())
+
+        mock_export_create.side_effect = export_create
+        jobs.run_export_job(export_job)
+
+        self.assertEqual(languages, ['pt-br'])
+        self.assertEqual(translation.get_language(), settings.LANGUAGE_CODE)
+
+    def test_export_job_status_returns_progress(self):
+        export_job = self.create_export_job(status='running', stage='per_participant', done=3, total=10)
+
+        response = self.client.get(reverse('export_job_status', args=(export_job.export_id,)))
+
+        status = json.loads(response.content.decode())
+        self.assertEqual(status['status'], 'running')
+        self.assertEqual((status['stage'], status['done'], status['total']), ('per_participant', 3, 10))
+        self.assertIsNone(status['download_url'])
+
+    def test_download_of_export_not_generated_redirects_to_export_menu(self):
+        os.makedirs(TEMP_MEDIA_ROOT, exist_ok=True)
+        export_instance = Export.objects.create(user=self.user)
+
+        response = self.client.get(reverse('export_download', args=(export_instance.pk,)))
+
+        self.assertRedirects(response, reverse('export_menu'), fetch_redirect_response=False)
+
+    def test_export_job_of_other_user_is_not_found(self):
+        other_user, other_user_passwd = create_user()
+        export_job = ExportJob.objects.create(export=Export.objects.create(user=other_user), parameters='{}')
+
+        response = self.client.get(reverse('export_job_status', args=(export_job.export_id,)))
+
+        self.assertEqual(response.status_code, 404)
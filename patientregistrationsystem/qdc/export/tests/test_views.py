@@ -25,7 +25,7 @@ from export import input_export
 from export.export import PROTOCOL_IMAGE_FILENAME, PROTOCOL_DESCRIPTION_FILENAME, EEG_DEFAULT_SETTING_FILENAME, \
     EEG_SETTING_FILENAME, TMS_DATA_FILENAME, HOTSPOT_MAP, EMG_SETTING_FILENAME, EMG_DEFAULT_SETTING, \
     TMS_DEFAULT_SETTING_FILENAME, CONTEXT_TREE_DEFAULT, ExportExecution
-from export.export_utils import create_list_of_trees
+from experiment.protocol_index import create_list_of_trees
 from export.models import Export
 from export.tests.mocks import set_mocks1, LIMESURVEY_SURVEY_ID_1, set_mocks2, set_mocks3, set_mocks4, \
     set_mocks5, set_mocks6, set_mocks7, update_mocks4_full_and_abbreviated, update_mocks7_full, \
@@ -1321,7 +1321,7 @@ class ExportDataCollectionTest(ExportTestCase):
         response = self.client.post(reverse('export_view'), data)
 
         # get the zipped file to test against its content
-        file = io.BytesIO(response.content)
+        file = io.BytesIO(b''.join(response.streaming_content))
         zipped_file = zipfile.ZipFile(file, 'r')
         self.assertIsNone(zipped_file.testzip())
 
@@ -1366,7 +1366,7 @@ class ExportDataCollectionTest(ExportTestCase):
         response = self.client.post(reverse('export_view'), data)
 
         # Get the zipped file to test against its content
-        file = io.BytesIO(response.content)
+        file = io.BytesIO(b''.join(response.streaming_content))
         zipped_file = zipfile.ZipFile(file, 'r')
         self.assertIsNone(zipped_file.testzip())
 
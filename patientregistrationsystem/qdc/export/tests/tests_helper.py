@@ -34,7 +34,7 @@ class ExportTestCase(ExperimentTestCase):
         session.save()
 
     def get_zipped_file(self, response):
-        file = io.BytesIO(response.content)
+        file = io.BytesIO(b''.join(response.streaming_content))
         zipped_file = zipfile.ZipFile(file, 'r')
         self.assertIsNone(zipped_file.testzip())
 
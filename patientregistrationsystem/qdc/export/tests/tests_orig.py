@@ -9,12 +9,13 @@ from django.core.urlresolvers import reverse
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
 from os import mkdir, remove, path
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 from shutil import rmtree
 
 
 from custom_user.models import User
 
-from export.export import is_patient_active
+from export.export import is_patient_active, ExportExecution
 from export.input_export import InputExport, build_complete_export_structure
 from export.views import Survey, Questionnaires, QuestionnaireResponse, create_directory
 
@@ -161,6 +162,48 @@ class DirectoryTest(TestCase):
         self.assertEquals(msg, _("Base path does not exist"))
 
 
+class ZipFileTest(TestCase):
+
+    def setUp(self):
+        self.basedir = path.join(path.dirname(path.realpath("__file__")), "test_zip_directory")
+        mkdir(self.basedir)
+        self.export = ExportExecution(1, 1)
+
+    def tearDown(self):
+        rmtree(self.basedir)
+
+    def write_file(self, filename, content):
+        complete_filename = path.join(self.basedir, filename)
+        with open(complete_filename, 'wb') as f:
+            f.write(content)
+        return complete_filename
+
+    def test_linked_file_is_zipped_from_where_it_is_stored_with_its_export_name(self):
+        source_filename = self.write_file('eeg_file_stored.raw', 1000 * b'eeg data')
+        export_filename = path.join(self.basedir, 'Participant_P1', 'eeg_file.raw')
+        self.export.link_file(source_filename, export_filename)
+        self.export.files_to_zip_list.append([export_filename, 'Per_participant/Participant_P1'])
+
+        zip_filename = path.join(self.basedir, 'export.zip')
+        self.export.write_zip_file(zip_filename)
+
+        self.assertFalse(path.exists(export_filename))
+        with ZipFile(zip_filename) as zip_file:
+            self.assertEqual(
+                zip_file.read('Per_participant/Participant_P1/eeg_file.raw'), 1000 * b'eeg data')
+
+    def test_compressed_files_are_stored_without_compression(self):
+        self.export.files_to_zip_list.append([self.write_file('sensor_position.png', 1000 * b'png'), 'EEG'])
+        self.export.files_to_zip_list.append([self.write_file('Participants.csv', 1000 * b'csv'), ''])
+
+        zip_filename = path.join(self.basedir, 'export.zip')
+        self.export.write_zip_file(zip_filename)
+
+        with ZipFile(zip_filename) as zip_file:
+            self.assertEqual(zip_file.getinfo('EEG/sensor_position.png').compress_type, ZIP_STORED)
+            self.assertEqual(zip_file.getinfo('Participants.csv').compress_type, ZIP_DEFLATED)
+
+
 class PatientActiveTest(TestCase):
     """ Cria um participante para ser utilizado durante os testes """
     user = ''
@@ -5,6 +5,9 @@ urlpatterns = [
     url(r'^$', views.export_menu, name='export_menu'),
     url(r'^create/$', views.export_create, name='export_create'),
     url(r'^view/$', views.export_view, name='export_view'),
+    url(r'^job/(?P<export_id>\d+)/$', views.export_job, name='export_job'),
+    url(r'^job/(?P<export_id>\d+)/status/$', views.export_job_status, name='export_job_status'),
+    url(r'^download/(?P<export_id>\d+)/$', views.export_download, name='export_download'),
 
     url(r'^filter_participants/$', views.filter_participants, name='filter_participants'),
     url(r'^experiment_selection/$', views.experiment_selection, name='experiment_selection'),
@@ -7,7 +7,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core import serializers
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils.translation import ugettext as ug_, ugettext_lazy as _
 from django.db.models import Q
@@ -16,16 +16,17 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 from os import path
-from zipfile import ZipFile
 from shutil import rmtree
 
 from survey.survey_utils import QuestionnaireUtils
 from .forms import ExportForm, ParticipantsSelectionForm, AgeIntervalForm
-from .models import Export
+from .models import Export, ExportJob
 
 from export.export import ExportExecution, create_directory
+from export.jobs import enqueue_export, get_export_workers
 from export.input_export import build_complete_export_structure
-from export.export_utils import create_list_of_trees, can_export_nwb
+from export.export_utils import can_export_nwb
+from experiment.protocol_index import create_list_of_trees
 
 from patient.models import QuestionnaireResponse, Patient
 from patient.views import check_limesurvey_access
@@ -223,10 +224,15 @@ def update_fields(list_, heading_type, fields):
 
 def export_create(
         request, export_id, input_filename, template_name='export/export_data.html', participants_plugin=None,
-        per_experiment_plugin=False):
+        per_experiment_plugin=False, progress=None):
+    """
+    :param progress: function called with the stage of the export, and how
+    much of it is done, as the export is made (see ExportJob.STAGE_OPTIONS)
+    """
     try:
         export_instance = Export.objects.get(user=request.user, id=export_id)
         export = ExportExecution(export_instance.user.id, export_instance.id)
+        export.progress = progress
         language_code = request.LANGUAGE_CODE
 
         if participants_plugin and not per_experiment_plugin:
@@ -262,6 +268,7 @@ def export_create(
 
         # Export participants data
         if export.get_input_data('participants')['output_list']:
+            export.report_progress('participants')
             participants_input_data = export.get_input_data('participants')['output_list']
             participants_list = export.get_participants_filtered_data()
             # If it's Per experiment exporting, add subject of group to
@@ -274,7 +281,7 @@ def export_create(
                     request.session['group_selected_list'])
             export_rows_participants = export.process_participant_data(
                 participants_input_data, participants_list, language_code, participants_plugin)
-            export.get_input_data('participants')['data_list'] = export_rows_participants
+            export.set_participant_rows(export_rows_participants)
             # Create file participants.csv and diagnosis.csv
             error_msg = export.build_participant_export_data(
                 'group_selected_list' in request.session, request.POST.get('headings'))
@@ -287,6 +294,7 @@ def export_create(
             export.include_group_data(request.session['group_selected_list'], participants_plugin)
             # if fields from questionnaires were selected
             if export.get_input_data('questionnaire_list'):
+                export.report_progress('questionnaires')
                 export.get_questionnaires_responses(request.POST.get('headings'))
 
             error_msg = export.create_group_data_directory()
@@ -340,6 +348,7 @@ def export_create(
         else:
             # Export method: filter by entrance questionnaire
             if export.get_input_data('questionnaires'):
+                export.report_progress('questionnaires')
                 # Process per questionnaire data - entrance evaluation questionnaires
                 error_msg = export.process_per_questionnaire(request.POST.get('headings'), participants_plugin)
                 if error_msg == Questionnaires.ERROR_CODE:  # TODO (NES-971): ??
@@ -367,10 +376,7 @@ def export_create(
             export_filename = export.get_input_data('export_filename')
             export_complete_filename = path.join(base_directory_name, export_filename)
 
-            with ZipFile(export_complete_filename, 'w') as zip_file:
-                for filename, directory, *resource in export.files_to_zip_list:  # just by now
-                    fdir, fname = path.split(filename)
-                    zip_file.write(filename.encode('utf-8'), path.join(directory, fname))
+            export.write_zip_file(export_complete_filename)
 
             output_export_file = path.join(
                 'export', path.join(str(export_instance.user.id), str(export_instance.id), str(export_filename)))
@@ -525,6 +531,10 @@ def export_view(request, template_name='export/export_data.html'):
                     diagnosis_list, questionnaires_list, experiment_questionnaires_list, responses_type,
                     heading_type, input_filename, component_list, language_code, filesformat_type)
 
+                if get_export_workers():
+                    enqueue_export(request, export_instance, input_filename)
+                    return redirect('export_job', export_id=export_instance.id)
+
                 result = export_create(request, export_instance.id, input_filename)
 
                 if isinstance(result, HttpResponse):
@@ -533,8 +543,8 @@ def export_view(request, template_name='export/export_data.html'):
                     return result
                 elif path.exists(result):
                     messages.success(request, _('Export was finished correctly'))
-                    zip_file = open(result, 'rb')
-                    response = HttpResponse(zip_file, content_type='application/zip')
+                    # Streamed in chunks, not read into memory
+                    response = FileResponse(open(result, 'rb'), content_type='application/zip')
                     response['Content-Disposition'] = 'attachment; filename="export.zip"'
                     response['Content-Length'] = path.getsize(result)
                     return response
@@ -699,6 +709,53 @@ def export_view(request, template_name='export/export_data.html'):
         return render(request, template_name, context)
 
 
+@login_required
+def export_job(request, export_id, template_name='export/export_job.html'):
+    export_job_ = get_object_or_404(ExportJob, export_id=export_id, export__user=request.user)
+
+    context = {
+        'export_job': export_job_,
+    }
+
+    return render(request, template_name, context)
+
+
+@login_required
+def export_job_status(request, export_id):
+    export_job_ = get_object_or_404(ExportJob, export_id=export_id, export__user=request.user)
+
+    status = {
+        'status': export_job_.status,
+        'status_display': export_job_.get_status_display(),
+        'stage': export_job_.stage,
+        'stage_display': export_job_.get_stage_display(),
+        'done': export_job_.done,
+        'total': export_job_.total,
+        'error_message': export_job_.error_message,
+        'download_url': reverse('export_download', args=(export_id,)) if export_job_.status == 'finished' else None,
+    }
+
+    return HttpResponse(json.dumps(status), content_type='application/json')
+
+
+@login_required
+def export_download(request, export_id):
+    export_instance = get_object_or_404(Export, id=export_id, user=request.user)
+    # Joined with MEDIA_ROOT only when set, as an empty name is MEDIA_ROOT itself
+    export_filename = path.join(settings.MEDIA_ROOT, export_instance.output_export.name) \
+        if export_instance.output_export else None
+
+    if not export_filename or not path.isfile(export_filename):
+        messages.error(request, _('Export data was not generated.'))
+        return redirect('export_menu')
+
+    response = FileResponse(open(export_filename, 'rb'), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % path.basename(export_filename)
+    response['Content-Length'] = path.getsize(export_filename)
+
+    return response
+
+
 def get_component_with_data_and_metadata(group, component_list):
 
     # data collection
@@ -1291,30 +1348,6 @@ def get_block_type_name(block_type):
     return block_type_name if block_type_name else block_type
 
 
-def list_data_configuration_tree(eeg_configuration_id, list_of_path):
-    data_configuration_tree = DataConfigurationTree.objects.filter(component_configuration_id=eeg_configuration_id)
-    list_of_path_in_db = []
-    data_configuration_tree_id = None
-
-    if data_configuration_tree:
-        for item in data_configuration_tree:
-            list_of_path_in_db.insert(0, item.component_configuration_id)
-            parent = item.parent_id
-            data_configuration_tree_id = item.id
-            while parent:
-                path = DataConfigurationTree.objects.get(id=parent)
-                list_of_path_in_db.insert(0, path.component_configuration_id)
-                parent = path.parent_id
-
-            if list_of_path_in_db == list_of_path:
-                break
-            else:
-                list_of_path_in_db = []
-                data_configuration_tree_id = None
-
-    return data_configuration_tree_id
-
-
 def search_locations(request):
 
     if request.is_ajax():
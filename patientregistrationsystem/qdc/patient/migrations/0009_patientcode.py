@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+
+from django.db import migrations, models
+
+
+def fill_patient_code_pool(apps, schema_editor):
+    # Same as PatientCode.fill_pool
+    patient_code_model = apps.get_model('patient', 'patientcode')
+    used_codes = set(apps.get_model('patient', 'patient').objects.values_list('code', flat=True))
+    codes = ['P' + str(number) for number in range(1, 100000) if 'P' + str(number) not in used_codes]
+    random.shuffle(codes)
+    patient_code_model.objects.bulk_create(
+        [patient_code_model(code=code, position=position) for position, code in enumerate(codes)], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0008_auto_20191125_1403'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientCode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('position', models.IntegerField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(fill_patient_code_pool, migrations.RunPython.noop),
+    ]
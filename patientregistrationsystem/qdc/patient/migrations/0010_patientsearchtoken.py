@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return [token[:50] for token in re.findall(r'\w+', text)]
+
+
+def index_patients(apps, schema_editor):
+    # Same as PatientSearchToken.index_patients
+    patient_search_token_model = apps.get_model('patient', 'patientsearchtoken')
+    search_tokens = []
+    for patient_id, name, code, cpf in apps.get_model('patient', 'patient').objects.values_list(
+            'id', 'name', 'code', 'cpf').iterator():
+        tokens = set(tokenize(name)) | set(tokenize(code))
+        if cpf:
+            tokens |= set(tokenize(cpf))
+            tokens.add(re.sub(r'\D', '', cpf))
+        tokens.discard('')
+        search_tokens += [patient_search_token_model(patient_id=patient_id, token=token) for token in tokens]
+    patient_search_token_model.objects.bulk_create(search_tokens, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0009_patientcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, max_length=50)),
+                ('patient', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens',
+                    to='patient.Patient')),
+            ],
+        ),
+        migrations.RunPython(index_patients, migrations.RunPython.noop),
+    ]
@@ -2,8 +2,11 @@
 
 import datetime
 import random
+import re
+import unicodedata
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import signals, Case, When, Value, IntegerField, Sum
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
@@ -394,10 +397,164 @@ class Patient(models.Model):
 
     @staticmethod
     def create_random_patient_code():
-        used_codes = set([patient.code for patient in Patient.objects.all()])
-        possible_code = set(['P' + str(item) for item in range(1, 100000)])
-        available_codes = list(possible_code - used_codes)
-        return random.choice(available_codes)
+        return PatientCode.reserve()[0]
+
+
+class PatientCode(models.Model):
+    """Pool of the patient codes not used yet, in random order, so that new
+    patients take a random code without reading the codes of all patients.
+    The pool is filled when it is found empty.
+    """
+    code = models.CharField(max_length=10, unique=True)
+    position = models.IntegerField(db_index=True)
+
+    PREFIX = 'P'
+    MAX_NUMBER = 99999
+
+    @classmethod
+    def fill_pool(cls):
+        """Fill the pool with the codes from P1 to P99999 not used by patients,
+        in random order
+        """
+        used_codes = set(Patient.objects.values_list('code', flat=True))
+        codes = [
+            cls.PREFIX + str(number) for number in range(1, cls.MAX_NUMBER + 1)
+            if cls.PREFIX + str(number) not in used_codes
+        ]
+        random.shuffle(codes)
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(
+                    [cls(code=code, position=position) for position, code in enumerate(codes)], batch_size=5000)
+        except IntegrityError:
+            # Filled by other process at the same time
+            pass
+
+    @classmethod
+    def _take(cls, number_of_codes):
+        # Concurrent transactions skip the codes that the others are taking
+        # instead of waiting for them
+        with transaction.atomic():
+            codes = list(cls.objects.select_for_update(skip_locked=True).order_by(
+                'position').values_list('id', 'code')[:number_of_codes])
+            cls.objects.filter(id__in=[id_ for id_, code in codes]).delete()
+        return [code for id_, code in codes]
+
+    @classmethod
+    def reserve(cls, number_of_codes=1):
+        """Take codes from the pool
+        :param number_of_codes: number of codes, e.g. for importing patients
+        :return: list of codes
+        """
+        codes = []
+        filled = False
+        while len(codes) < number_of_codes:
+            taken = cls._take(number_of_codes - len(codes))
+            if not taken:
+                if filled:
+                    raise ValueError('There are no patient codes available')
+                cls.fill_pool()
+                filled = True
+                continue
+            # Patients not created by save (as the ones loaded from fixtures)
+            # may have codes of the pool
+            used_codes = set(Patient.objects.filter(code__in=taken).values_list('code', flat=True))
+            codes += [code for code in taken if code not in used_codes]
+
+        return codes
+
+
+class PatientSearchToken(models.Model):
+    """Words of the name, code and CPF of the patients, accent folded and
+    lowercased, for searching patients by prefix of the words with an index
+    instead of reading the whole table. The tokens of a patient are replaced
+    when the patient is saved.
+    """
+    patient = models.ForeignKey(Patient, related_name='search_tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=50, db_index=True)
+
+    MAX_SEARCH_RESULTS = 100
+
+    @staticmethod
+    def normalize(text):
+        """
+        :param text: text with accents, e.g. 'José'
+        :return: text without accents, lowercased, e.g. 'jose'
+        """
+        text = unicodedata.normalize('NFKD', text or '')
+        return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+    @classmethod
+    def tokenize(cls, text):
+        return [token[:cls._meta.get_field('token').max_length] for token in re.findall(r'\w+', cls.normalize(text))]
+
+    @classmethod
+    def tokens_of(cls, patient):
+        """
+        :param patient: Patient
+        :return: set of the tokens of the name, code and CPF of patient, the
+        CPF also with its digits only
+        """
+        tokens = set(cls.tokenize(patient.name)) | set(cls.tokenize(patient.code))
+        if patient.cpf:
+            tokens |= set(cls.tokenize(patient.cpf))
+            tokens.add(re.sub(r'\D', '', patient.cpf))
+        tokens.discard('')
+        return tokens
+
+    @classmethod
+    def index_patients(cls, patients):
+        """Replace the tokens of patients, e.g. of the ones inserted in bulk
+        :param patients: Patient list or queryset
+        """
+        patients = list(patients)
+        with transaction.atomic():
+            cls.objects.filter(patient__in=patients).delete()
+            cls.objects.bulk_create(
+                [cls(patient=patient, token=token) for patient in patients for token in cls.tokens_of(patient)],
+                batch_size=5000)
+
+    @classmethod
+    def search_terms(cls, search_text):
+        # CPFs are searched by their digits, with or without punctuation
+        if re.match(r'^[\d.\-/\s]*\d[\d.\-/\s]*$', search_text):
+            return [re.sub(r'\D', '', search_text)]
+        return cls.tokenize(search_text)
+
+    @classmethod
+    def search(cls, search_text, page=1, exclude_group_id=None):
+        """Search the patients not removed with words starting with each word of
+        search_text, ignoring accents and case. Patients with more words equal
+        to the ones searched come first, then by name.
+        :param search_text: e.g. 'jose sil', 'P123' or '123.456'
+        :param page: page of MAX_SEARCH_RESULTS patients, starting at 1
+        :param exclude_group_id: id of an experiment group whose participants
+        are not searched
+        :return: Patient queryset with at most MAX_SEARCH_RESULTS patients
+        """
+        terms = cls.search_terms(search_text)
+        patients = Patient.objects.exclude(removed=True)
+        if exclude_group_id:
+            patients = patients.exclude(subject__subjectofgroup__group_id=exclude_group_id)
+        for term in terms:
+            patients = patients.filter(
+                pk__in=cls.objects.filter(token__startswith=term).values('patient_id'))
+        if terms:
+            patients = patients.annotate(exact_matches=Sum(Case(
+                When(search_tokens__token__in=terms, then=Value(1)), default=Value(0), output_field=IntegerField()
+            ))).order_by('-exact_matches', 'name', 'code')
+        else:
+            patients = patients.order_by('name', 'code')
+
+        start = (max(page, 1) - 1) * cls.MAX_SEARCH_RESULTS
+        return patients[start:start + cls.MAX_SEARCH_RESULTS]
+
+
+def index_patient_signal(sender, instance, **kwargs):
+    PatientSearchToken.index_patients([instance])
+
+
+signals.post_save.connect(index_patient_signal, sender=Patient, dispatch_uid='patient.search_tokens')
 
 
 class Telephone(models.Model):
@@ -0,0 +1,129 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from patient.models import Patient, PatientCode, PatientSearchToken, Gender
+from patient.tests.tests_orig import UtilTests
+
+
+class PatientCodeTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='jose', email='jose@example.com', password='passwd')
+
+    def test_new_patient_takes_code_from_pool(self):
+        pool_size = PatientCode.objects.count()
+
+        patient = UtilTests.create_patient(changed_by=self.user)
+
+        self.assertRegex(patient.code, r'^P\d{1,5}$')
+        self.assertEqual(PatientCode.objects.count(), pool_size - 1)
+        self.assertFalse(PatientCode.objects.filter(code=patient.code).exists())
+
+    def test_codes_are_reserved_in_batch_without_repetition(self):
+        codes = PatientCode.reserve(500)
+
+        self.assertEqual(len(set(codes)), 500)
+        self.assertFalse(PatientCode.objects.filter(code__in=codes).exists())
+
+    def test_codes_used_by_patients_are_skipped(self):
+        code = PatientCode.objects.order_by('position').first().code
+        patient = UtilTests.create_patient(changed_by=self.user)
+        Patient.objects.filter(pk=patient.pk).update(code=code)
+
+        self.assertNotEqual(PatientCode.reserve()[0], code)
+
+    def test_empty_pool_is_filled_without_used_codes(self):
+        patient = UtilTests.create_patient(changed_by=self.user)
+        PatientCode.objects.all().delete()
+
+        codes = PatientCode.reserve(2)
+
+        self.assertEqual(len(codes), 2)
+        self.assertEqual(PatientCode.objects.count(), PatientCode.MAX_NUMBER - 1 - 2)
+        self.assertNotIn(patient.code, codes)
+        self.assertFalse(PatientCode.objects.filter(code=patient.code).exists())
+
+
+class PatientSearchTokenTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='jose', email='jose@example.com', password='passwd')
+        self.gender = Gender.objects.create(name='Masculino')
+
+    def create_patient(self, name, cpf=None):
+        return Patient.objects.create(
+            name=name, cpf=cpf, date_birth=datetime.date(1980, 1, 1), gender=self.gender, changed_by=self.user)
+
+    def test_patient_is_indexed_when_saved(self):
+        patient = self.create_patient('José da Silva', '374.276.738-08')
+
+        self.assertEqual(
+            set(patient.search_tokens.values_list('token', flat=True)),
+            {'jose', 'da', 'silva', patient.code.lower(), '374', '276', '738', '08', '37427673808'})
+
+        patient.name = 'João da Silva'
+        patient.save()
+
+        self.assertIn('joao', patient.search_tokens.values_list('token', flat=True))
+        self.assertNotIn('jose', patient.search_tokens.values_list('token', flat=True))
+
+    def test_search_ignores_accents_and_case(self):
+        patient = self.create_patient('José Conceição')
+        self.create_patient('Maria Silva')
+
+        self.assertEqual(list(PatientSearchToken.search('jose conc')), [patient])
+        self.assertEqual(list(PatientSearchToken.search('CONCEIÇÃO')), [patient])
+        self.assertEqual(list(PatientSearchToken.search('Jóse')), [patient])
+
+    def test_search_by_code_and_cpf(self):
+        patient = self.create_patient('Maria Silva', '374.276.738-08')
+        self.create_patient('Maria Souza', '123.456.789-09')
+
+        self.assertEqual(list(PatientSearchToken.search(patient.code)), [patient])
+        self.assertEqual(list(PatientSearchToken.search('374.276')), [patient])
+        self.assertEqual(list(PatientSearchToken.search('3742767')), [patient])
+
+    def test_search_skips_removed_patients(self):
+        patient = self.create_patient('Maria Silva')
+        patient.removed = True
+        patient.save()
+
+        self.assertFalse(PatientSearchToken.search('maria').exists())
+
+    def test_exact_words_are_ranked_first(self):
+        silvana = self.create_patient('Ana Silvana')
+        silva = self.create_patient('Bruno Silva')
+
+        self.assertEqual(list(PatientSearchToken.search('silva')), [silva, silvana])
+
+    def test_results_are_capped_and_paginated(self):
+        for number in range(PatientSearchToken.MAX_SEARCH_RESULTS + 5):
+            self.create_patient('Maria %03d' % number)
+
+        first_page = list(PatientSearchToken.search('maria'))
+        second_page = list(PatientSearchToken.search('maria', page=2))
+
+        self.assertEqual(len(first_page), PatientSearchToken.MAX_SEARCH_RESULTS)
+        self.assertEqual(len(second_page), 5)
+        self.assertEqual(first_page[0].name, 'Maria 000')
+        self.assertFalse(set(first_page) & set(second_page))
+
+    def test_each_keystroke_searches_the_token_index_in_one_query(self):
+        for name in ('José Conceição Silva', 'José Conceição Santos', 'José Silva', 'Maria Conceição Silva'):
+            self.create_patient(name)
+
+        search_text = 'jose conceicao sil'
+        for length in range(1, len(search_text) + 1):
+            with CaptureQueriesContext(connection) as queries:
+                patients = list(PatientSearchToken.search(search_text[:length]))
+            self.assertEqual(len(queries), 1)
+            # Words are looked up by prefix in the indexed tokens, not in the names of the patients
+            self.assertIn('"patient_patientsearchtoken"."token"', queries[0]['sql'])
+            self.assertNotIn('"patient_patient"."name"::text LIKE', queries[0]['sql'])
+            self.assertNotIn('UPPER(', queries[0]['sql'])
+
+        self.assertEqual([patient.name for patient in patients], ['José Conceição Silva'])
@@ -1,7 +1,8 @@
 from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
 from .tests_orig import QuestionnaireFormValidation, UtilTests
@@ -11,6 +12,8 @@ USERNAME = 'joaopedro'
 PASSWD = 'password'
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class QuestionnaireFillTest(TestCase):
 
     def setUp(self):
@@ -44,6 +44,7 @@ from patient.views import medical_record_view, medical_record_update, \
     medical_record_create_diagnosis_create, exam_create, exam_view, \
     patient_update, patient_view, restore_patient, reverse, \
     check_limesurvey_access
+from survey import survey_cache
 from survey.abc_search_engine import Questionnaires
 from survey.models import Survey
 from update_english_data import translate_fixtures_into_english, \
@@ -815,6 +816,14 @@ class PatientFormValidation(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, patient.cpf)
 
+    def test_search_with_page_that_is_not_a_number_shows_first_page(self):
+        patient = self.util.create_patient(changed_by=self.user)
+
+        response = self.client.post(reverse(PATIENT_SEARCH), {'search_text': patient.code, 'page': 'next'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'href="/patient/%s"' % patient.id)
+
     def test_views(self):
         """
         Tests aleatorios de views para checar robustez
@@ -1247,6 +1256,8 @@ class MedicalRecordFormValidation(TestCase):
         self.assertEqual(response.context['cid_10_list'], '')
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class QuestionnaireFormValidation(TestCase):
     """
     For this test to be executed, it is necessary to
@@ -1677,14 +1688,8 @@ class QuestionnaireFormValidation(TestCase):
         url2 = url1.replace('experiment', 'patient')
         response = self.client.get(url2 + "?origin=subject&status=edit")
         self.assertEqual(response.status_code, 200)
-        self.assertIsNone(cache.get(
-            "pt-br" + "-" + str(survey_mock.lime_survey_id) + "-"
-            + str(response_survey_mock.token_id) + "_survey_title_participant")
-        )
-        self.assertIsNone(cache.get(
-            "pt-br" + "-" + str(survey_mock.lime_survey_id) + "-"
-            + str(response_survey_mock.token_id) + "_group_of_questions_participant")
-        )
+        self.assertIsNone(cache.get(survey_cache.make_key(
+            Questionnaires(), survey_mock.lime_survey_id, 'structure', 'pt-BR')))
         self.assertEqual(response_survey_mock.token_id, response.context["questionnaire_response"].token_id)
 
     @patch('survey.abc_search_engine.Server')
@@ -1707,14 +1712,23 @@ class QuestionnaireFormValidation(TestCase):
         url2 = url1.replace('experiment', 'patient')
         response = self.client.get(url2 + "?origin=subject&status=edit")
         self.assertEqual(response.status_code, 200)
-        self.assertIsNotNone(cache.get(
-            "pt-br" + "-" + str(survey_mock.lime_survey_id) + "-"
-            + str(response_survey_mock.token_id) + "_survey_title_participant")
-        )
-        self.assertIsNotNone(cache.get(
-            "pt-br" + "-" + str(survey_mock.lime_survey_id) + "-"
-            + str(response_survey_mock.token_id) + "_group_of_questions_participant")
-        )
+        self.assertIsNotNone(cache.get(survey_cache.make_key(
+            Questionnaires(), survey_mock.lime_survey_id, 'structure', 'pt-BR')))
+        groups_of_questions = response.context['groups_of_questions']
+
+        # Viewing the response again reads the survey structure from the
+        # cache, but the responses of the token from LimeSurvey
+        mockServer.reset_mock()
+        mockServer.return_value.get_participant_properties.side_effect = [
+            {'completed': '2018-05-15 15:51'},
+            {'token': 'y32dlEFm9J1MTH4'}
+        ]
+        response = self.client.get(url2 + "?origin=subject&status=edit")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(groups_of_questions, response.context['groups_of_questions'])
+        mockServer.return_value.list_groups.assert_not_called()
+        mockServer.return_value.get_question_properties.assert_not_called()
+        self.assertTrue(mockServer.return_value.export_responses_by_token.called)
         self.assertEqual(response_survey_mock.token_id, response.context["questionnaire_response"].token_id)
 
     @patch('survey.abc_search_engine.Server')
@@ -15,7 +15,6 @@ from django.http import HttpResponseRedirect
 from django.shortcuts import render, render_to_response, get_object_or_404
 from django.conf import settings
 from django.utils.translation import ugettext as _
-from django.core.cache import cache
 
 from experiment.models import Subject, SubjectOfGroup, \
     QuestionnaireResponse as ExperimentQuestionnaireResponse, Questionnaire
@@ -26,9 +25,10 @@ from patient.forms import PatientForm, TelephoneForm, \
     ExamFileForm
 from patient.models import Patient, Telephone, SocialDemographicData,\
     SocialHistoryData, MedicalRecordData, ClassificationOfDiseases, Diagnosis,\
-    ExamFile, ComplementaryExam, QuestionnaireResponse
+    ExamFile, ComplementaryExam, QuestionnaireResponse, PatientSearchToken
 
 from survey.abc_search_engine import Questionnaires
+from survey.token_completion import TokenCompletionMirror
 from survey.models import Survey
 from survey.survey_utils import find_questionnaire_name
 from survey.views import get_questionnaire_responses, check_limesurvey_access, \
@@ -481,6 +481,12 @@ def patient_view_questionnaires(request, patient, context, is_update):
     questionnaire_responses = \
         QuestionnaireResponse.objects.filter(patient=patient).order_by('date')
 
+    # The completion of the tokens of each survey is read at once, unless
+    # it was read recently
+    token_completion = TokenCompletionMirror(surveys)
+    token_completion.refresh(
+        questionnaire_response.survey.lime_survey_id for questionnaire_response in questionnaire_responses)
+
     for questionnaire_response in questionnaire_responses:
         limesurvey_id = questionnaire_response.survey.lime_survey_id
         if limesurvey_id not in patient_questionnaires_data_dictionary:
@@ -494,17 +500,21 @@ def patient_view_questionnaires(request, patient, context, is_update):
                     'questionnaire_responses': []
                 }
 
-        properties = surveys.get_participant_properties(
-            limesurvey_id, questionnaire_response.token_id)
-        if properties:
+        completed = token_completion.completed(
+            limesurvey_id, questionnaire_response)
+        if completed is not None:
             update_completed_status(
-                limesurvey_id, properties['completed'],
-                questionnaire_response)
-            language = get_questionnaire_language(
-                surveys, limesurvey_id, language_code)
-            acquisitiondate_updated = update_acquisition_date(
-                limesurvey_id, properties['token'],
-                questionnaire_response, language)
+                limesurvey_id, completed, questionnaire_response)
+            acquisitiondate_updated = False
+            # Only completed responses have an acquisition date
+            if questionnaire_response.is_completed != 'N' \
+                    and questionnaire_response.is_completed != '':
+                token = surveys.get_participant_properties(
+                    limesurvey_id, questionnaire_response.token_id, 'token')
+                language = get_questionnaire_language(
+                    surveys, limesurvey_id, language_code)
+                acquisitiondate_updated = update_acquisition_date(
+                    limesurvey_id, token, questionnaire_response, language)
 
             response_result = questionnaire_response.is_completed
 
@@ -561,11 +571,7 @@ def patient_view_questionnaires(request, patient, context, is_update):
 
             if questionnaire_response.is_completed == 'N' \
                     or questionnaire_response.is_completed == '':
-                is_completed = surveys.get_participant_properties(
-                    limesurvey_id, questionnaire_response.token_id,
-                    'completed') or ''
-                questionnaire_response.is_completed = is_completed
-                questionnaire_response.save()
+                token_completion.completed(limesurvey_id, questionnaire_response)
 
             response_result = questionnaire_response.is_completed
 
@@ -657,15 +663,11 @@ def search_patients_ajax(request):
     if request.method == "POST":
         search_text = request.POST['search_text']
         if search_text:
-            if re.match('P{1}[0-9]', search_text):
-                patient_list = \
-                    Patient.objects.filter(code__icontains=search_text).exclude(removed=True).order_by('code')
-            elif re.match('[a-zA-Z ]+', search_text):
-                patient_list = \
-                    Patient.objects.filter(name__icontains=search_text).exclude(removed=True).order_by('name')
-            else:
-                patient_list = \
-                    Patient.objects.filter(cpf__icontains=search_text).exclude(removed=True).order_by('name')
+            try:
+                page = int(request.POST.get('page', 1))
+            except ValueError:
+                page = 1
+            patient_list = PatientSearchToken.search(search_text, page)
 
     return render_to_response('patient/ajax_search.html', {'patients': patient_list})
 
@@ -1240,23 +1242,9 @@ def questionnaire_response_view(
                 token_id=questionnaire_response.token_id,
                 data_configuration_tree__component_configuration__component__in=questionnaire_component_list).exists()
 
-    survey_title_key = \
-        request.LANGUAGE_CODE + "-" + str(questionnaire_response.survey.lime_survey_id) + \
-        "-" + str(questionnaire_response.token_id) + "_survey_title_participant"
-    groups_of_questions_key = \
-        request.LANGUAGE_CODE + "-" + str(questionnaire_response.survey.lime_survey_id) + \
-        "-" + str(questionnaire_response.token_id) + "_group_of_questions_participant"
-
-    survey_title = cache.get(survey_title_key)
-    groups_of_questions = cache.get(groups_of_questions_key)
-
-    if not survey_title or not groups_of_questions:
-        survey_title, groups_of_questions = get_questionnaire_responses(
-            request.LANGUAGE_CODE, questionnaire_response.survey.lime_survey_id,
-            questionnaire_response.token_id, request)
-
-        cache.set(survey_title_key, survey_title)
-        cache.set(groups_of_questions_key, groups_of_questions)
+    survey_title, groups_of_questions = get_questionnaire_responses(
+        request.LANGUAGE_CODE, questionnaire_response.survey.lime_survey_id,
+        questionnaire_response.token_id, request)
 
     context = {
         "questionnaire_response_form": questionnaire_response_form,
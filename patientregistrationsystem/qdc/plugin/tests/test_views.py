@@ -27,6 +27,8 @@ from survey.tests.tests_helper import create_survey
 TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class PluginTest(ExportTestCase):
 
     def setUp(self):
@@ -1,19 +1,39 @@
+from django.contrib.auth import HASH_SESSION_KEY
 from django.urls import reverse
 
 from custom_user.models import UserProfile
-import re
 from django.shortcuts import redirect
 
+EXEMPT_PATHS = ('/password_change', '/logout')
+FORCE_PASSWORD_CHANGE_SESSION_KEY = '_force_password_change'
+
 
 class PasswordChangeMiddleware:
 
     @staticmethod
     def process_request(request):
         if request.user.is_authenticated() and not \
-                re.match(r'^/password_change/?', request.path) and not \
-                re.match(r'^/logout/?', request.path) and not \
+                request.path.startswith(EXEMPT_PATHS) and not \
                 request.user.is_superuser:
 
-            zm, created = UserProfile.objects.get_or_create(user=request.user)
-            if zm.force_password_change:
+            if force_password_change(request):
                 return redirect(reverse('password_change'))
+
+
+def force_password_change(request):
+    """Read the force_password_change flag of the profile of the user once per
+    session. The flag is set along with a new password by the researcher
+    update and unset when the user changes the password, so it is kept in the
+    session with the auth hash of the session, which changes with the password
+    (and sessions with the old password are logged out).
+    :param request: request of an authenticated user
+    :return: True if the user must change the password
+    """
+    session_auth_hash = request.session.get(HASH_SESSION_KEY)
+    cached = request.session.get(FORCE_PASSWORD_CHANGE_SESSION_KEY)
+    if cached and cached[0] == session_auth_hash:
+        return cached[1]
+
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    request.session[FORCE_PASSWORD_CHANGE_SESSION_KEY] = [session_auth_hash, profile.force_password_change]
+    return profile.force_password_change
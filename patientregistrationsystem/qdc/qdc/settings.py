@@ -113,6 +113,18 @@ CACHES = {
         'LOCATION': 'limesurveycache',
         'TIMEOUT': 24*60*60,
 
+    },
+    # Survey titles, languages, structures and response headers read from
+    # LimeSurvey (see survey.survey_cache). Entries expire after TIMEOUT and the oldest are
+    # culled past MAX_ENTRIES. The versions of the surveys, which make the
+    # entries stale, are kept in 'default' so that every process sees them.
+    'limesurvey': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'limesurvey',
+        'TIMEOUT': 60*60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        }
     }
 }
 
@@ -120,12 +132,24 @@ ROOT_URLCONF = 'qdc.urls'
 
 WSGI_APPLICATION = 'qdc.wsgi.application'
 
+# Resets what is kept from LimeSurvey between tests
+TEST_RUNNER = 'qdc.test_runner.TestRunner'
+
 # LimeSurvey configuration
 LIMESURVEY = {
     'URL_API': '',
     'URL_WEB': '',
     'USER': '',
     'PASSWORD': '',
+    # Seconds a session key not used is kept before logging in again. Must
+    # not exceed LimeSurvey's iSessionExpirationTime
+    'SESSION_EXPIRATION': 60*60,
+    # Seconds to wait for concurrent calls before giving up on them
+    'CALL_TIMEOUT': 60,
+    # Seconds the completion of the tokens of a survey, mirrored in the
+    # questionnaire responses, is used before reading it again (see
+    # survey.token_completion)
+    'COMPLETION_SYNC_INTERVAL': 60,
 }
 
 # Portal API configuration
@@ -133,9 +157,18 @@ PORTAL_API = {
     'URL': '',
     'PORT': '',
     'USER': '',
-    'PASSWORD': ''
+    'PASSWORD': '',
+    # Seconds the API schema is kept before downloading it again
+    'SCHEMA_EXPIRATION': 10*60,
+    # Objects of a schedule of sending sent at the same time (see
+    # experiment.portal_sending); 1 sends them in sequence
+    'MAX_CONCURRENT_SENDS': 4,
 }
 
+# Threads of each process making exports in background (see export.jobs).
+# With 0, exports are made in the request that asks for them
+EXPORT_WORKERS = 0
+
 # Show button to send experiments to Portal
 SHOW_SEND_TO_PORTAL_BUTTON = False
 
@@ -31,9 +31,25 @@ LIMESURVEY = {
     'URL_API': 'http://example.limesurvey.server.com',
     'URL_WEB': 'http://example.limesurvey.server.com',
     'USER': 'limesurvey_user',
-    'PASSWORD': 'limesurvey_password'
+    'PASSWORD': 'limesurvey_password',
+    'MAX_CONCURRENT_CALLS': 8,
+    'CALL_TIMEOUT': 60,
+    'COMPLETION_SYNC_INTERVAL': 60
 }
 
+# Portal configuration
+PORTAL_API = {
+    'URL': 'http://example.portal.server.com',
+    'PORT': '80',
+    'USER': 'portal_user',
+    'PASSWORD': 'portal_password',
+    'SCHEMA_EXPIRATION': 10*60,
+    'MAX_CONCURRENT_SENDS': 4
+}
+
+# Threads making exports in background; 0 makes exports in the request
+EXPORT_WORKERS = 2
+
 # Settings to send emails
 EMAIL_USE_TLS = True
 EMAIL_HOST = 'smtp.example.com'
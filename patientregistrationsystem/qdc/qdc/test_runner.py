@@ -0,0 +1,31 @@
+import unittest
+
+from django.test.runner import DiscoverRunner
+
+
+def reset_limesurvey_state():
+    """Drop what the process keeps from LimeSurvey, as each test mocks
+    LimeSurvey in its own way
+    """
+    from survey import survey_cache
+    from survey.abc_search_engine import LimeSurveySession
+
+    survey_cache.clear()
+    LimeSurveySession.reset()
+
+
+class TestRunner(DiscoverRunner):
+    """Test runner that resets the state kept from LimeSurvey before each
+    test
+    """
+
+    def get_resultclass(self):
+        resultclass = super(TestRunner, self).get_resultclass() or unittest.TextTestResult
+
+        class ResetLimeSurveyStateResult(resultclass):
+
+            def startTest(self, test):
+                reset_limesurvey_state()
+                super(ResetLimeSurveyStateResult, self).startTest(test)
+
+        return ResetLimeSurveyStateResult
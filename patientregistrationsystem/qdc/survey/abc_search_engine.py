@@ -1,37 +1,312 @@
 # coding=utf-8
+import codecs
+import concurrent.futures
+import csv
+import functools
 import re
+import threading
+import time
 from abc import abstractmethod, ABC
 from base64 import b64decode, b64encode
-from jsonrpc_requests import Server, TransportError
+from collections import OrderedDict
+from jsonrpc_requests import Server, TransportError, ProtocolError
 from django.conf import settings
 
 
+def decode_lines(encoded, chunk_size):
+    """Decode a base 64 encoded utf-8 text a chunk at a time
+    :param encoded: base 64 encoded text
+    :param chunk_size: characters decoded at a time (multiple of 4)
+    :return: generator of the lines of the text, with their line endings
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for start in range(0, len(encoded), chunk_size):
+        lines = (pending + decoder.decode(b64decode(encoded[start:start + chunk_size]))).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def decode_csv_rows(encoded, columns=None, chunk_size=4 * 256 * 1024):
+    """Decode and parse a base 64 encoded csv a row at a time, so that only
+    a chunk of the text and a row are held in memory besides the encoded text
+    :param encoded: base 64 encoded csv, as exported by LimeSurvey
+    :param columns: headings of the columns to keep, in this order; the ones
+    not in the header are left out. All the columns by default.
+    :param chunk_size: characters decoded at a time (multiple of 4)
+    :return: generator of the rows as lists, the header first, the same as
+    csv.reader of the decoded text
+    """
+    rows = csv.reader(decode_lines(encoded, chunk_size), delimiter=',')
+    if columns is None:
+        yield from rows
+        return
+
+    header = next(rows, None)
+    if header is None:
+        return
+    indices = {}
+    for index, heading in enumerate(header):
+        indices.setdefault(heading, index)
+    subscripts = [indices[heading] for heading in OrderedDict.fromkeys(columns) if heading in indices]
+
+    yield [header[index] for index in subscripts]
+    for row in rows:
+        yield [row[index] for index in subscripts] if row else row
+
+
+class SurveyStructure:
+    """Groups and question properties of a LimeSurvey survey in one language.
+    Built by ABCSearchEngine.get_survey_structure so that views and exports
+    that need several questions of the same survey consult it instead of
+    querying LimeSurvey again.
+    """
+
+    def __init__(self, sid, language, groups, question_ids, question_properties, failed_question_ids=()):
+        """
+        :param sid: LimeSurvey survey id
+        :param language: language of the groups and question properties
+        :param groups: list of group dicts in language, in LimeSurvey order
+        :param question_ids: ids of the questions (not sub-questions), in
+        LimeSurvey order
+        :param question_properties: dict {question id: question properties}
+        :param failed_question_ids: ids of the questions whose properties
+        LimeSurvey failed to give, left out of question_ids
+        """
+        self.sid = sid
+        self.language = language
+        self.groups = groups
+        self.question_ids = question_ids
+        self.question_properties = question_properties
+        self.failed_question_ids = list(failed_question_ids)
+
+    @staticmethod
+    def group_id(group):
+        return group['id']['gid'] if 'id' in group else group['gid']
+
+    @staticmethod
+    def group_language(group):
+        return group['id']['language'] if 'id' in group else group['language']
+
+    def get_group(self, gid):
+        """
+        :param gid: LimeSurvey group id
+        :return: group dict or None
+        """
+        return next((group for group in self.groups if self.group_id(group) == gid), None)
+
+    def get_question_properties(self, question_id):
+        """
+        :param question_id: question ID
+        :return: properties of the question, as returned by
+        ABCSearchEngine.get_question_properties, or None
+        """
+        return self.question_properties.get(question_id)
+
+    def group_question_ids(self, gid):
+        """
+        :param gid: LimeSurvey group id
+        :return: sorted ids of the questions belonging to the group
+        """
+        return sorted(
+            question_id for question_id in self.question_ids
+            if self.question_properties[question_id]['gid'] == gid)
+
+    def questions(self, types=None):
+        """
+        :param types: list of question types. Defaults to return all questions
+        :return: list of question properties, in LimeSurvey order
+        """
+        return [
+            self.question_properties[question_id] for question_id in self.question_ids
+            if types is None or self.question_properties[question_id]['type'] in types
+        ]
+
+
+class LimeSurveySession:
+    """Session with the LimeSurvey Remote Control API shared by all the
+    Questionnaires instances of a process, so that they do not log in to
+    LimeSurvey each time they are created.
+
+    The session key is reused until it has not been used for
+    LIMESURVEY['SESSION_EXPIRATION'] seconds (LimeSurvey extends the key
+    expiration each time it is used), and a new one is requested when
+    LimeSurvey answers that it is invalid. Each thread gets its own Server,
+    keeping its HTTP connections alive between calls. There is a session for
+    each url and LimeSurvey user.
+    """
+
+    INVALID_SESSION_KEY = 'Invalid session key'
+    SESSION_EXPIRATION = 60 * 60
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+    def __init__(self, limesurvey_rpc):
+        self.limesurvey_rpc = limesurvey_rpc
+        self.session_key = None
+        self.last_used = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.metrics = {'logins': 0, 'logins_avoided': 0, 'relogins': 0, 'calls': 0}
+
+    @classmethod
+    def get(cls, limesurvey_rpc):
+        """
+        :param limesurvey_rpc: url of the LimeSurvey Remote Control API
+        :return: the LimeSurveySession of the process for the url and the
+        LIMESURVEY user
+        """
+        key = (limesurvey_rpc, settings.LIMESURVEY['USER'])
+        with cls._sessions_lock:
+            if key not in cls._sessions:
+                cls._sessions[key] = cls(limesurvey_rpc)
+            return cls._sessions[key]
+
+    @classmethod
+    def reset(cls):
+        """Forget the sessions of the process, without logging out, e.g.
+        between tests that mock Server differently
+        """
+        with cls._sessions_lock:
+            cls._sessions.clear()
+
+    @classmethod
+    def get_metrics(cls):
+        """
+        :return: dict with the number of logins, logins avoided by reusing a
+        session key, logins made again after an invalid session key and calls
+        made, summed over the sessions of the process
+        """
+        metrics = {'logins': 0, 'logins_avoided': 0, 'relogins': 0, 'calls': 0}
+        with cls._sessions_lock:
+            for session in cls._sessions.values():
+                for name, value in session.metrics.items():
+                    metrics[name] += value
+        return metrics
+
+    @property
+    def server(self):
+        if not hasattr(self.local, 'server'):
+            self.local.server = Server(self.limesurvey_rpc)
+        return self.local.server
+
+    def _count(self, metric):
+        with self.lock:
+            self.metrics[metric] += 1
+
+    def _expiration(self):
+        return settings.LIMESURVEY.get('SESSION_EXPIRATION', self.SESSION_EXPIRATION)
+
+    def _login(self):
+        # Must be called holding self.lock
+        self.metrics['logins'] += 1
+        try:
+            session_key = self.server.get_session_key(
+                settings.LIMESURVEY['USER'], settings.LIMESURVEY['PASSWORD'])
+            self.session_key = None if isinstance(session_key, dict) else session_key
+        except TransportError:
+            self.session_key = None
+        self.last_used = time.time()
+
+    def get_session_key(self):
+        """
+        :return: a valid session key, or None if LimeSurvey is unavailable
+        """
+        with self.lock:
+            if self.session_key and time.time() - self.last_used < self._expiration():
+                self.metrics['logins_avoided'] += 1
+            else:
+                self._login()
+            return self.session_key
+
+    def relogin(self, invalid_session_key):
+        """
+        :param invalid_session_key: session key LimeSurvey refused
+        :return: new session key, or None if LimeSurvey is unavailable
+        """
+        with self.lock:
+            # Other thread may have already logged in again
+            if self.session_key is None or self.session_key == invalid_session_key:
+                self.metrics['relogins'] += 1
+                self._login()
+            return self.session_key
+
+    def call(self, method_name, *args):
+        """Call a method of the API, logging in again and repeating the call
+        once if LimeSurvey answers that the session key (the first argument
+        of all methods) is invalid
+        """
+        self._count('calls')
+        result = getattr(self.server, method_name)(*args)
+        if args and isinstance(result, dict) and result.get('status') == self.INVALID_SESSION_KEY:
+            session_key = self.relogin(args[0])
+            if session_key:
+                self._count('calls')
+                result = getattr(self.server, method_name)(session_key, *args[1:])
+        self.last_used = time.time()
+
+        return result
+
+    def release(self):
+        """Log out from LimeSurvey"""
+        with self.lock:
+            if self.session_key:
+                self.server.release_session_key(self.session_key)
+                self.session_key = None
+
+
+class SessionServer:
+    """Server like object that makes its calls through a LimeSurveySession"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def __getattr__(self, method_name):
+        if method_name.startswith('_'):
+            raise AttributeError(method_name)
+        return functools.partial(self.session.call, method_name)
+
+
 class ABCSearchEngine(ABC):
     QUESTION_PROPERTIES = [
         'gid', 'question', 'question_order', 'subquestions', 'answeroptions',
         'title', 'type', 'attributes_lang', 'attributes', 'other'
     ]
+    # Characters of base 64 encoded archives and responses decoded at a time
+    # (multiple of 4)
+    BASE64_CHUNK_SIZE = 4 * 256 * 1024
 
-    session_key = None
+    session = None
     server = None
 
     def __init__(self, limesurvey_rpc=None):
         self.limesurvey_rpc = limesurvey_rpc or settings.LIMESURVEY['URL_API'] + '/index.php/admin/remotecontrol'
         self.get_session_key()
 
+    @property
+    def session_key(self):
+        return self.session.session_key if self.session else None
+
     def get_session_key(self):
-        self.server = Server(self.limesurvey_rpc)
-        try:
-            self.session_key = self.server.get_session_key(
-                settings.LIMESURVEY['USER'], settings.LIMESURVEY['PASSWORD'])
-            self.session_key = None if isinstance(self.session_key, dict) else self.session_key
-        except TransportError:
-            self.session_key = None
+        """Get the LimeSurvey session of the process, logging in only if
+        there is no valid session key yet
+        """
+        self.session = LimeSurveySession.get(self.limesurvey_rpc)
+        self.server = SessionServer(self.session)
+        self.session.get_session_key()
         # TODO: catch user/password exception
 
     def release_session_key(self):
-        if self.session_key:
-            self.server.release_session_key(self.session_key)
+        """The session is shared by all instances of the process and kept
+        open, so there is nothing to release. LimeSurveySession.release logs
+        it out.
+        """
 
     @abstractmethod
     def find_all_questionnaires(self):
@@ -291,6 +566,33 @@ class ABCSearchEngine(ABC):
         Optional defaults to 'code'
         :return: responses in txt format
         """
+        responses = self.export_responses(sid, language, response_type, heading_type)
+
+        return None if responses is None else b64decode(responses).decode()
+
+    def get_responses_rows(self, sid, language, response_type, heading_type, columns):
+        """Obtains responses from a determined survey as csv rows, decoded
+        and parsed as they are read, so that the whole decoded text and list
+        of rows are not held in memory. LimeSurvey is called at once (e.g.
+        in ConcurrentQuestionnaires.gather), only the decoding is deferred.
+        :param sid: survey ID
+        :param language: language
+        :param response_type: 'short' or 'long'
+        :param heading_type: 'code','full' or 'abbreviated'
+        :param columns: headings of the columns to keep, None for all
+        :return: generator of the rows as lists, the header first (see
+        decode_csv_rows), or None if some error occurs
+        """
+        responses = self.export_responses(sid, language, response_type, heading_type)
+
+        return None if responses is None \
+            else decode_csv_rows(responses, columns, self.BASE64_CHUNK_SIZE)
+
+    def export_responses(self, sid, language, response_type, heading_type):
+        """
+        :return: responses base 64 encoded in csv format, or None if some
+        error occurs
+        """
         if response_type == 'long':
             responses = self.server.export_responses(
                 self.session_key, sid, 'csv', language, 'complete',
@@ -305,8 +607,7 @@ class ABCSearchEngine(ABC):
                     self.session_key, sid, 'csv', language, 'complete',
                     heading_type, response_type)
 
-        return None if isinstance(responses, dict) \
-            else b64decode(responses).decode()
+        return None if isinstance(responses, dict) else responses
 
     def get_header_response(self, sid, language, token, heading_type):
         """Obtain header responses.
@@ -454,6 +755,43 @@ class ABCSearchEngine(ABC):
 
         return question_ids
 
+    def get_survey_structure(self, sid, language):
+        """Load groups and question properties of a survey in a bounded
+        number of calls: one for the groups, one for the questions of all
+        groups, and one per question. Sub-questions are not fetched
+        separately as they come in the 'subquestions' property of their
+        parent question.
+        :param sid: LimeSurvey survey id
+        :param language: language of the groups and question properties
+        :return: SurveyStructure instance, without the questions whose
+        properties could not be read (see failed_question_ids); None if the
+        groups or the questions could not be listed
+        """
+        groups = self.list_groups(sid)
+        if groups is None:
+            return None
+        groups = [group for group in groups if SurveyStructure.group_language(group) == language]
+
+        questions = self.list_questions(sid, None)
+        if questions is None:
+            return None
+
+        question_ids = []
+        question_properties = {}
+        failed_question_ids = []
+        for question in questions:
+            if int(question.get('parent_qid') or 0):
+                continue
+            question_id = question['id']['qid']
+            properties = self.get_question_properties(question_id, language)
+            if properties is None or 'status' in properties:
+                failed_question_ids.append(question_id)
+                continue
+            question_ids.append(question_id)
+            question_properties[question_id] = properties
+
+        return SurveyStructure(sid, language, groups, question_ids, question_properties, failed_question_ids)
+
     @abstractmethod
     def find_tokens_by_questionnaire(self, sid):
         """
@@ -466,6 +804,24 @@ class ABCSearchEngine(ABC):
         # If some error occurs RPC returns a dict, so return None
         return tokens if isinstance(tokens, list) else None
 
+    @abstractmethod
+    def get_tokens_completed(self, sid):
+        """Read the 'completed' property of all the participants of the
+        survey in one call
+        :param sid: survey ID
+        :return: dict with the 'completed' property ('N' or the completion
+        date) by token id, or None if some error occurs
+        """
+        participants = self.server.list_participants(self.session_key, sid, 0, 99999999, False, ['completed'])
+
+        # LimeSurvey answers with a status instead of an empty list
+        if isinstance(participants, dict) and participants.get('status') == 'No survey participants found.':
+            return {}
+        if not isinstance(participants, list):
+            return None
+
+        return {int(participant['tid']): participant.get('completed') or '' for participant in participants}
+
     def add_group(self, sid, title, description):
         result = self.server.add_group(self.session_key, sid, title)
 
@@ -505,6 +861,30 @@ class ABCSearchEngine(ABC):
 
         return result
 
+    def export_survey_to_file(self, sid, file_path):
+        """Export survey archive to a file, decoding it a chunk at a time
+        :param sid: LimeSurvey survey id
+        :param file_path: path of the lsa archive
+        :return: on success file_path, else None
+        """
+        result = self.export_survey(sid)
+        if result is None:
+            return None
+
+        with open(file_path, 'wb') as f:
+            for start in range(0, len(result), self.BASE64_CHUNK_SIZE):
+                f.write(b64decode(result[start:start + self.BASE64_CHUNK_SIZE]))
+
+        return file_path
+
+    def import_survey_from_file(self, file_path):
+        """
+        :param file_path: path of the lsa archive
+        :return: lime survey id of survey created
+        """
+        with open(file_path, 'rb') as f:
+            return self.import_survey(b64encode(f.read()).decode('utf-8'))
+
     def delete_responses(self, sid, responses):
         """Delete responses from LimeSurvey survey
         :param sid: LimeSurvey survey id
@@ -578,6 +958,9 @@ class Questionnaires(ABCSearchEngine):
     def get_responses(self, sid, language, response_type='short', fields=None, heading_type='code'):
         return super(Questionnaires, self).get_responses(sid, language, response_type, fields, heading_type)
 
+    def get_responses_rows(self, sid, language, response_type='short', heading_type='code', columns=None):
+        return super(Questionnaires, self).get_responses_rows(sid, language, response_type, heading_type, columns)
+
     def get_header_response(self, sid, language, token=1, heading_type='code'):
         return super(Questionnaires, self).get_header_response(sid, language, token, heading_type)
 
@@ -593,6 +976,9 @@ class Questionnaires(ABCSearchEngine):
     def get_question_properties(self, question_id, language):
         return super(Questionnaires, self).get_question_properties(question_id, language)
 
+    def get_survey_structure(self, sid, language):
+        return super(Questionnaires, self).get_survey_structure(sid, language)
+
     # TODO (NES-956): see when this was created
     def set_question_properties(self, sid, data):
         return super(Questionnaires, self).set_question_properties(sid, data)
@@ -612,6 +998,9 @@ class Questionnaires(ABCSearchEngine):
     def find_tokens_by_questionnaire(self, sid):
         return super(Questionnaires, self).find_tokens_by_questionnaire(sid)
 
+    def get_tokens_completed(self, sid):
+        return super(Questionnaires, self).get_tokens_completed(sid)
+
     def add_group(self, sid, title, description=None):
         return super(Questionnaires, self).add_group(sid, title, description)
 
@@ -632,3 +1021,74 @@ class Questionnaires(ABCSearchEngine):
 
     def update_response(self, sid, response_data):
         return super(Questionnaires, self).update_response(sid, response_data)
+
+
+class ConcurrentQuestionnaires(Questionnaires):
+    """Questionnaires that makes independent calls to LimeSurvey at the same
+    time, so that a page needing one call per survey or per response waits
+    for the slowest call instead of the sum of them.
+
+    The calls run in a pool of LIMESURVEY['MAX_CONCURRENT_CALLS'] threads
+    shared by the process. With only one thread they are made in sequence,
+    in the calling thread.
+    """
+
+    MAX_CONCURRENT_CALLS = 8
+    CALL_TIMEOUT = 60
+
+    _executors = {}
+    _executors_lock = threading.Lock()
+
+    @classmethod
+    def max_concurrent_calls(cls):
+        return settings.LIMESURVEY.get('MAX_CONCURRENT_CALLS', cls.MAX_CONCURRENT_CALLS)
+
+    @classmethod
+    def get_executor(cls):
+        """
+        :return: the thread pool of the process for the configured number of
+        concurrent calls
+        """
+        max_workers = cls.max_concurrent_calls()
+        with cls._executors_lock:
+            if max_workers not in cls._executors:
+                cls._executors[max_workers] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix='limesurvey')
+            return cls._executors[max_workers]
+
+    def _call(self, method_name, *args):
+        try:
+            return getattr(self, method_name)(*args)
+        except (TransportError, ProtocolError):
+            return None
+
+    def gather(self, calls, timeout=None):
+        """Make calls to methods of this class, at the same time if possible
+        :param calls: iterable of tuples with the method name followed by its
+        arguments, e.g. [('get_survey_title', sid, 'en'), ...]
+        :param timeout: seconds to wait for the calls, counted from the
+        moment gather is called; LIMESURVEY['CALL_TIMEOUT'] by default. Not
+        used when the calls are made in sequence.
+        :return: list with the result of each call, in the order of calls;
+        None for the calls that failed to reach LimeSurvey or timed out
+        """
+        calls = list(calls)
+        if self.max_concurrent_calls() <= 1 or len(calls) <= 1:
+            return [self._call(*call) for call in calls]
+
+        if timeout is None:
+            timeout = settings.LIMESURVEY.get('CALL_TIMEOUT', self.CALL_TIMEOUT)
+        deadline = time.time() + timeout
+
+        executor = self.get_executor()
+        futures = [executor.submit(self._call, *call) for call in calls]
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(max(deadline - time.time(), 0)))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                results.append(None)
+
+        return results
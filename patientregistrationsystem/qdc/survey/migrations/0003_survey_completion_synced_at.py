@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0002_auto_20190401_1335'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='completion_synced_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -10,6 +10,9 @@ class Survey(models.Model):
     pt_title = models.CharField(null=True, max_length=255, default=None)
     en_title = models.CharField(null=True, max_length=255, default=None)
     is_active = models.NullBooleanField(default=None)
+    # Last time the completion of the tokens of the survey was read from
+    # LimeSurvey (see survey.token_completion)
+    completion_synced_at = models.DateTimeField(null=True, blank=True, default=None)
 
     def __str__(self):
         if self.en_title:
@@ -0,0 +1,154 @@
+"""Cache of data fetched from LimeSurvey that only changes when a survey is
+edited there: titles, languages, survey structures and headers of responses.
+
+Entries are stored in the 'limesurvey' cache (falling back to 'default' if
+it is not configured), which may be local to each process, under keys made
+of the survey id, the language and the version of the survey. Versions are
+kept in the 'default' cache, shared by every process, so invalidating a
+survey makes the entries of every process stale at once. Each version
+records a fingerprint of the groups and questions of the survey as listed
+by LimeSurvey; every VERSION_TIMEOUT seconds the fingerprint is read again
+and the version is replaced if it changed, so surveys edited directly in
+LimeSurvey are seen after at most that time. Entries of former versions
+are evicted by the cache timeout or size limit.
+
+Responses of tokens are not cached: they change while the participants
+fill in the surveys.
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+LIMESURVEY_CACHE = 'limesurvey'
+VERSION_CACHE = 'default'
+VERSION_KEY = 'limesurvey-version-%s'
+VERSION_TIMEOUT = 60
+
+
+def _cache():
+    return caches[LIMESURVEY_CACHE if LIMESURVEY_CACHE in settings.CACHES else 'default']
+
+
+def _version_cache():
+    return caches[VERSION_CACHE]
+
+
+def _fingerprint(surveys, sid):
+    """
+    :param surveys: Questionnaires instance
+    :param sid: LimeSurvey survey id
+    :return: hash of the groups and questions of the survey, or None if
+    LimeSurvey failed
+    """
+    groups = surveys.list_groups(sid) if surveys.session_key else None
+    questions = surveys.list_questions(sid, None) if groups is not None else None
+    if groups is None or questions is None:
+        return None
+
+    return hashlib.sha1(json.dumps([groups, questions], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _version(surveys, sid):
+    """Return the version of the survey. Once the version is VERSION_TIMEOUT
+    seconds old, the fingerprint of the survey is read again and a new
+    version is made only if it changed. While LimeSurvey can't be reached
+    the version is kept.
+    :param surveys: Questionnaires instance
+    :param sid: LimeSurvey survey id
+    """
+    # (version, fingerprint, time of the fingerprint)
+    entry = _version_cache().get(VERSION_KEY % sid)
+    if entry is not None and time.time() - entry[2] < VERSION_TIMEOUT:
+        return entry[0]
+
+    fingerprint = _fingerprint(surveys, sid)
+    if entry is None:
+        entry = (uuid.uuid4().hex, fingerprint, time.time())
+    elif fingerprint is None:
+        entry = (entry[0], entry[1], time.time())
+    elif entry[1] is not None and fingerprint != entry[1]:
+        entry = (uuid.uuid4().hex, fingerprint, time.time())
+    else:
+        # Fingerprint unchanged, or adopted if it could not be read when
+        # the version was made
+        entry = (entry[0], fingerprint, time.time())
+    _version_cache().set(VERSION_KEY % sid, entry, None)
+
+    return entry[0]
+
+
+def make_key(surveys, sid, *parts):
+    """
+    :param surveys: Questionnaires instance
+    :param sid: LimeSurvey survey id
+    :param parts: what is cached, e.g. ('title', 'en')
+    :return: cache key including the version of the survey
+    """
+    return ('limesurvey-%s-%s-%s' % (
+        sid, '-'.join(str(part) for part in parts), _version(surveys, sid))).replace(' ', '_')
+
+
+def get_or_load(key, loader):
+    """Return the value cached in key, calling loader and caching its result
+    on a cache miss. None results, meaning LimeSurvey failed, are not cached.
+    """
+    value = _cache().get(key)
+    if value is None:
+        value = loader()
+        if value is not None:
+            _cache().set(key, value)
+
+    return value
+
+
+def invalidate_survey(sid):
+    """Make every entry of the survey stale, in every process
+    :param sid: LimeSurvey survey id
+    """
+    _version_cache().delete(VERSION_KEY % sid)
+
+
+def clear():
+    """Drop every entry of this process, e.g. between tests that mock
+    LimeSurvey differently
+    """
+    _cache().clear()
+
+
+def get_survey_title(surveys, sid, language):
+    """
+    :param surveys: Questionnaires instance
+    :return: title of the survey
+    """
+    return get_or_load(
+        make_key(surveys, sid, 'title', language),
+        lambda: surveys.get_survey_title(sid, language) if surveys.session_key else None
+    ) or str(sid)
+
+
+def get_survey_languages(surveys, sid):
+    """
+    :param surveys: Questionnaires instance
+    :return: the base and the additional idioms, or None
+    """
+    return get_or_load(make_key(surveys, sid, 'languages'), lambda: surveys.get_survey_languages(sid))
+
+
+def get_survey_structure(surveys, sid, language):
+    """
+    :param surveys: Questionnaires instance
+    :return: SurveyStructure instance, or None. Structures missing questions
+    that LimeSurvey failed to give are not cached, so they are read again.
+    """
+    key = make_key(surveys, sid, 'structure', language)
+    survey_structure = _cache().get(key)
+    if survey_structure is None:
+        survey_structure = surveys.get_survey_structure(sid, language)
+        if survey_structure is not None and not survey_structure.failed_question_ids:
+            _cache().set(key, survey_structure)
+
+    return survey_structure
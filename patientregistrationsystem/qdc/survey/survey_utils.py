@@ -64,6 +64,7 @@ class QuestionnaireUtils:
         self.questionnaires_data = {}
         self.questionnaires_experiment_data = {}
         self.questionnaire_code_and_id = {}
+        self.survey_structures = {}
 
     def set_questionnaire_header_and_fields(self, questionnaire, entrance_questionnaire):
 
@@ -217,6 +218,25 @@ class QuestionnaireUtils:
         self.questionnaires_experiment_data[questionnaire_id]["header_questionnaire"] = new_header_questionnaire
         self.questionnaires_experiment_data[questionnaire_id]["fields"] = new_fields
 
+    def get_survey_structure(self, questionnaire_lime_survey, questionnaire_id, language):
+        """Return the survey structure of the questionnaire in language,
+        loading it from LimeSurvey only the first time it is requested
+        :param questionnaire_lime_survey: Questionnaires instance
+        :param questionnaire_id: LimeSurvey survey id
+        :param language: survey language
+        :return: SurveyStructure instance, or None if LimeSurvey failed.
+        Structures missing questions that LimeSurvey failed to give are not
+        kept, so they are loaded again.
+        """
+        key = (str(questionnaire_id), language)
+        if key not in self.survey_structures:
+            survey_structure = questionnaire_lime_survey.get_survey_structure(questionnaire_id, language)
+            if survey_structure is None or survey_structure.failed_question_ids:
+                return survey_structure
+            self.survey_structures[key] = survey_structure
+
+        return self.survey_structures[key]
+
     def include_questionnaire_code_and_id(self, code, questionnaire_id):
 
         if code not in self.questionnaire_code_and_id:
@@ -264,14 +284,12 @@ class QuestionnaireUtils:
         questionnaire_title = questionnaire_lime_survey.get_survey_title(questionnaire_id, language)
         questionnaire_code = self.get_questionnaire_code_from_id(questionnaire_id)
         # Get fields description
-        questionnaire_questions = questionnaire_lime_survey.list_questions_ids(questionnaire_id, 0)
-        if not questionnaire_questions:
+        survey_structure = self.get_survey_structure(questionnaire_lime_survey, questionnaire_id, language)
+        # Questions left out would be missing from the explanation
+        if survey_structure is None or not survey_structure.question_ids or survey_structure.failed_question_ids:
             return Questionnaires.ERROR_CODE, []
 
-        for question in questionnaire_questions:
-            properties = questionnaire_lime_survey.get_question_properties(question, language)
-            if properties is None:
-                return Questionnaires.ERROR_CODE, []
+        for properties in survey_structure.questions():
             question_code = properties['title'] if 'title' in properties else None
             if question_code and question_code in fields_cleared:
                 fields_from_questions.append(question_code)
@@ -280,8 +298,7 @@ class QuestionnaireUtils:
                     '{.*?}', '', re.sub('<.*?>', '', properties['question'])).replace('&nbsp;', '').strip()
                 question_type = smart_str(properties['type'])
                 question_type_description = QUESTION_TYPES[question_type][0] if question_type in QUESTION_TYPES else ''
-                question_group = self.get_group_properties(
-                        questionnaire_lime_survey, questionnaire_id, properties['gid'], language)
+                question_group = survey_structure.get_group(properties['gid'])
                 if question_group is None:
                     return Questionnaires.ERROR_CODE, []
                 question_order = properties['question_order']
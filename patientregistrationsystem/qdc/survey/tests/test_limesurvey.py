@@ -1,8 +1,18 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from base64 import b64decode, b64encode
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
 
-from survey.abc_search_engine import Questionnaires, ABCSearchEngine
+from survey import survey_cache
+from survey.abc_search_engine import Questionnaires, ABCSearchEngine, LimeSurveySession, ConcurrentQuestionnaires, \
+    decode_csv_rows
 from survey.survey_utils import QuestionnaireUtils
 
 
@@ -27,6 +37,55 @@ class LimeSurveyAPITest(TestCase):
         )
 
 
+class ResponsesRowsTest(TestCase):
+
+    RESPONSES = '"id","token","question","acquisitiondate"\n' \
+                '"1","tökén1","Olá\nMundo!","2021-03-09 00:00:00"\n' \
+                '"2","token2","Hallo Welt!","N/A"\n\n'
+
+    @staticmethod
+    def encode(text):
+        return b64encode(text.encode()).decode()
+
+    def test_rows_are_the_same_as_parsed_from_the_decoded_text(self):
+        for chunk_size in (4, 8, 16, 1024):
+            self.assertEqual(
+                list(decode_csv_rows(self.encode(self.RESPONSES), chunk_size=chunk_size)),
+                QuestionnaireUtils.responses_to_csv(self.RESPONSES))
+
+    def test_rows_are_projected_to_the_columns_requested(self):
+        rows = decode_csv_rows(self.encode(self.RESPONSES), ['acquisitiondate', 'missing', 'token'], 8)
+
+        self.assertEqual(list(rows), [
+            ['acquisitiondate', 'token'], ['2021-03-09 00:00:00', 'tökén1'], ['N/A', 'token2'], []
+        ])
+
+    @patch('survey.abc_search_engine.Server')
+    def test_get_responses_rows(self, mockServer):
+        mockServer.return_value.export_responses.return_value = self.encode(self.RESPONSES)
+        rows = Questionnaires().get_responses_rows(1, 'en', columns=['token'])
+
+        self.assertEqual(list(rows), [['token'], ['tökén1'], ['token2'], []])
+
+        mockServer.return_value.export_responses.return_value = {'status': 'No Data, survey table does not exist.'}
+        self.assertIsNone(Questionnaires().get_responses_rows(1, 'en'))
+
+    def test_memory_is_bounded_by_row_width(self):
+        responses = '"id","token","question"\n' + ''.join(
+            '"%d","token%d","%s"\n' % (number, number, 'answer' * 10) for number in range(50000))
+        encoded = self.encode(responses)
+
+        tracemalloc.start()
+        try:
+            for row in decode_csv_rows(encoded, ['token'], 4 * 1024):
+                pass
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak, len(responses) / 20)
+
+
 class SurveyUtilsTest(TestCase):
 
     @patch('survey.abc_search_engine.Server')
@@ -82,3 +141,427 @@ class SurveyUtilsTest(TestCase):
         self.assertTrue('question_order' in questionnaire_fields[0])
         index_ = questionnaire_fields[0].index('question_order')
         self.assertEqual(questionnaire_fields[1][index_], str(question_order))
+
+
+class LimeSurveyStandIn:
+    """Local stand-in for the LimeSurvey RPC server that serves a survey with
+    a given number of groups and questions per group, each question with
+    sub-questions, and counts the round trips made to it.
+    """
+
+    def __init__(self, url, groups=5, questions_per_group=30, subquestions=4, language='en'):
+        self.calls = []
+        self.language = language
+        self.groups = [
+            {'id': {'gid': gid, 'language': language}, 'gid': gid, 'language': language,
+             'group_name': 'Group %d' % gid, 'group_order': gid}
+            for gid in range(1, groups + 1)
+        ]
+        self.questions = []
+        qid = 1
+        for group in self.groups:
+            for order in range(questions_per_group):
+                parent_qid = qid
+                self.questions.append(
+                    {'id': {'qid': parent_qid, 'language': language}, 'qid': parent_qid, 'parent_qid': 0,
+                     'gid': group['gid'], 'title': 'Q%d' % parent_qid, 'type': 'F', 'question_order': order})
+                qid += 1
+                for sq_order in range(subquestions):
+                    self.questions.append(
+                        {'id': {'qid': qid, 'language': language}, 'qid': qid, 'parent_qid': parent_qid,
+                         'gid': group['gid'], 'title': 'SQ%d' % sq_order, 'type': 'T', 'question_order': sq_order})
+                    qid += 1
+
+    def __getattr__(self, name):
+        # Any other RPC method is answered with an error status
+        self.calls.append(name)
+        return lambda *args: {'status': 'No data'}
+
+    def get_session_key(self, user, password):
+        self.calls.append('get_session_key')
+        return 'session-key'
+
+    def list_groups(self, session_key, sid):
+        self.calls.append('list_groups')
+        return self.groups
+
+    def list_questions(self, session_key, sid, gid=None):
+        self.calls.append('list_questions')
+        return [question for question in self.questions if gid is None or question['gid'] == gid]
+
+    def get_question_properties(self, session_key, qid, properties, language):
+        self.calls.append('get_question_properties')
+        question = next(item for item in self.questions if item['qid'] == qid)
+        subquestions = {
+            item['qid']: {'title': item['title'], 'question': item['title']}
+            for item in self.questions if item['parent_qid'] == qid
+        }
+        return {
+            'gid': question['gid'], 'question': question['title'], 'question_order': question['question_order'],
+            'subquestions': subquestions or 'No available answers',
+            'answeroptions': 'No available answer options', 'title': question['title'],
+            'type': question['type'], 'attributes_lang': 'No available attributes', 'attributes': {},
+            'other': 'N'
+        }
+
+
+class SurveyStructureTest(TestCase):
+
+    def setUp(self):
+        self.stand_in = LimeSurveyStandIn('url', groups=5, questions_per_group=30, subquestions=4)
+        patcher = patch('survey.abc_search_engine.Server', return_value=self.stand_in)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lime_survey = Questionnaires()
+        self.stand_in.calls = []
+
+    def test_get_survey_structure_round_trips_are_bounded_by_number_of_questions(self):
+        survey_structure = self.lime_survey.get_survey_structure(123456, 'en')
+
+        # One call for groups, one for all questions and one per question,
+        # none per sub-question
+        self.assertEqual(len(self.stand_in.calls), 2 + 150)
+        self.assertEqual(self.stand_in.calls.count('list_groups'), 1)
+        self.assertEqual(self.stand_in.calls.count('list_questions'), 1)
+        self.assertEqual(len(survey_structure.question_ids), 150)
+
+    def test_get_survey_structure_costs_fewer_round_trips_than_per_group_fetch(self):
+        self.lime_survey.get_survey_structure(123456, 'en')
+        structure_calls = len(self.stand_in.calls)
+
+        self.stand_in.calls = []
+        for group in self.lime_survey.list_groups(123456):
+            for question_id in self.lime_survey.list_questions_ids(123456, group['gid']):
+                self.lime_survey.get_question_properties(question_id, 'en')
+        per_group_calls = len(self.stand_in.calls)
+
+        # 152 against 756 round trips for 150 questions with 600 sub-questions
+        self.assertEqual(structure_calls, 152)
+        self.assertEqual(per_group_calls, 1 + 5 + 750)
+
+    def test_survey_structure_groups_questions_by_group_in_language(self):
+        survey_structure = self.lime_survey.get_survey_structure(123456, 'en')
+
+        self.assertEqual(len(survey_structure.groups), 5)
+        self.assertEqual(survey_structure.group_question_ids(1), [1 + 5 * i for i in range(30)])
+        properties = survey_structure.get_question_properties(1)
+        self.assertEqual(len(properties['subquestions']), 4)
+        self.assertEqual(survey_structure.get_group(2)['group_name'], 'Group 2')
+
+    def test_question_whose_properties_failed_is_left_out_of_the_survey_structure(self):
+        get_question_properties = self.stand_in.get_question_properties
+        self.stand_in.get_question_properties = lambda session_key, qid, properties, language: \
+            {'status': 'Error'} if qid == 6 else get_question_properties(session_key, qid, properties, language)
+
+        survey_structure = self.lime_survey.get_survey_structure(123456, 'en')
+
+        self.assertEqual(len(survey_structure.groups), 5)
+        self.assertEqual(len(survey_structure.question_ids), 149)
+        self.assertNotIn(6, survey_structure.question_ids)
+        self.assertEqual(survey_structure.failed_question_ids, [6])
+        self.assertIsNone(survey_structure.get_question_properties(6))
+        self.assertEqual(survey_structure.group_question_ids(1), [1 + 5 * i for i in range(30) if i != 1])
+
+    def test_explanation_fields_are_not_made_without_the_questions_whose_properties_failed(self):
+        get_question_properties = self.stand_in.get_question_properties
+        self.stand_in.get_question_properties = lambda session_key, qid, properties, language: \
+            {'status': 'Error'} if qid == 6 else get_question_properties(session_key, qid, properties, language)
+        survey_utils = QuestionnaireUtils()
+        survey_utils.questionnaires_experiment_data['123456'] = {'fields': ['Q1', 'Q6'], 'header': ['Q1', 'Q6']}
+
+        error, questionnaire_fields = survey_utils.create_questionnaire_explanation_fields(
+            '123456', 'en', self.lime_survey, ['Q1', 'Q6'], False)
+
+        self.assertEqual(error, Questionnaires.ERROR_CODE)
+        self.assertEqual(questionnaire_fields, [])
+
+        # The structure missing a question is loaded again
+        self.stand_in.calls = []
+        survey_utils.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertIn('list_groups', self.stand_in.calls)
+
+    def test_questionnaire_utils_loads_survey_structure_once(self):
+        survey_utils = QuestionnaireUtils()
+        survey_utils.get_survey_structure(self.lime_survey, 123456, 'en')
+        calls = len(self.stand_in.calls)
+        survey_utils.get_survey_structure(self.lime_survey, 123456, 'en')
+
+        self.assertEqual(len(self.stand_in.calls), calls)
+
+
+class SurveyCacheTest(TestCase):
+
+    def setUp(self):
+        self.stand_in = LimeSurveyStandIn('url', groups=2, questions_per_group=3, subquestions=2)
+        patcher = patch('survey.abc_search_engine.Server', return_value=self.stand_in)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lime_survey = Questionnaires()
+        self.stand_in.calls = []
+        survey_cache.invalidate_survey(123456)
+
+    def test_survey_structure_is_read_from_cache_without_calling_limesurvey(self):
+        survey_structure = survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertTrue(self.stand_in.calls)
+
+        self.stand_in.calls = []
+        cached_structure = survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertEqual(self.stand_in.calls, [])
+        self.assertEqual(cached_structure.question_ids, survey_structure.question_ids)
+
+    def test_invalidate_survey_makes_limesurvey_be_called_again(self):
+        survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        survey_cache.invalidate_survey(123456)
+
+        self.stand_in.calls = []
+        survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertIn('list_groups', self.stand_in.calls)
+
+    def test_invalidate_survey_does_not_affect_other_surveys(self):
+        key = survey_cache.make_key(self.lime_survey, 123456, 'title', 'en')
+        survey_cache.invalidate_survey(654321)
+
+        self.assertEqual(survey_cache.make_key(self.lime_survey, 123456, 'title', 'en'), key)
+
+    def test_version_is_read_from_the_shared_cache_without_calling_limesurvey(self):
+        key = survey_cache.make_key(self.lime_survey, 123456, 'title', 'en')
+
+        self.stand_in.calls = []
+        with self.assertNumQueries(1):
+            self.assertEqual(survey_cache.make_key(self.lime_survey, 123456, 'title', 'en'), key)
+        self.assertEqual(self.stand_in.calls, [])
+
+    def test_invalidate_survey_makes_entries_of_other_processes_stale(self):
+        survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        # Another process shares the versions but not the entries
+        survey_cache.clear()
+        survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        survey_cache.invalidate_survey(123456)
+
+        self.stand_in.calls = []
+        survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertIn('list_groups', self.stand_in.calls)
+
+    def test_first_check_of_the_version_keeps_the_cached_entries(self):
+        key = survey_cache.make_key(self.lime_survey, 123456, 'title', 'en')
+
+        with patch('survey.survey_cache.VERSION_TIMEOUT', 0):
+            self.assertEqual(survey_cache.make_key(self.lime_survey, 123456, 'title', 'en'), key)
+
+    def test_version_is_kept_while_limesurvey_cannot_be_reached(self):
+        key = survey_cache.make_key(self.lime_survey, 123456, 'title', 'en')
+
+        with patch('survey.survey_cache._fingerprint', return_value=None), \
+                patch('survey.survey_cache.VERSION_TIMEOUT', 0):
+            self.assertEqual(survey_cache.make_key(self.lime_survey, 123456, 'title', 'en'), key)
+
+    def test_fingerprint_missing_when_the_version_was_made_is_adopted(self):
+        with patch('survey.survey_cache._fingerprint', return_value=None):
+            key = survey_cache.make_key(self.lime_survey, 123456, 'title', 'en')
+
+        with patch('survey.survey_cache.VERSION_TIMEOUT', 0):
+            self.assertEqual(survey_cache.make_key(self.lime_survey, 123456, 'title', 'en'), key)
+
+    def test_survey_edited_in_limesurvey_is_read_again_after_version_timeout(self):
+        survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+
+        # Survey not edited: the version is checked, the structure is kept
+        with patch('survey.survey_cache.VERSION_TIMEOUT', 0):
+            survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+            self.stand_in.calls = []
+            survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertEqual(self.stand_in.calls, ['list_groups', 'list_questions'])
+
+        self.stand_in.questions[0]['title'] = 'Q1edited'
+        survey_structure = survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertEqual(survey_structure.get_question_properties(1)['title'], 'Q1')
+
+        with patch('survey.survey_cache.VERSION_TIMEOUT', 0):
+            survey_structure = survey_cache.get_survey_structure(self.lime_survey, 123456, 'en')
+        self.assertEqual(survey_structure.get_question_properties(1)['title'], 'Q1edited')
+
+    def test_failed_limesurvey_calls_are_not_cached(self):
+        key = survey_cache.make_key(self.lime_survey, 123456, 'languages')
+        survey_cache.get_or_load(key, lambda: None)
+
+        self.assertEqual(survey_cache.get_or_load(key, lambda: {'language': 'en'}), {'language': 'en'})
+
+
+class LimeSurveySessionTest(TestCase):
+
+    def setUp(self):
+        LimeSurveySession.reset()
+
+    def test_session_is_shared_by_url_and_user(self):
+        session = LimeSurveySession.get('http://limesurvey.test')
+
+        self.assertIs(LimeSurveySession.get('http://limesurvey.test'), session)
+        self.assertIsNot(LimeSurveySession.get('http://other.limesurvey.test'), session)
+        with override_settings(LIMESURVEY=dict(settings.LIMESURVEY, USER='other_user')):
+            self.assertIsNot(LimeSurveySession.get('http://limesurvey.test'), session)
+
+    @patch('survey.abc_search_engine.Server')
+    def test_questionnaires_instances_share_session_key(self, mockServer):
+        mockServer.return_value.get_session_key.return_value = 'session-key'
+
+        logins_avoided = LimeSurveySession.get_metrics()['logins_avoided']
+        for _ in range(5):
+            lime_survey = Questionnaires()
+            lime_survey.release_session_key()
+
+        self.assertEqual(lime_survey.session_key, 'session-key')
+        self.assertEqual(mockServer.return_value.get_session_key.call_count, 1)
+        self.assertFalse(mockServer.return_value.release_session_key.called)
+        self.assertEqual(LimeSurveySession.get_metrics()['logins_avoided'], logins_avoided + 4)
+
+    @patch('survey.abc_search_engine.Server')
+    def test_invalid_session_key_logs_in_again_and_repeats_call(self, mockServer):
+        mockServer.return_value.get_session_key.side_effect = ['session-key-1', 'session-key-2']
+        mockServer.return_value.list_groups.side_effect = [
+            {'status': 'Invalid session key'}, [{'gid': 1, 'language': 'en'}]
+        ]
+
+        lime_survey = Questionnaires()
+        groups = lime_survey.list_groups(123456)
+
+        self.assertEqual(groups, [{'gid': 1, 'language': 'en'}])
+        self.assertEqual(lime_survey.session_key, 'session-key-2')
+        (session_key, sid), kwargs = mockServer.return_value.list_groups.call_args
+        self.assertEqual(session_key, 'session-key-2')
+
+    @patch('survey.abc_search_engine.Server')
+    def test_session_key_not_used_for_session_expiration_logs_in_again(self, mockServer):
+        mockServer.return_value.get_session_key.side_effect = ['session-key-1', 'session-key-2']
+
+        with override_settings(LIMESURVEY=dict(settings.LIMESURVEY, SESSION_EXPIRATION=0)):
+            Questionnaires()
+            lime_survey = Questionnaires()
+
+        self.assertEqual(lime_survey.session_key, 'session-key-2')
+
+    @patch('survey.abc_search_engine.Server')
+    def test_limesurvey_unavailable_is_not_kept_as_session(self, mockServer):
+        mockServer.return_value.get_session_key.side_effect = [{'status': 'Invalid user name or password'}, 'key']
+
+        self.assertIsNone(Questionnaires().session_key)
+        self.assertEqual(Questionnaires().session_key, 'key')
+
+    @patch('survey.abc_search_engine.Server')
+    def test_concurrent_questionnaires_log_in_once(self, mockServer):
+        mockServer.return_value.get_session_key.return_value = 'session-key'
+
+        session_keys = []
+        threads = [
+            threading.Thread(target=lambda: session_keys.append(Questionnaires().session_key)) for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(session_keys, 10 * ['session-key'])
+        self.assertEqual(mockServer.return_value.get_session_key.call_count, 1)
+
+
+class SlowLimeSurveyStandIn:
+    """Local stand-in for the LimeSurvey RPC server that takes a given time
+    to answer the titles of the surveys, recording the threads that called it
+    and the most calls it was answering at the same time.
+    """
+
+    latency = {}
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    threads = set()
+
+    def __init__(self, url):
+        pass
+
+    def get_session_key(self, user, password):
+        return 'session-key'
+
+    def get_language_properties(self, session_key, sid, properties, language):
+        cls = SlowLimeSurveyStandIn
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            cls.threads.add(threading.current_thread())
+        time.sleep(cls.latency.get(sid, 0.1))
+        with cls.lock:
+            cls.active -= 1
+        return {'surveyls_title': 'Survey %s' % sid}
+
+    def export_survey(self, session_key, sid):
+        time.sleep(SlowLimeSurveyStandIn.latency.get(sid, 0.1))
+        return b64encode(SlowLimeSurveyStandIn.archive(sid)).decode('utf-8')
+
+    def import_survey(self, session_key, base64_encoded_lsa, import_format):
+        time.sleep(0.1)
+        return int(b64decode(base64_encoded_lsa).split(b' ')[1])
+
+    @staticmethod
+    def archive(sid):
+        return b'archive %d ' % sid + bytes(range(256)) * 100
+
+
+@patch('survey.abc_search_engine.Server', SlowLimeSurveyStandIn)
+class ConcurrentQuestionnairesTest(TestCase):
+
+    def setUp(self):
+        SlowLimeSurveyStandIn.latency = {}
+        SlowLimeSurveyStandIn.max_active = 0
+        SlowLimeSurveyStandIn.threads = set()
+
+    def gather_titles(self, sids, max_concurrent_calls, timeout=None):
+        with override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=max_concurrent_calls)):
+            return ConcurrentQuestionnaires().gather(
+                [('get_survey_title', sid, 'en') for sid in sids], timeout)
+
+    def test_gather_takes_about_the_slowest_call(self):
+        start = time.time()
+        titles = self.gather_titles(range(10), 10)
+
+        self.assertLess(time.time() - start, 10 * 0.1 / 2)
+        self.assertEqual(titles, ['Survey %d' % sid for sid in range(10)])
+
+    def test_gather_does_not_exceed_max_concurrent_calls(self):
+        titles = self.gather_titles(range(9), 3)
+
+        self.assertEqual(len(titles), 9)
+        self.assertLessEqual(SlowLimeSurveyStandIn.max_active, 3)
+
+    def test_call_timed_out_returns_none(self):
+        SlowLimeSurveyStandIn.latency = {1: 1}
+
+        titles = self.gather_titles(range(3), 3, timeout=0.5)
+
+        self.assertEqual(titles, ['Survey 0', None, 'Survey 2'])
+
+    def test_one_concurrent_call_makes_calls_in_sequence_in_calling_thread(self):
+        titles = self.gather_titles(range(3), 1)
+
+        self.assertEqual(titles, ['Survey 0', 'Survey 1', 'Survey 2'])
+        self.assertEqual(SlowLimeSurveyStandIn.threads, {threading.current_thread()})
+        self.assertEqual(SlowLimeSurveyStandIn.max_active, 1)
+
+    @patch.object(ABCSearchEngine, 'BASE64_CHUNK_SIZE', 4 * 100)
+    def test_survey_archives_are_exported_and_imported_at_the_same_time(self):
+        temp_dir = tempfile.mkdtemp()
+        archive_paths = [os.path.join(temp_dir, '%d.lsa' % sid) for sid in range(5)]
+
+        with override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=5)):
+            start = time.time()
+            results = ConcurrentQuestionnaires().gather(
+                ('export_survey_to_file', sid, archive_path) for sid, archive_path in enumerate(archive_paths))
+            new_sids = ConcurrentQuestionnaires().gather(
+                ('import_survey_from_file', archive_path) for archive_path in archive_paths)
+
+        self.assertLess(time.time() - start, 2 * 5 * 0.1 / 2)
+        self.assertEqual(results, archive_paths)
+        for sid, archive_path in enumerate(archive_paths):
+            with open(archive_path, 'rb') as f:
+                self.assertEqual(f.read(), SlowLimeSurveyStandIn.archive(sid))
+        self.assertEqual(new_sids, list(range(5)))
+
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,110 @@
+from unittest.mock import patch
+
+from django.test import override_settings
+
+from experiment.models import Component, QuestionnaireResponse as ExperimentQuestionnaireResponse
+from experiment.tests.tests_helper import ObjectsFactory, ExperimentTestCase
+from patient.models import QuestionnaireResponse as PatientQuestionnaireResponse
+from patient.tests.tests_orig import UtilTests
+from survey.abc_search_engine import Questionnaires
+from survey.models import Survey
+from survey.tests.tests_helper import create_survey
+from survey.token_completion import TokenCompletionMirror
+
+LIMESURVEY = {'URL_API': '', 'URL_WEB': '', 'USER': '', 'PASSWORD': '', 'COMPLETION_SYNC_INTERVAL': 60}
+
+
+@override_settings(LIMESURVEY=LIMESURVEY)
+@patch('survey.abc_search_engine.Server')
+class TokenCompletionMirrorTest(ExperimentTestCase):
+
+    def setUp(self):
+        super(TokenCompletionMirrorTest, self).setUp()
+
+        self.survey = create_survey()
+        questionnaire = ObjectsFactory.create_component(
+            self.experiment, Component.QUESTIONNAIRE, kwargs={'survey': self.survey})
+        data_configuration_tree = ObjectsFactory.create_data_configuration_tree(
+            ObjectsFactory.create_component_configuration(self.root_component, questionnaire))
+
+        self.experiment_responses = []
+        for token_id in (1, 2, 3):
+            response = ObjectsFactory.create_questionnaire_response(
+                data_configuration_tree, self.user, token_id, self.subject_of_group)
+            response.is_completed = 'N'
+            response.save()
+            self.experiment_responses.append(response)
+        self.patient_response = UtilTests.create_response_survey(
+            self.user, self.patient, self.survey, token_id=4, is_completed='N')
+
+    @staticmethod
+    def set_participants(mock_server, completed_by_token):
+        mock_server.return_value.list_participants.return_value = [
+            {'tid': str(token_id), 'token': 'token%s' % token_id, 'participant_info': {}, 'completed': completed}
+            for token_id, completed in completed_by_token.items()
+        ]
+
+    def test_completion_of_all_tokens_is_read_in_one_call(self, mock_server):
+        self.set_participants(mock_server, {1: '2019-06-26 10:00', 2: 'N', 3: 'N', 4: '2019-06-27 11:00'})
+        mirror = TokenCompletionMirror(Questionnaires())
+
+        completed = [
+            mirror.completed(self.survey.lime_survey_id, response) for response in self.experiment_responses
+        ]
+
+        self.assertEqual(completed, ['2019-06-26 10:00', 'N', 'N'])
+        self.assertEqual(mock_server.return_value.list_participants.call_count, 1)
+        mock_server.return_value.get_participant_properties.assert_not_called()
+        self.assertEqual(ExperimentQuestionnaireResponse.objects.get(
+            pk=self.experiment_responses[0].pk).is_completed, '2019-06-26 10:00')
+        self.assertEqual(PatientQuestionnaireResponse.objects.get(
+            pk=self.patient_response.pk).is_completed, '2019-06-27 11:00')
+        self.assertIsNotNone(Survey.objects.get(pk=self.survey.pk).completion_synced_at)
+
+    def test_token_not_in_the_survey_is_not_completed(self, mock_server):
+        self.set_participants(mock_server, {1: '2019-06-26 10:00', 3: 'N', 4: 'N'})
+        mirror = TokenCompletionMirror(Questionnaires())
+        response = ExperimentQuestionnaireResponse.objects.get(pk=self.experiment_responses[1].pk)
+
+        self.assertIsNone(mirror.completed(self.survey.lime_survey_id, response))
+        self.assertEqual(ExperimentQuestionnaireResponse.objects.get(pk=response.pk).is_completed, 'N')
+
+    def test_survey_read_recently_is_not_read_again(self, mock_server):
+        self.set_participants(mock_server, {1: '2019-06-26 10:00', 2: 'N', 3: 'N', 4: 'N'})
+        TokenCompletionMirror(Questionnaires()).refresh([self.survey.lime_survey_id])
+        self.set_participants(mock_server, {1: '2019-06-26 10:00', 2: '2019-06-28 09:00', 3: 'N', 4: 'N'})
+
+        mirror = TokenCompletionMirror(Questionnaires())
+        response = ExperimentQuestionnaireResponse.objects.get(pk=self.experiment_responses[1].pk)
+
+        self.assertEqual(mirror.completed(self.survey.lime_survey_id, response), 'N')
+        self.assertEqual(mock_server.return_value.list_participants.call_count, 1)
+
+        # With no interval the survey is always read
+        mirror = TokenCompletionMirror(Questionnaires(), sync_interval=0)
+        self.assertEqual(mirror.completed(self.survey.lime_survey_id, response), '2019-06-28 09:00')
+        self.assertEqual(mock_server.return_value.list_participants.call_count, 2)
+
+    def test_tokens_are_read_one_by_one_if_they_can_not_be_listed(self, mock_server):
+        mock_server.return_value.list_participants.return_value = {'status': 'Error: No token table'}
+        mock_server.return_value.get_participant_properties.return_value = {'completed': '2019-06-26 10:00'}
+        mirror = TokenCompletionMirror(Questionnaires())
+
+        self.assertEqual(
+            mirror.completed(self.survey.lime_survey_id, self.experiment_responses[0]), '2019-06-26 10:00')
+        self.assertEqual(ExperimentQuestionnaireResponse.objects.get(
+            pk=self.experiment_responses[0].pk).is_completed, '2019-06-26 10:00')
+        self.assertIsNone(Survey.objects.get(pk=self.survey.pk).completion_synced_at)
+
+    def test_completion_of_token_is_read_with_the_other_tokens_of_the_survey(self, mock_server):
+        self.set_participants(mock_server, {1: '2019-06-26 10:00', 2: 'N', 3: 'N', 4: 'N'})
+        TokenCompletionMirror(Questionnaires()).refresh([self.survey.lime_survey_id])
+        self.set_participants(mock_server, {1: '2019-06-26 10:00', 2: '2019-06-28 09:00', 3: 'N', 4: 'N'})
+        mirror = TokenCompletionMirror(Questionnaires())
+
+        # Read recently, but the token has no response at hand to hold it
+        self.assertEqual(
+            [mirror.token_completed(self.survey.lime_survey_id, token_id) for token_id in (1, 2, 5)],
+            ['2019-06-26 10:00', '2019-06-28 09:00', None])
+        self.assertEqual(mock_server.return_value.list_participants.call_count, 2)
+        mock_server.return_value.get_participant_properties.assert_not_called()
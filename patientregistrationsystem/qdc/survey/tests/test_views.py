@@ -1,6 +1,7 @@
 from base64 import b64decode
 from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth.models import Group
 from django.core.urlresolvers import reverse
 from django.test import TestCase, override_settings
@@ -205,6 +206,8 @@ LIME_SURVEY_TOKEN_ID_1 = 1
 #         surveys.release_session_key()
 
 
+# LimeSurvey answers are mocked in the order of the calls
+@override_settings(LIMESURVEY=dict(settings.LIMESURVEY, MAX_CONCURRENT_CALLS=1))
 class SurveyTest(TestCase):
 
     def setUp(self):
@@ -0,0 +1,160 @@
+"""Mirror of the completion of LimeSurvey tokens in the is_completed field of
+the questionnaire responses of experiments and patients.
+
+Instead of asking LimeSurvey the 'completed' property of each token, the
+tokens of a survey are read in one list_participants call and the responses
+whose completion changed are updated in bulk. A survey is read again only
+after LIMESURVEY['COMPLETION_SYNC_INTERVAL'] seconds (Survey.completion_synced_at);
+meanwhile the responses already hold the mirrored completion. If LimeSurvey
+can not list the tokens of a survey, the tokens are asked one by one, as
+before the mirror.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, CharField, Value, When
+from django.utils import timezone
+
+from experiment.models import QuestionnaireResponse as ExperimentQuestionnaireResponse
+from patient.models import QuestionnaireResponse as PatientQuestionnaireResponse
+from survey.models import Survey
+
+COMPLETION_SYNC_INTERVAL = 60
+BATCH_SIZE = 500
+
+
+def get_sync_interval():
+    return settings.LIMESURVEY.get('COMPLETION_SYNC_INTERVAL', COMPLETION_SYNC_INTERVAL)
+
+
+def _update_completed(queryset, completed_by_token):
+    """Update is_completed of the responses of queryset whose completion
+    changed, in batches
+    :param queryset: questionnaire responses of one survey
+    :param completed_by_token: dict with the 'completed' property by token id
+    """
+    changed = [
+        token_id for token_id, current in queryset.filter(
+            token_id__in=list(completed_by_token)).values_list('token_id', 'is_completed')
+        if current != completed_by_token[token_id]
+    ]
+    for start in range(0, len(changed), BATCH_SIZE):
+        batch = changed[start:start + BATCH_SIZE]
+        queryset.filter(token_id__in=batch).update(is_completed=Case(
+            *[When(token_id=token_id, then=Value(completed_by_token[token_id])) for token_id in batch],
+            output_field=CharField()))
+
+
+def store_completion(lime_survey_id, completed_by_token):
+    """Mirror the completion of the tokens of a survey and record the time
+    :param lime_survey_id: LimeSurvey survey id
+    :param completed_by_token: dict with the 'completed' property by token id
+    """
+    now = timezone.now()
+    survey_lookup = \
+        'data_configuration_tree__component_configuration__component__questionnaire__survey__lime_survey_id'
+    _update_completed(ExperimentQuestionnaireResponse.objects.filter(
+        **{survey_lookup: lime_survey_id}), completed_by_token)
+    _update_completed(PatientQuestionnaireResponse.objects.filter(
+        survey__lime_survey_id=lime_survey_id), completed_by_token)
+    Survey.objects.filter(lime_survey_id=lime_survey_id).update(completion_synced_at=now)
+
+
+class TokenCompletionMirror:
+    """Completion of the tokens of the surveys used by a request, each survey
+    synchronized with LimeSurvey at most once
+    """
+
+    def __init__(self, surveys, sync_interval=None):
+        """
+        :param surveys: Questionnaires or ConcurrentQuestionnaires
+        :param sync_interval: seconds after which the completion mirrored is
+        read again; LIMESURVEY['COMPLETION_SYNC_INTERVAL'] by default, 0 to
+        always read it, e.g. for exporting
+        """
+        self.surveys = surveys
+        self.sync_interval = get_sync_interval() if sync_interval is None else sync_interval
+        # Surveys checked by this mirror: dict of the completion by token id
+        # of the ones read now, {} for the ones read recently, None for the
+        # ones that could not be read
+        self.completion = {}
+        # Surveys read recently, whose responses hold the mirrored completion
+        self.recent = set()
+
+    def refresh(self, lime_survey_ids):
+        """Read the completion of the tokens of the surveys not read for
+        sync_interval, at the same time if surveys is ConcurrentQuestionnaires
+        :param lime_survey_ids: LimeSurvey survey ids
+        """
+        lime_survey_ids = [sid for sid in set(lime_survey_ids) if sid not in self.completion]
+        if not lime_survey_ids:
+            return
+
+        synced_after = timezone.now() - timedelta(seconds=self.sync_interval)
+        recent = set(Survey.objects.filter(
+            lime_survey_id__in=lime_survey_ids, completion_synced_at__gte=synced_after
+        ).values_list('lime_survey_id', flat=True)) if self.sync_interval > 0 else set()
+        for sid in recent:
+            self.completion[sid] = {}
+        self.recent.update(recent)
+
+        self._read([sid for sid in lime_survey_ids if sid not in recent])
+
+    def _read(self, lime_survey_ids):
+        if hasattr(self.surveys, 'gather'):
+            results = self.surveys.gather(('get_tokens_completed', sid) for sid in lime_survey_ids)
+        else:
+            results = [self.surveys.get_tokens_completed(sid) for sid in lime_survey_ids]
+        for sid, completed_by_token in zip(lime_survey_ids, results):
+            if completed_by_token is not None:
+                store_completion(sid, completed_by_token)
+            self.completion[sid] = completed_by_token
+
+    def failed(self, lime_survey_id):
+        """
+        :return: True if the completion of the tokens of the survey could not
+        be read from LimeSurvey
+        """
+        self.refresh([lime_survey_id])
+        return self.completion[lime_survey_id] is None
+
+    def completed(self, lime_survey_id, questionnaire_response):
+        """Completion of a response, updating is_completed of the instance
+        :param lime_survey_id: LimeSurvey id of the survey of the response
+        :param questionnaire_response: experiment or patient QuestionnaireResponse
+        :return: 'completed' property of the token of the response, None if
+        LimeSurvey is not available or the token is not in the survey
+        """
+        if self.failed(lime_survey_id):
+            completed = self.surveys.get_participant_properties(
+                lime_survey_id, questionnaire_response.token_id, 'completed')
+            if completed is not None and completed != questionnaire_response.is_completed:
+                questionnaire_response.is_completed = completed
+                questionnaire_response.save()
+            return completed
+
+        if lime_survey_id in self.recent:
+            return questionnaire_response.is_completed
+
+        completed = self.completion[lime_survey_id].get(questionnaire_response.token_id)
+        if completed is not None:
+            questionnaire_response.is_completed = completed
+
+        return completed
+
+    def token_completed(self, lime_survey_id, token_id):
+        """Completion of a token without its questionnaire response at hand
+        :param lime_survey_id: LimeSurvey id of the survey
+        :param token_id: token id
+        :return: 'completed' property of the token, None if LimeSurvey is not
+        available or the token is not in the survey
+        """
+        if lime_survey_id in self.recent:
+            # The completion read recently is only in the responses
+            self.recent.discard(lime_survey_id)
+            self._read([lime_survey_id])
+
+        if self.failed(lime_survey_id):
+            return self.surveys.get_participant_properties(lime_survey_id, token_id, 'completed')
+
+        return self.completion[lime_survey_id].get(token_id)
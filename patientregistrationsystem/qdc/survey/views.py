@@ -21,7 +21,8 @@ from django.utils.translation import ugettext as _
 
 from .models import Survey, SensitiveQuestion
 from .forms import SurveyForm
-from survey.abc_search_engine import Questionnaires
+from survey import survey_cache
+from survey.abc_search_engine import Questionnaires, ConcurrentQuestionnaires
 
 from experiment.models import ComponentConfiguration, QuestionnaireResponse, Questionnaire, Group, Block
 
@@ -49,50 +50,67 @@ class GroupOfQuestions:
     questionnaire_responses = []
 
 
-def get_survey_title_based_on_the_user_language(survey, language_code, update=False):
-
-    if not update:
-        # Get the titles in both languages and return the one compatible with the user's language,
-        # If the title is blank in that language, return it in the other language, and
-        # if that one is also blank, try to update the titles in each language
-        # if any of them updates isn't blank, recursively calls this function
-        # otherwise, try to get the title for this survey at LimeSurvey and return it
-        titles = {'pt-br': survey.pt_title, 'en': survey.en_title}
-        fallback_language = 'en' if language_code == 'pt-br' else 'pt-br'
-
-        if titles[language_code]:
-            return titles[language_code]
-        elif titles[fallback_language]:
-            return titles[fallback_language]
-
-    surveys = Questionnaires()
-    pt_title = surveys.get_survey_title(survey.lime_survey_id, 'pt-br')
-    en_title = surveys.get_survey_title(survey.lime_survey_id, 'en')
+def get_survey_title_from_database(survey, language_code):
+    """Get the title compatible with the user's language; if the title is
+    blank in that language, the one in the other language
+    :return: the title, or None if it is blank in both languages
+    """
+    titles = {'pt-br': survey.pt_title, 'en': survey.en_title}
+    fallback_language = 'en' if language_code == 'pt-br' else 'pt-br'
+
+    return titles[language_code] or titles[fallback_language] or None
+
+
+def get_survey_titles_based_on_the_user_language(survey_list, language_code, update=False, surveys=None):
+    """Get the titles of the surveys in the user's language. The titles not
+    stored in database (or all of them, if update) are searched at LimeSurvey,
+    where the title in the user's language is stored in database. If there
+    is none, the title in the survey base language is returned, or the
+    LimeSurvey id if that one is also blank.
+    The calls to LimeSurvey for the surveys are made at the same time.
+    :param survey_list: list of Survey
+    :param surveys: ConcurrentQuestionnaires instance
+    :return: list with the title of each survey
+    """
+    titles = [None if update else get_survey_title_from_database(survey, language_code) for survey in survey_list]
+    missing = [index for index, title in enumerate(titles) if title is None]
+    if not missing:
+        return titles
+
+    surveys = surveys or ConcurrentQuestionnaires()
+    limesurvey_titles = surveys.gather(
+        ('get_survey_title', survey_list[index].lime_survey_id, language)
+        for index in missing for language in ('pt-br', 'en')
+    )
+
+    without_title = []
+    for position, index in enumerate(missing):
+        survey = survey_list[index]
+        pt_title, en_title = limesurvey_titles[2 * position:2 * position + 2]
+        if language_code == 'pt-br' and pt_title:
+            survey.pt_title = pt_title
+            survey.save()
+            titles[index] = pt_title
+        elif language_code == 'en' and en_title:
+            survey.en_title = en_title
+            survey.save()
+            titles[index] = en_title
+        else:
+            without_title.append(index)
 
-    if language_code == 'pt-br' and pt_title:
-        surveys.release_session_key()
-        survey.pt_title = pt_title
-        survey.save()
-        return get_survey_title_based_on_the_user_language(survey, language_code)
-    elif language_code == 'en' and en_title:
-        surveys.release_session_key()
-        survey.en_title = en_title
-        survey.save()
-        return get_survey_title_based_on_the_user_language(survey, language_code)
-    else:
-        title = surveys.get_survey_title(survey.lime_survey_id)
-        surveys.release_session_key()
+    default_titles = surveys.gather(
+        ('get_survey_title', survey_list[index].lime_survey_id) for index in without_title
+    )
+    for index, title in zip(without_title, default_titles):
+        titles[index] = title or survey_list[index].lime_survey_id
 
-        if title:
-            return title
-        else:
-            return survey.lime_survey_id
+    return titles
 
 
 @login_required
 @permission_required('survey.view_survey')
 def survey_list(request, template_name='survey/survey_list.html'):
-    surveys = Questionnaires()
+    surveys = ConcurrentQuestionnaires()
     limesurvey_available_ = check_limesurvey_access(request, surveys)
 
     questionnaires_list = []
@@ -104,26 +122,22 @@ def survey_list(request, template_name='survey/survey_list.html'):
         if request.POST['action'] == "update":
             update = True
 
-    for survey in Survey.objects.all():
-        survey_title = get_survey_title_based_on_the_user_language(
-            survey, language_code, update)
-
-        # Get the status of the survey
-        # If there's any inactive survey, search LimeSurvey to see if
-        # there's any change in that matter and update the fields in the
-        # database
-        is_active = survey.is_active
-
-        if not is_active or update:
-            status = surveys.get_survey_properties(
-                survey.lime_survey_id, 'active')
-            if status == 'Y':
-                survey.is_active = True
-            else:
-                survey.is_active = False
-
-            survey.save()
+    survey_list_ = list(Survey.objects.all())
+    survey_titles = get_survey_titles_based_on_the_user_language(survey_list_, language_code, update, surveys)
+
+    # Get the status of the surveys
+    # If there's any inactive survey, search LimeSurvey to see if
+    # there's any change in that matter and update the fields in the
+    # database
+    surveys_to_check = [survey for survey in survey_list_ if not survey.is_active or update]
+    status_list = surveys.gather(
+        ('get_survey_properties', survey.lime_survey_id, 'active') for survey in surveys_to_check
+    )
+    for survey, status in zip(surveys_to_check, status_list):
+        survey.is_active = status == 'Y'
+        survey.save()
 
+    for survey, survey_title in zip(survey_list_, survey_titles):
         questionnaires_list.append(
             {
                 'id': survey.id,
@@ -212,6 +226,9 @@ def survey_update(request, survey_id, template_name="survey/survey_register.html
 
     if request.method == "POST":
         if request.POST['action'] == "save":
+            # Drop what is cached from LimeSurvey, so the survey is read
+            # again as it is now there
+            survey_cache.invalidate_survey(survey.lime_survey_id)
             if survey_form.is_valid():
                 if survey_form.has_changed():
                     survey_form.save()
@@ -334,50 +351,13 @@ def get_survey_header(surveys, survey, language, heading_type):
     :param heading_type: 'code' or 'full'
     :return:
     """
-    result = []
-    responses_text = surveys.get_responses(
-        survey.lime_survey_id, language, heading_type=heading_type)
-    header_fields = next(reader(StringIO(responses_text), delimiter=','))
-    for field in header_fields:
-        result.append(field)
-    return result
-
-
-def create_list_of_trees(block_id, component_type, numeration=''):
-
-    list_of_path = []
-
-    configurations = ComponentConfiguration.objects.filter(parent_id=block_id).order_by('order')
-
-    counter = 1
-    for configuration in configurations:
-
-        sub_numeration = (numeration + '.' if numeration else '') + str(counter)
-
-        if not component_type or configuration.component.component_type == component_type:
-            list_of_path.append(
-                [[configuration.id,
-                  configuration.parent.identification,
-                  configuration.name,
-                  configuration.component.identification,
-                  sub_numeration]]
-            )
-
-        # Look for steps in descendant blocks
-        if configuration.component.component_type == "block":
-            list_of_configurations = create_list_of_trees(configuration.component.id, component_type, sub_numeration)
-            for item in list_of_configurations:
-                item.insert(0,
-                            [configuration.id,
-                             configuration.parent.identification,
-                             configuration.name,
-                             configuration.component.identification,
-                             sub_numeration])
-                list_of_path.append(item)
-
-        counter += 1
+    def load():
+        # Only the header is decoded
+        return next(surveys.get_responses_rows(
+            survey.lime_survey_id, language, heading_type=heading_type))
 
-    return list_of_path
+    return list(survey_cache.get_or_load(
+        survey_cache.make_key(surveys, survey.lime_survey_id, 'header', language, heading_type), load))
 
 
 def recursively_create_list_of_steps(block_id, component_type, list_of_configurations):
@@ -595,6 +575,7 @@ def create_patients_questionnaire_data_list(survey, surveys):
 @permission_required('survey.view_survey')
 def update_survey_acquisitiondate_view(request, survey_id):
     survey = get_object_or_404(Survey, pk=survey_id)
+    survey_cache.invalidate_survey(survey.lime_survey_id)
     ls = Questionnaires()
     languages = ls.get_survey_languages(survey.lime_survey_id)
     tokens = ls.find_tokens_by_questionnaire(survey.lime_survey_id)
@@ -603,7 +584,8 @@ def update_survey_acquisitiondate_view(request, survey_id):
     nes_responses = get_responses(survey)
     responses_updated = []
     for lang in [default_language, additional_language]:
-        ls_responses = ls.get_responses(survey.lime_survey_id, lang)
+        ls_responses = ls.get_responses_rows(
+            survey.lime_survey_id, lang, columns=['token', 'acquisitiondate'])
         responses_updated.append(
             update_acquisitiondate(tokens, ls_responses, nes_responses))
         responses_updated = flatten(responses_updated)
@@ -629,33 +611,48 @@ def update_acquisitiondate(tokens, ls_responses, nes_responses):
     """Acquisition date from LimeSurvey may be in wrong format. So add a try
     block.
     :param tokens: list. Tokens from LimeSurvey
-    :param ls_responses: string. Responses from LimeSurvey in csv format
+    :param ls_responses: responses from LimeSurvey: string in csv format or
+    iterable of csv rows, header first (see Questionnaires.get_responses_rows)
     :param nes_responses: list of querysets from experiment responses and
     entrance questionnaire responses
     :return: list of responses with acquisitiondate updated
     """
-    ls_responses = csv_to_list(ls_responses)
+    if ls_responses is None:
+        return []
+    if isinstance(ls_responses, str):
+        ls_responses = reader(StringIO(ls_responses), delimiter=',')
+    ls_responses = iter(ls_responses)
+
+    token_by_id = {}
+    for item in tokens:
+        token_by_id.setdefault(item['tid'], item['token'])
+    nes_tokens = {token_by_id.get(response.token_id) for response in nes_responses}
+
+    # Acquisition date of the first response of each token of NES responses
+    acquisitiondates = {}
+    header = next(ls_responses, [])
+    if 'token' in header and 'acquisitiondate' in header:
+        token_index = header.index('token')
+        acquisitiondate_index = header.index('acquisitiondate')
+        for row in ls_responses:
+            if row and row[token_index] in nes_tokens:
+                acquisitiondates.setdefault(row[token_index], row[acquisitiondate_index])
+
     responses_updated = []
     for response in nes_responses:
-        token = next((
-            item['token'] for item in tokens
-            if item['tid'] == response.token_id), None)
-        if token is not None:
-            ls_response = next((
-                ls_response for ls_response in ls_responses
-                if ls_response['token'] == token), None)
-            if ls_response is not None:
-                try:
-                    new_date = datetime.datetime.strptime(
-                            ls_response['acquisitiondate'],
-                            '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    continue
-                new_date = new_date.date()
-                if response.date != new_date:
-                    response.date = new_date
-                    responses_updated.append(response)
-                response.save()
+        token = token_by_id.get(response.token_id)
+        if token in acquisitiondates:
+            try:
+                new_date = datetime.datetime.strptime(
+                        acquisitiondates[token],
+                        '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                continue
+            new_date = new_date.date()
+            if response.date != new_date:
+                response.date = new_date
+                responses_updated.append(response)
+            response.save()
 
     return responses_updated
 
@@ -751,10 +748,9 @@ def get_questionnaire_responses(language_code, lime_survey_id, token_id, request
     token = surveys.get_participant_properties(
         lime_survey_id, token_id, 'token')
     question_properties = []
-    groups = surveys.list_groups(lime_survey_id)
 
     # defining language to be showed
-    languages = surveys.get_survey_languages(lime_survey_id)
+    languages = survey_cache.get_survey_languages(surveys, lime_survey_id)
 
     # language to be showed can be the base language, or...
     language = languages['language']
@@ -772,17 +768,17 @@ def get_questionnaire_responses(language_code, lime_survey_id, token_id, request
             index = additional_languages_list_lower.index(language_code.lower())
             language = additional_languages_list[index]
 
-    survey_title = surveys.get_survey_title(lime_survey_id, language)
+    survey_title = survey_cache.get_survey_title(surveys, lime_survey_id, language)
+
+    survey_structure = survey_cache.get_survey_structure(surveys, lime_survey_id, language)
 
-    if not isinstance(groups, dict):
-        for group in groups:
-            if 'id' in group and group['id']['language'] == language:
-                question_list = surveys.list_questions_ids(
-                    lime_survey_id, group['id']['gid']
-                )
-                question_list = sorted(question_list)
+    if survey_structure is not None:
+        for group in survey_structure.groups:
+            if 'id' in group:
+                question_list = survey_structure.group_question_ids(group['id']['gid'])
                 for question in question_list:
-                    properties = surveys.get_question_properties(question, group['id']['language'])
+                    # copy, as the question field is cleaned below
+                    properties = dict(survey_structure.get_question_properties(question))
 
                     # cleaning the question field
                     properties['question'] = re.sub(